@@ -0,0 +1,58 @@
+"""
+    Micro-benchmark of the per-request cost of getting AWS clients.
+
+    Compares building a fresh boto3 resource/client on every call, as
+    S3Service and SESService used to do, with fetching the shared clients
+    from the process-wide registry. No requests are sent to AWS.
+
+        PYTHONPATH=. python benchmarks/bench_boto_clients.py --iterations 200
+"""
+import argparse
+import os
+import statistics
+import time
+
+import boto3
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+from src.services.aws_utils import ClientRegistry
+
+
+def per_call(iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        # a logo delete used to build two resources, an invite one ses client
+        boto3.resource("s3")
+        boto3.resource("s3")
+        boto3.client("ses")
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def shared(iterations: int) -> list:
+    registry = ClientRegistry()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        registry.get_client("s3")
+        registry.get_client("s3")
+        registry.get_client("ses")
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings = sorted(timings)
+    print(f"{name:>10}: mean={statistics.mean(timings) * 1000:.3f} ms "
+          f"p50={timings[len(timings) // 2] * 1000:.3f} ms "
+          f"p99={timings[min(len(timings) - 1, int(0.99 * len(timings)))] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    report("per call", per_call(args.iterations))
+    report("registry", shared(args.iterations))
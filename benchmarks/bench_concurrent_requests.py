@@ -0,0 +1,77 @@
+"""
+    Load benchmark measuring throughput of concurrent authenticated requests
+    against a running instance of the app.
+
+    Start the app (uvicorn src.main:app --port 8000) on the commit you want to
+    measure, then run:
+
+        python benchmarks/bench_concurrent_requests.py --url http://localhost:8000
+
+    Run it once on the commit before the async database layer and once after
+    to compare requests per second and latency percentiles.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+async def sign_up_and_login(client: httpx.AsyncClient) -> str:
+    username = uuid.uuid4().hex[:10]
+    await client.post("/auth", data={"username": username,
+                                     "full_name": "Benchmark User",
+                                     "email": f"{username}@bench.com",
+                                     "password": "benchmark"})
+    response = await client.post("/login", data={"username": username,
+                                                 "password": "benchmark"})
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"bearer {token}"}
+    # give the user something to read back
+    for i in range(5):
+        await client.post("/projects",
+                          json={"name": f"Project {i}", "description": "benchmark"},
+                          headers=headers)
+    return token
+
+
+async def worker(client: httpx.AsyncClient, path: str, headers: dict,
+                 deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+async def run(url: str, path: str, concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        token = await sign_up_and_login(client)
+        headers = {"Authorization": f"bearer {token}"}
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client, path, headers, deadline, latencies, errors)
+                               for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"path={path} concurrency={concurrency} duration={elapsed:.1f}s")
+    print(f"requests={len(latencies)} errors={len(errors)} throughput={len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms: mean={statistics.mean(latencies) * 1000:.1f} "
+          f"p50={percentile(0.50):.1f} p95={percentile(0.95):.1f} p99={percentile(0.99):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/projects")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=15)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.path, args.concurrency, args.duration))
@@ -0,0 +1,59 @@
+"""
+    Offline benchmark of the local storage backend.
+
+    Writes files through LocalStorage.upload_file (temp file, fsync and
+    rename) and reads them back in download chunks, once through the
+    memory-mapped stream used for responses and once with plain buffered
+    reads for comparison. Needs no AWS account.
+
+        PYTHONPATH=. python benchmarks/bench_local_storage.py --files 50 --size-mb 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from src.services.documents_utils import DOWNLOAD_CHUNK_SIZE
+from src.services.local_storage import LocalStorage
+
+
+def plain_read(path: str) -> int:
+    total = 0
+    with open(path, "rb") as file:
+        while chunk := file.read(DOWNLOAD_CHUNK_SIZE):
+            total += len(chunk)
+    return total
+
+
+def mmap_read(storage: LocalStorage, key: str) -> int:
+    return sum(len(chunk) for chunk in storage.stream_file(key).iter_chunks())
+
+
+def report(name: str, seconds: float, total_bytes: int, files: int):
+    print(f"{name:>8}: {total_bytes / seconds / 1024 / 1024:8.1f} MB/s "
+          f"{files / seconds:8.1f} files/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--root", default=None, help="directory to write to, a temporary one by default")
+    args = parser.parse_args()
+    content = os.urandom(int(args.size_mb * 1024 * 1024))
+    keys = [f"bench-{i}" for i in range(args.files)]
+    total_bytes = len(content) * args.files
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        storage = LocalStorage(root)
+        start = time.perf_counter()
+        for key in keys:
+            storage.upload_file(key, content, "application/octet-stream")
+        report("write", time.perf_counter() - start, total_bytes, args.files)
+        # files are in the page cache now, both readers start warm
+        start = time.perf_counter()
+        assert sum(plain_read(os.path.join(root, key)) for key in keys) == total_bytes
+        report("read", time.perf_counter() - start, total_bytes, args.files)
+        start = time.perf_counter()
+        assert sum(mmap_read(storage, key) for key in keys) == total_bytes
+        report("mmap", time.perf_counter() - start, total_bytes, args.files)
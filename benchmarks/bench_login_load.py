@@ -0,0 +1,83 @@
+"""
+    Login throughput benchmark against a running instance of the app.
+
+    Runs concurrent login loops and, at the same time, a single client
+    polling a cheap endpoint. The latency of that endpoint is reported once
+    without and once with the login load, which shows whether password
+    hashing stalls the rest of the worker.
+
+        uvicorn src.main:app --port 8000
+        python benchmarks/bench_login_load.py --url http://localhost:8000 --logins 16
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+async def sign_up(client: httpx.AsyncClient) -> tuple[str, str]:
+    username = uuid.uuid4().hex[:10]
+    await client.post("/auth", data={"username": username,
+                                     "full_name": "Benchmark User",
+                                     "email": f"{username}@bench.com",
+                                     "password": "benchmark"})
+    response = await client.post("/login", data={"username": username,
+                                                 "password": "benchmark"})
+    return username, response.json()["access_token"]
+
+
+async def login_loop(client: httpx.AsyncClient, username: str, deadline: float, logins: list):
+    while time.perf_counter() < deadline:
+        response = await client.post("/login", data={"username": username,
+                                                     "password": "benchmark"})
+        logins.append(response.status_code)
+
+
+async def probe(client: httpx.AsyncClient, path: str, headers: dict, deadline: float) -> list:
+    latencies = []
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: list):
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{name}: requests={len(latencies)} mean={statistics.mean(latencies) * 1000:.1f} ms "
+          f"p50={percentile(0.50):.1f} ms p99={percentile(0.99):.1f} ms")
+
+
+async def run(url: str, path: str, logins: int, duration: float):
+    limits = httpx.Limits(max_connections=logins + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        username, token = await sign_up(client)
+        headers = {"Authorization": f"bearer {token}"}
+        idle = await probe(client, path, headers, time.perf_counter() + duration)
+        login_statuses = []
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        loaded, *_ = await asyncio.gather(probe(client, path, headers, deadline),
+                                          *[login_loop(client, username, deadline, login_statuses)
+                                            for _ in range(logins)])
+        elapsed = time.perf_counter() - started
+    report(f"{path} idle", idle)
+    report(f"{path} under login load", loaded)
+    rejected = sum(1 for code in login_statuses if code == 503)
+    print(f"logins={len(login_statuses)} rejected={rejected} "
+          f"throughput={len(login_statuses) / elapsed:.1f} logins/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/projects")
+    parser.add_argument("--logins", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.path, args.logins, args.duration))
@@ -0,0 +1,109 @@
+"""
+    Benchmark of the logo resize Lambda's handler, without S3.
+
+    Runs resize_record from logo-resize/lambda_function.py for every image
+    of a corpus directory on a thread pool, as lambda_handler does for the
+    records of one event. S3 is replaced by an in-memory client, so the
+    time is spent decoding, resizing and encoding every rendition. Reports
+    logos and renditions per second and the peak RSS of the process.
+    --baseline runs the handler from before renditions: one full size
+    decode and a default filter resample to a single 400x400 image.
+    Without --corpus a set of synthetic JPEG and PNG logos is generated.
+    Run each configuration in its own process, the peak RSS is per process.
+
+        PYTHONPATH=. python benchmarks/bench_logo_resize.py --corpus ./logos --workers 8
+        PYTHONPATH=. python benchmarks/bench_logo_resize.py --baseline --workers 1
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import resource
+import sys
+import time
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "logo-resize"))
+from PIL import Image
+import lambda_function
+from lambda_function import LOGO_SIZE, RAW_BUCKET, resize_record
+
+
+class MemoryS3():
+    """
+        Stands in for the boto3 client used by the handler. Raw logos are
+        kept in memory and written objects are counted, not stored.
+    """
+    def __init__(self, corpus: list) -> None:
+        self.objects = {f"logo-{i}.{'png' if file_type == 'PNG' else 'jpg'}": (content, f"image/{file_type.lower()}")
+                        for i, (content, file_type) in enumerate(corpus)}
+        self.puts = 0
+
+    def get_object(self, Bucket, Key):
+        content, content_type = self.objects[Key]
+        return {"ContentType": content_type, "Body": io.BytesIO(content)}
+
+    def put_object(self, **kwargs):
+        self.puts += 1
+
+
+def synthetic_corpus(count: int) -> list:
+    corpus = []
+    for i in range(count):
+        image = Image.effect_mandelbrot((2400, 1800), (-2, -1.5, 1, 1.5), 50 + i).convert("RGB")
+        file_type = "JPEG" if i % 2 == 0 else "PNG"
+        output = io.BytesIO()
+        image.save(output, format=file_type)
+        corpus.append((output.getvalue(), file_type))
+    return corpus
+
+
+def load_corpus(directory: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        file_type = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}.get(os.path.splitext(name)[1].lower())
+        if file_type is not None:
+            with open(os.path.join(directory, name), "rb") as image:
+                corpus.append((image.read(), file_type))
+    return corpus
+
+
+def baseline_record(record):
+    key = record['s3']['object']['key']
+    image_obj = lambda_function.s3_client.get_object(Bucket=RAW_BUCKET, Key=key)
+    with Image.open(io.BytesIO(image_obj['Body'].read())) as image:
+        # the old handler picked the format from the content type
+        file_type = "PNG" if image_obj['ContentType'] == "image/png" else "JPEG"
+        image = image.resize(LOGO_SIZE)
+        output = io.BytesIO()
+        image.save(output, format=file_type)
+    lambda_function.s3_client.put_object(Bucket="resized", Key=key, Body=output.getvalue())
+    return key
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=None, help="directory with .jpg/.jpeg/.png logos")
+    parser.add_argument("--synthetic", type=int, default=24, help="images generated without --corpus")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--baseline", action="store_true")
+    args = parser.parse_args()
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic)
+    s3 = MemoryS3(corpus)
+    lambda_function.s3_client = s3
+    records = [{"s3": {"bucket": {"name": RAW_BUCKET}, "object": {"key": key}}} for key in s3.objects]
+    process = baseline_record if args.baseline else resize_record
+    corpus_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            list(pool.map(process, records))
+        elapsed = time.perf_counter() - start
+    logos = len(records) * args.rounds
+    # ru_maxrss is in kilobytes on linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{'baseline' if args.baseline else 'renditions'} workers={args.workers}: "
+          f"{logos / elapsed:.1f} logos/s, {s3.puts / elapsed:.1f} objects written/s, "
+          f"peak RSS {peak_rss_mb:.0f} MB ({corpus_rss_mb:.0f} MB after loading the corpus)")
@@ -17,6 +17,7 @@ CREATE TABLE projects(
 	updated_by varchar(10),
 	updated_on timestamp,
 	logo varchar(300),
+	logo_updated_on timestamp,
 	FOREIGN KEY (created_by) REFERENCES users(username)
 	);
 
@@ -26,12 +27,20 @@ CREATE TABLE documents(
 	project_id integer NOT NULL, 
 	added_by varchar(10) NOT NULL,
 	content_type varchar(50) NOT NULL,
-	s3_key varchar(36) UNIQUE,
+	s3_key varchar(64),
 	added_on timestamp NOT NULL,
 	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
 	FOREIGN KEY (added_by) REFERENCES users(username)
 );
 
+-- documents with identical content share the file stored under its sha256
+CREATE INDEX documents_s3_key_idx ON documents(s3_key);
+
+CREATE TABLE blobs(
+	key varchar(64) PRIMARY KEY,
+	ref_count integer NOT NULL
+);
+
 CREATE TYPE role AS ENUM('owner', 'participant');
 
 CREATE TABLE project_access(
@@ -42,4 +51,26 @@ CREATE TABLE project_access(
 	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
 	FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE,
 	PRIMARY KEY (project_id, username)
-);
\ No newline at end of file
+);
+
+-- lookups of a user's projects filter project_access by username alone
+CREATE INDEX project_access_username_idx ON project_access(username);
+
+CREATE TABLE email_outbox(
+	id SERIAL PRIMARY KEY,
+	project_id integer NOT NULL,
+	to_address varchar(50) NOT NULL,
+	subject varchar(200) NOT NULL,
+	body text NOT NULL,
+	status varchar(10) NOT NULL DEFAULT 'queued',
+	attempts integer NOT NULL DEFAULT 0,
+	next_attempt_at timestamp NOT NULL,
+	created_on timestamp DEFAULT NOW(),
+	sent_on timestamp,
+	message_id varchar(100),
+	last_error varchar(500),
+	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+);
+
+-- the email dispatcher polls for queued rows that are due
+CREATE INDEX email_outbox_due_idx ON email_outbox(status, next_attempt_at);
\ No newline at end of file
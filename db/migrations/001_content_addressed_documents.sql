@@ -0,0 +1,26 @@
+-- Upgrades a database created from an earlier create_db.sql to store
+-- documents by content hash. New installations get this from create_db.sql.
+-- Run once before deploying the new version:
+--   psql -U <user> -f db/migrations/001_content_addressed_documents.sql
+\c project_manager;
+
+BEGIN;
+
+-- sha256 keys are 64 characters and shared by documents with equal content
+ALTER TABLE documents ALTER COLUMN s3_key TYPE varchar(64);
+ALTER TABLE documents DROP CONSTRAINT IF EXISTS documents_s3_key_key;
+CREATE INDEX IF NOT EXISTS documents_s3_key_idx ON documents(s3_key);
+
+CREATE TABLE IF NOT EXISTS blobs(
+	key varchar(64) PRIMARY KEY,
+	ref_count integer NOT NULL
+);
+
+-- every existing document holds one reference to its file
+INSERT INTO blobs(key, ref_count)
+SELECT s3_key, count(*) FROM documents
+WHERE s3_key IS NOT NULL
+GROUP BY s3_key
+ON CONFLICT (key) DO NOTHING;
+
+COMMIT;
\ No newline at end of file
@@ -0,0 +1,16 @@
+-- Adds the time a project's logo was last uploaded. Cached logos are
+-- versioned by it, so editing a project doesn't keep its logo out of the
+-- cache. Run once before deploying the new version:
+--   psql -U <user> -f db/migrations/002_logo_updated_on.sql
+\c project_manager;
+
+BEGIN;
+
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS logo_updated_on timestamp;
+
+-- the real upload time isn't known. Existing logos were resized long ago,
+-- so any earlier time is safe and keeps them cacheable
+UPDATE projects SET logo_updated_on = created_on
+WHERE logo IS NOT NULL AND logo_updated_on IS NULL;
+
+COMMIT;
\ No newline at end of file
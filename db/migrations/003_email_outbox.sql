@@ -0,0 +1,31 @@
+-- Adds the email outbox drained by the email dispatcher, and the index
+-- used to look up a user's projects. Run once before deploying the new
+-- version:
+--   psql -U <user> -f db/migrations/003_email_outbox.sql
+\c project_manager;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS email_outbox(
+	id SERIAL PRIMARY KEY,
+	project_id integer NOT NULL,
+	to_address varchar(50) NOT NULL,
+	subject varchar(200) NOT NULL,
+	body text NOT NULL,
+	status varchar(10) NOT NULL DEFAULT 'queued',
+	attempts integer NOT NULL DEFAULT 0,
+	next_attempt_at timestamp NOT NULL,
+	created_on timestamp DEFAULT NOW(),
+	sent_on timestamp,
+	message_id varchar(100),
+	last_error varchar(500),
+	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+);
+
+-- the email dispatcher polls for queued rows that are due
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx ON email_outbox(status, next_attempt_at);
+
+-- lookups of a user's projects filter project_access by username alone
+CREATE INDEX IF NOT EXISTS project_access_username_idx ON project_access(username);
+
+COMMIT;
\ No newline at end of file
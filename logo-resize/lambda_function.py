@@ -1,35 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from urllib.parse import unquote_plus
 import boto3
-from PIL import Image
-import io
+from botocore.config import Config
+# shipped in the zip next to this file, the app's LogoResizeWorker renders
+# logos with the same code
+from src.services.logo_render import FALLBACK_FORMAT, create_renditions, rendition_key, writable_formats
 
-s3_client = boto3.client('s3')
+RAW_BUCKET = os.environ.get('RAW_LOGO_BUCKET', 'logos-raw')
+PROCESSED_BUCKET = os.environ.get('RESIZED_LOGO_BUCKET', 'logos-processed')
+LOGO_SIZE = (400, 400)
+# smaller sizes and modern formats are written next to the resized logo, see
+# src/services/logo_renditions.py for how the app picks one
+RENDITION_SIZES = sorted({int(size) for size in os.environ.get('LOGO_RENDITION_SIZES', '64,128,400').split(',')}
+                         | {LOGO_SIZE[0]}, reverse=True)
+RENDITION_FORMATS = writable_formats(os.environ.get('LOGO_RENDITION_FORMATS', 'webp').split(','))
+# records of one event are resized in parallel, decoding and resampling
+# release the GIL so threads also use more than one core
+MAX_WORKERS = int(os.environ.get('LOGO_RESIZE_WORKERS', 8))
 
-def resize_image(image_bytes, image_filetype):
-    with Image.open(image_bytes) as image:
-        image = image.resize((400, 400))
-        output = io.BytesIO()
-        image.save(output, format=image_filetype)
-        output.seek(0)
-        return output
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+# client and pool are created once per container and reused by warm starts
+s3_client = boto3.client('s3', config=Config(max_pool_connections=MAX_WORKERS))
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-def get_pil_format(image_object):
-    image_filetype = image_object['ContentType']
-    pil_format = 'JPEG'
-    if image_filetype[6:] == 'png':
-        pil_format = 'PNG'
-    return pil_format
+
+def resize_record(record):
+    # keys in event notifications are url encoded
+    key = unquote_plus(record['s3']['object']['key'])
+    # get raw image, resize and upload to processed bucket
+    image_obj = s3_client.get_object(Bucket=RAW_BUCKET, Key=key)
+    renditions = create_renditions(image_obj['Body'].read(), RENDITION_SIZES, RENDITION_FORMATS)
+    for (size, rendition_format), output in renditions.items():
+        content_type = image_obj['ContentType'] if rendition_format == FALLBACK_FORMAT else f"image/{rendition_format}"
+        s3_client.put_object(Bucket=PROCESSED_BUCKET,
+                             Key=rendition_key(key, size, rendition_format),
+                             Body=output,
+                             ContentType=content_type)
+    # the resized logo under the logo's own key is written last, the app
+    # reads it when a rendition is missing and for presigned downloads
+    s3_client.put_object(Bucket=PROCESSED_BUCKET,
+                         Key=key,
+                         Body=renditions[(LOGO_SIZE[0], FALLBACK_FORMAT)],
+                         ContentType=image_obj['ContentType'])
+    return key
 
 
 def lambda_handler(event, context):
-    # get bucket name and file key from the event object
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
-    
-    if bucket_name == 'logos-raw':
-        new_bucket_name = 'logos-processed'
-        # get raw image, resize and upload to processed bucket
-        image_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
-        image_bytes = io.BytesIO(image_obj['Body'].read())
-        file_type = get_pil_format(image_obj)
-        resized_image = resize_image(image_bytes, file_type)
-        s3_client.upload_fileobj(resized_image, new_bucket_name, key)
+    # s3 may deliver several uploads in one event, all of them are resized
+    records = [record for record in event.get('Records', [])
+               if record['s3']['bucket']['name'] == RAW_BUCKET]
+    futures = [executor.submit(resize_record, record) for record in records]
+    failed = []
+    for record, future in zip(records, futures):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to resize {record['s3']['object']['key']}: {error}")
+            failed.append(record['s3']['object']['key'])
+    if failed:
+        # the event is retried; resizing the other logos again is harmless
+        raise RuntimeError(f"Failed to resize {len(failed)} of {len(records)} logos: {failed}")
+    return {'resized': len(records)}
@@ -1,19 +1,155 @@
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import create_engine
+from threading import Lock
+import time
+from fastapi import Request
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import os
+from src.services import request_timing
 from src.services.project_manager_tables import Base
 
+# async drivers used in place of the blocking ones from DB_CONNECTION_STRING
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg",
+                 "postgresql+psycopg2": "postgresql+asyncpg",
+                 "sqlite": "sqlite+aiosqlite",
+                 "sqlite+pysqlite": "sqlite+aiosqlite"}
+
+# session factories shared by the whole process, bound once DbConnector
+# creates the engines
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, class_=AsyncSession)
+
 def get_db():
-    db_conn = DbConnector()
-    engine = db_conn.engine
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    DbConnector()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+
+async def get_async_db(request: Request):
+    # reuse the session the auth middleware opened for this request
+    db = getattr(request.state, "db", None)
+    if db is not None:
+        yield db
+    else:
+        async with get_async_session() as db:
+            yield db
+
+
+def get_async_database_url(sync_url: str):
+    url = make_url(sync_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value in ["True", "1", "true"]
+
+
+def get_pool_settings(url) -> dict:
+    # sqlite uses single-connection pools that don't take these arguments
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {"pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+            "pool_pre_ping": env_flag("DB_POOL_PRE_PING", True)}
+
+
+def get_statement_timeout_args(url) -> dict:
+    timeout_ms = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+    url = make_url(url)
+    if timeout_ms <= 0 or url.get_backend_name() != "postgresql":
+        return {}
+    if url.get_driver_name() == "asyncpg":
+        return {"server_settings": {"statement_timeout": str(timeout_ms)}}
+    return {"options": f"-c statement_timeout={timeout_ms}"}
+
+
+class PoolMetrics():
+    """
+        Counters describing how request handling uses the connection pool,
+        used to size DB_POOL_SIZE/DB_MAX_OVERFLOW for the number of workers.
+    """
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.pool = None
+        self.connections_created = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.invalidated = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connections_created += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.invalidated += 1
+
+    def listen(self, pool) -> None:
+        self.pool = pool
+        event.listen(pool, "connect", self.on_connect)
+        event.listen(pool, "checkout", self.on_checkout)
+        event.listen(pool, "checkin", self.on_checkin)
+        event.listen(pool, "invalidate", self.on_invalidate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"connections_created": self.connections_created,
+                     "checkouts": self.checkouts,
+                     "checked_out": self.checked_out,
+                     "max_checked_out": self.max_checked_out,
+                     "invalidated": self.invalidated,
+                     "avg_wait_ms": (self.total_wait_seconds / self.checkouts * 1000
+                                     if self.checkouts else 0.0),
+                     "max_wait_ms": self.max_wait_seconds * 1000}
+        if self.pool is not None:
+            stats["pool_status"] = self.pool.status()
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+        Queue pool that records how long each checkout waits for a
+        connection, including time spent opening a new one.
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+
 class DbConnector():
     initialized = False
     def __new__(cls):
@@ -26,11 +162,28 @@ class DbConnector():
             load_dotenv()
             SQLALCHEMY_DATABASE_URL = os.getenv("DB_CONNECTION_STRING")
             self.engine = create_engine(
-                SQLALCHEMY_DATABASE_URL)
+                SQLALCHEMY_DATABASE_URL,
+                connect_args=get_statement_timeout_args(SQLALCHEMY_DATABASE_URL),
+                **get_pool_settings(SQLALCHEMY_DATABASE_URL))
             Base.metadata.create_all(bind=self.engine)
+            ASYNC_DATABASE_URL = os.getenv("ASYNC_DB_CONNECTION_STRING",
+                                           get_async_database_url(SQLALCHEMY_DATABASE_URL))
+            async_pool_settings = get_pool_settings(ASYNC_DATABASE_URL)
+            if async_pool_settings:
+                async_pool_settings["poolclass"] = MeteredAsyncAdaptedQueuePool
+            self.async_engine = create_async_engine(
+                ASYNC_DATABASE_URL,
+                connect_args=get_statement_timeout_args(ASYNC_DATABASE_URL),
+                **async_pool_settings)
+            pool_metrics.listen(self.async_engine.sync_engine.pool)
+            # per request database time for the access log
+            request_timing.listen(self.engine)
+            request_timing.listen(self.async_engine.sync_engine)
+            SessionLocal.configure(bind=self.engine)
+            AsyncSessionLocal.configure(bind=self.async_engine)
             self.initialized = True
 
 
-def get_session():
-    db_conn = DbConnector()
-    return Session(bind=db_conn.engine, autocommit=False, autoflush=False)
\ No newline at end of file
+def get_async_session() -> AsyncSession:
+    DbConnector()
+    return AsyncSessionLocal()
@@ -1,18 +1,71 @@
-
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import queue
+from threading import Lock
 from dotenv import load_dotenv
 import os
 
-def get_logger(name: str):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    # setting the log file
-    load_dotenv()
+load_dotenv()
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# access records are JSON lines, they are written without the text prefix
+ACCESS_LOGGER = "access"
+# every logger puts its records on one queue, a single listener thread
+# writes them to the file, so logging never waits for the disk
+_lock = Lock()
+_queue_handler = None
+_listener = None
+
+class FileFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        if record.name == ACCESS_LOGGER:
+            return record.getMessage()
+        return super().format(record)
+
+def create_file_handler() -> logging.Handler:
     LOG_FILE = os.getenv("LOG_FILE_PATH")
-    f_handler = logging.FileHandler(LOG_FILE)
+    max_mb = float(os.getenv("LOG_MAX_MB", 0))
+    rotate_when = os.getenv("LOG_ROTATE_WHEN")
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", 5))
+    # rotation by size takes precedence over rotation by time
+    if max_mb > 0:
+        f_handler = RotatingFileHandler(LOG_FILE,
+                                        maxBytes=int(max_mb * 1024 * 1024),
+                                        backupCount=backup_count)
+    elif rotate_when:
+        f_handler = TimedRotatingFileHandler(LOG_FILE,
+                                             when=rotate_when,
+                                             backupCount=backup_count)
+    else:
+        f_handler = logging.FileHandler(LOG_FILE)
     f_handler.setLevel(logging.INFO)  # set log level to INFO
     # setting the format of logs
-    f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    f_handler.setFormatter(f_format)
-    logger.addHandler(f_handler)
-    return logger
\ No newline at end of file
+    f_handler.setFormatter(FileFormatter(LOG_FORMAT))
+    return f_handler
+
+def get_queue_handler() -> QueueHandler:
+    global _queue_handler, _listener
+    with _lock:
+        if _queue_handler is None:
+            log_queue = queue.SimpleQueue()
+            _listener = QueueListener(log_queue, create_file_handler(), respect_handler_level=True)
+            _listener.start()
+            # records still queued at exit are written before the file closes
+            atexit.register(_listener.stop)
+            _queue_handler = QueueHandler(log_queue)
+        return _queue_handler
+
+def get_logger(name: str):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    # loggers are shared by name, the handler is only added the first time
+    q_handler = get_queue_handler()
+    if q_handler not in logger.handlers:
+        logger.addHandler(q_handler)
+    return logger
+
+def get_access_logger():
+    logger = get_logger(ACCESS_LOGGER)
+    # handlers of the root logger (uvicorn's console) would add their own prefix
+    logger.propagate = False
+    return logger
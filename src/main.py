@@ -1,26 +1,54 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from starlette import status
 from jose import JWTError, jwt
-from src.dependecies import get_session
-from src.services.auth_utils import get_user
-from src.services.db_project_handler import DbProjectHandler
+from src.dependecies import env_flag, get_async_session
+from src.logs.logger import get_access_logger
+from src.services.auth_utils import privilege_cache, token_cache, token_digest
+from src.services.async_db_project_handler import AsyncDbProjectHandler
+from src.services.email_outbox import email_dispatcher
+from src.services.logo_resize_worker import logo_resize_worker
+from src.services.project_manager_tables import Users
+from src.services.request_timing import RequestTimings, access_record, add_time, request_timings
 from .routers.project import projects
 from .routers.auth import auth
 from dotenv import load_dotenv
+import json
 import os
-from datetime import datetime, timezone
+import time
 from .routers.documents import documents
 from .routers.join import join
+from .routers.metrics import metrics
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # queued emails are sent by a background task of each worker process
+    dispatch_emails = env_flag("EMAIL_DISPATCHER_ENABLED", True)
+    if dispatch_emails:
+        email_dispatcher.start()
+    # logos are resized by the lambda unless the in-process worker is enabled
+    resize_logos = env_flag("LOGO_RESIZE_WORKER_ENABLED", False)
+    if resize_logos:
+        logo_resize_worker.start()
+    yield
+    if dispatch_emails:
+        await email_dispatcher.stop()
+    if resize_logos:
+        await logo_resize_worker.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(projects.project_router)
 app.include_router(auth.auth_router)
 app.include_router(documents.documents_router)
 app.include_router(join.join_router)
+app.include_router(metrics.metrics_router)
 
 
 load_dotenv()
 SECRET_KEY = os.getenv("AUTH_SECRET_KEY")
+access_logger = get_access_logger()
 
 def is_excluded(path: str):
     paths_excluded_from_authorization = ["/", "/auth", "/login", "/join", "/openapi.json", "/docs", "/favicon.ico"]
@@ -39,33 +67,75 @@ async def add_user_privilieges_to_header(request, call_next):
     )
     if is_excluded(request.url.path):
         return await call_next(request)
-    try:
-        # extract token from header
-        token = request.headers["Authorization"][7:]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        expires: datetime = payload.get("exp")
-        if username is None:
+    auth_started = time.perf_counter()
+    # one session per request, shared with the routes through get_async_db
+    async with get_async_session() as db:
+        try:
+            # extract token from header
+            token = request.headers["Authorization"][7:]
+            # the signature and user are checked once per token, later
+            # requests with the same token are served from the cache
+            digest = token_digest(token)
+            username = token_cache.get(digest)
+            if username is None:
+                # expired tokens are rejected by jwt.decode
+                payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                username: str = payload.get("sub")
+                expires: int = payload.get("exp")
+                if username is None or expires is None:
+                    raise credentials_exception
+                # if username specified in sub doesn't exist, raise error
+                if await db.get(Users, username) is None:
+                    raise credentials_exception
+                token_cache.set(digest, username, ttl=expires - time.time())
+            # privileges are cached per user, so the db is only hit on a miss
+            privileges = privilege_cache.get(username)
+            if privileges is None:
+                # get owner and participant privileges for authenticated user
+                privileges = await AsyncDbProjectHandler.get_project_privileges(db=db, username=username)
+                privilege_cache.set(username, privileges)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="No Authorization header")
+        except JWTError:
             raise credentials_exception
-        elif datetime.fromtimestamp(expires, tz=timezone.utc) < datetime.now(timezone.utc):
-            raise credentials_exception
-        db = get_session()
-        # if username specified in sub doesn't exist, raise error
-        if get_user(db, username) is None:
-            raise credentials_exception
-        # get owner and participant privileges for authenticated user
-        owned, participating = DbProjectHandler.get_project_privileges(db=db, username=username)
-    except KeyError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="No Authorization header")
-    except JWTError:
-        raise credentials_exception
-    # add extracted info into request
-    request.state.username = username
-    request.state.owned = owned
-    request.state.participating = participating
-    # proxy the request and return response
-    response = await call_next(request)
+        # add extracted info into request
+        request.state.db = db
+        request.state.username = username
+        request.state.owned = privileges.owned
+        request.state.participating = privileges.participating
+        add_time("auth", time.perf_counter() - auth_started)
+        # proxy the request and return response
+        response = await call_next(request)
+    return response
+
+
+@app.middleware("http")
+async def log_request_timings(request, call_next):
+    # added after the auth middleware, so it wraps it and the timings
+    # cover authentication too. One JSON record per request is logged
+    # once the response body has been sent
+    timings = RequestTimings()
+    context_token = request_timings.set(timings)
+    try:
+        response = await call_next(request)
+    except Exception:
+        access_logger.info(json.dumps(access_record(request, 500, timings, 0)))
+        raise
+    finally:
+        request_timings.reset(context_token)
+    body = response.body_iterator
+
+    async def counted_body():
+        bytes_out = 0
+        try:
+            async for chunk in body:
+                bytes_out += len(chunk)
+                yield chunk
+        finally:
+            access_logger.info(json.dumps(access_record(request, response.status_code, timings, bytes_out)))
+
+    response.body_iterator = counted_body()
     return response
 
 
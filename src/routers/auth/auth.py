@@ -3,10 +3,10 @@ from typing import Annotated
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette import status
-from sqlalchemy.orm import Session
-from src.dependecies import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.dependecies import get_async_db
 from src.routers.auth.schemas import CreatedUser, Token, User
-from src.services.auth_utils import authenticate_user, write_new_user, create_access_token
+from src.services.auth_utils import authenticate_user_async, password_hashing_pool, write_new_user, create_access_token
 from src.logs.logger import get_logger
 
 
@@ -16,9 +16,9 @@ logger = get_logger(__name__)
 @auth_router.post("/login", response_model=Token)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_async_db)]
 ) -> Token:
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         logger.error(f"Log in for {form_data.username} with password {form_data.password} failed")
         raise HTTPException(
@@ -34,8 +34,9 @@ async def login_for_access_token(
     return Token(access_token=access_token, token_type="bearer")
 
 @auth_router.post("/auth", response_model=CreatedUser)
-async def create_new_user(db: Annotated[Session, Depends(get_db)],
+async def create_new_user(db: Annotated[AsyncSession, Depends(get_async_db)],
                           new_user: User = Depends(User.as_form),):        
-    created_user = write_new_user(db, new_user)
+    hashed_password = await password_hashing_pool.hash(new_user.password)
+    created_user = await db.run_sync(write_new_user, new_user, hashed_password)
     logger.info(f"Created user with username {created_user.username}")
     return created_user
@@ -1,49 +1,58 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile
-from src.dependecies import get_db
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+from src.dependecies import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.logs.logger import get_logger
-from src.services.document_handler import DocumentHandler
+from src.services.async_document_handler import AsyncDocumentHandler
+from src.services.documents_utils import get_byte_range, stream_response
 from starlette import status
 from src.routers.documents.schemas import Document
+from src.routers.project.schemas import PresignUpload, CompleteUpload, PresignedTransfer
 from src.services.auth_utils import check_privilege
 
 documents_router = APIRouter()
 logger = get_logger(__name__)
 
-@documents_router.get("/document/{document_id}")
+# the document itself is streamed, presigned=true returns json instead
+@documents_router.get("/document/{document_id}",
+                      responses={200: {"model": PresignedTransfer,
+                                       "content": {"application/octet-stream": {}},
+                                       "description": "The document, or a presigned download with presigned=true"},
+                                 206: {"description": "The requested byte range of the document"}})
 async def get_document(request: Request,
                        document_id: int,
-                       db: Annotated[Session, Depends(get_db)]):
+                       db: Annotated[AsyncSession, Depends(get_async_db)],
+                       presigned: bool = False):
     # check if document exists
-    project_id = DocumentHandler.get_document_project(document_id=document_id,
-                                                       db=db)
+    project_id = await AsyncDocumentHandler.get_document_project(document_id=document_id,
+                                                                 db=db)
     # check if caller is authorized to get it
     owned = request.state.owned
     participating = request.state.participating
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     participating_projects=participating)
-    # call method
-    name, content_type, contents = DocumentHandler.download_document(document_id=document_id, db=db)
+    if presigned:
+        # the client fetches the document from s3 itself
+        resp = await AsyncDocumentHandler.presign_download(document_id=document_id, db=db)
+        logger.info(f"Issued presigned download for document {document_id}")
+        return resp
+    # call method, forwarding a Range header as a ranged S3 GET
+    byte_range = get_byte_range(request.headers.get("Range"))
+    name, content_type, stream = await AsyncDocumentHandler.download_document(document_id=document_id,
+                                                                              db=db,
+                                                                              byte_range=byte_range)
     logger.info(f"Retrieved document with id {document_id}")
-    return Response(
-        content=contents,
-        media_type=content_type,
-        headers={
-            "Content-Disposition": f"attachment;filename={name}",
-            "Content-Type": f"{content_type}"
-        }
-    )
+    return stream_response(stream, filename=name, content_type=content_type)
 
 
 @documents_router.put("/document/{document_id}", response_model=Document)
 async def update_document(request: Request,
                           document_id: int,
                           new_document: UploadFile,
-                          db: Annotated[Session, Depends(get_db)]):
+                          db: Annotated[AsyncSession, Depends(get_async_db)]):
     # check if document exists
-    project_id = DocumentHandler.get_document_project(document_id=document_id, db=db)
+    project_id = await AsyncDocumentHandler.get_document_project(document_id=document_id, db=db)
     # check if caller is authorized to update it
     owned = request.state.owned
     participating = request.state.participating
@@ -51,30 +60,72 @@ async def update_document(request: Request,
                     owned_projects=owned,
                     participating_projects=participating)
     user_calling = request.state.username
-    content = await new_document.read()
-    resp = DocumentHandler.update_document(document_id=document_id,
-                                        doc_name=new_document.filename,
-                                        content_type=new_document.content_type,
-                                        updating_user=user_calling,
-                                        b_content=content,
-                                        db=db)
+    resp = await AsyncDocumentHandler.update_document(document_id=document_id,
+                                                      doc_name=new_document.filename,
+                                                      content_type=new_document.content_type,
+                                                      updating_user=user_calling,
+                                                      b_content=new_document.file,
+                                                      db=db)
     logger.info(f"Updated document with id {document_id}")
     return resp
 
 
+@documents_router.post("/document/{document_id}/presign", response_model=PresignedTransfer)
+async def presign_document_update(request: Request,
+                                  document_id: int,
+                                  upload: PresignUpload,
+                                  db: Annotated[AsyncSession, Depends(get_async_db)]):
+    # check if document exists
+    project_id = await AsyncDocumentHandler.get_document_project(document_id=document_id, db=db)
+    # check if caller is authorized to update it
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    resp = await AsyncDocumentHandler.presign_update(document_id=document_id,
+                                                     doc_name=upload.name,
+                                                     content_type=upload.content_type,
+                                                     updating_user=request.state.username,
+                                                     db=db)
+    logger.info(f"Issued presigned update for document {document_id}")
+    return resp
+
+
+@documents_router.post("/document/{document_id}/complete", response_model=Document)
+async def complete_document_update(request: Request,
+                                   document_id: int,
+                                   completed: CompleteUpload,
+                                   db: Annotated[AsyncSession, Depends(get_async_db)]):
+    # check if document exists
+    project_id = await AsyncDocumentHandler.get_document_project(document_id=document_id, db=db)
+    # check if caller is authorized to update it
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    resp = await AsyncDocumentHandler.complete_update(document_id=document_id,
+                                                      upload_token=completed.upload_token,
+                                                      updating_user=request.state.username,
+                                                      db=db)
+    logger.info(f"Updated document with id {document_id} from presigned upload")
+    return resp
+
+
 @documents_router.delete("/document/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_document(request: Request,
                           document_id: int,
-                          db: Annotated[Session, Depends(get_db)]):
+                          db: Annotated[AsyncSession, Depends(get_async_db)]):
     # check if document exists
-    project_id = DocumentHandler.get_document_project(document_id=document_id, db=db)
+    project_id = await AsyncDocumentHandler.get_document_project(document_id=document_id, db=db)
     # check owner privileges
     owned = request.state.owned
     participating = request.state.participating
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     participating_projects=participating)
-    DocumentHandler.delete_document(document_id=document_id,
-                                    db=db)
+    await AsyncDocumentHandler.delete_document(document_id=document_id,
+                                               db=db)
     logger.info(f"Deleted document with id {document_id}")
     
\ No newline at end of file
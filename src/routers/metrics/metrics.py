@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from src.dependecies import pool_metrics
+from src.services.aws_utils import io_executor
+from src.services.documents_utils import logo_cache
+from src.services.email_outbox import email_dispatcher
+from src.services.logo_resize_worker import logo_resize_worker
+from src.services.auth_utils import password_hashing_pool, privilege_cache, token_cache
+
+metrics_router = APIRouter()
+
+@metrics_router.get("/metrics")
+async def get_metrics():
+    return {"db_pool": pool_metrics.stats(),
+            "privilege_cache": privilege_cache.stats(),
+            "token_cache": token_cache.stats(),
+            "logo_cache": logo_cache.stats(),
+            "aws_io": io_executor.stats(),
+            "password_hashing": password_hashing_pool.stats(),
+            "email_outbox": email_dispatcher.stats(),
+            "logo_resize": logo_resize_worker.stats()}
@@ -1,26 +1,45 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Response, UploadFile
+import os
+from typing import Annotated
+from fastapi import APIRouter, Body, HTTPException, Depends, Query, Request, Response, UploadFile
 from starlette import status
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.logs.logger import get_logger
 from src.project_handler_factory import createHandler
-from src.routers.project.schemas import NewProject, UpdateProject, Project, InviteProject, ProjectDocument, ProjectLogo, CoreProjectData, ProjectPermission, EmailInviteProject, SentEmailProjectInvite
-from src.dependecies import get_db
+from src.routers.project.schemas import NewProject, UpdateProject, Project, InviteProject, ProjectDocument, ProjectLogo, CoreProjectData, ProjectPermission, ProjectSort, EmailInviteProject, QueuedEmailProjectInvite, EmailInviteStatus, PresignUpload, CompleteUpload, PresignedTransfer, BatchInviteResult, DocumentUploadResult
+from src.dependecies import get_async_db
 from src.services.auth_utils import check_privilege
-from src.services.aws_utils import SESService
+from src.services.email_outbox import INVITE_SUBJECT, EmailOutboxHandler
+from src.services.documents_utils import cached_file_response, get_byte_range
 from src.services.invite_utils import get_user_from_email
 
 project_router = APIRouter()
 logger = get_logger(__name__)
+# upper bound on the number of rows written by one batch request
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 500))
 
 @project_router.get("/projects", response_model=list[CoreProjectData])
 async def get_all_projects(request: Request,
-                           db: Session = Depends(get_db),
+                           response: Response,
+                           limit: int | None = Query(None, ge=1, le=200),
+                           cursor: str | None = None,
+                           sort: ProjectSort = ProjectSort.created_on,
+                           name: str | None = None,
+                           owner: str | None = None,
+                           db: AsyncSession = Depends(get_async_db),
                            project_handler: object = Depends(createHandler)):
-    owned = request.state.owned
-    participating = request.state.participating
-    accessible = owned + participating
-    resp = project_handler.get_all(db, accessible)
+    resp, next_cursor = await project_handler.get_all(db,
+                                                      username=request.state.username,
+                                                      limit=limit,
+                                                      cursor=cursor,
+                                                      sort=sort,
+                                                      name_filter=name,
+                                                      owner_filter=owner)
+    # pages are opt-in, a request without limit gets every project. The
+    # cursor for the following page is passed back in a header, so the
+    # body stays a plain list of projects
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
     logger.info(f"Successfully retrieved projects for user '{request.state.username}'")
     return resp
 
@@ -28,23 +47,36 @@ async def get_all_projects(request: Request,
 @project_router.post("/projects", response_model=Project)
 async def make_new_project(request: Request,
                            new_project: NewProject,
-                           db: Session = Depends(get_db),
+                           db: AsyncSession = Depends(get_async_db),
                            project_handler: object = Depends(createHandler)):
     user_calling = request.state.username
-    resp = project_handler.create(name=new_project.name,
-                                  created_by=user_calling,
-                                  description=new_project.description,
-                                  db=db)
+    resp = await project_handler.create(name=new_project.name,
+                                        created_by=user_calling,
+                                        description=new_project.description,
+                                        db=db)
     logger.info(f"Created new project with id {resp.id} for user '{user_calling}'")
     return resp
 
+@project_router.post("/projects:batch", response_model=list[Project])
+async def make_new_projects(request: Request,
+                            new_projects: Annotated[list[NewProject], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+                            db: AsyncSession = Depends(get_async_db),
+                            project_handler: object = Depends(createHandler)):
+    user_calling = request.state.username
+    resp = await project_handler.create_many(new_projects=[project.model_dump() for project in new_projects],
+                                             created_by=user_calling,
+                                             db=db)
+    logger.info(f"Created {len(resp)} new projects for user '{user_calling}'")
+    return resp
+
+
 @project_router.get("/project/{project_id}/info", response_model=Project)
 async def get_project_details(request: Request,
                               project_id: int,
-                              db: Session = Depends(get_db),
+                              db: AsyncSession = Depends(get_async_db),
                               project_handler: object = Depends(createHandler)):
     # check if project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     # extract user permissions injected by middleware
     owned = request.state.owned
     participating = request.state.participating
@@ -52,7 +84,7 @@ async def get_project_details(request: Request,
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     participating_projects=participating)
-    resp = project_handler.get(project_id=project_id, db=db)
+    resp = await project_handler.get(project_id=project_id, db=db)
     logger.info(f"Successfully retrieved project with id {project_id}")
     return resp
     
@@ -61,7 +93,7 @@ async def get_project_details(request: Request,
 async def update_project_details(request: Request,
                                  project_id: int,
                                  new_info: UpdateProject,
-                                 db: Session = Depends(get_db),
+                                 db: AsyncSession = Depends(get_async_db),
                                  project_handler: object = Depends(createHandler)):
     # check if any fields were set to be updated
     if new_info.model_fields_set == set():
@@ -70,7 +102,7 @@ async def update_project_details(request: Request,
             detail="No project properties were specified in the request body"
         )
     # check if project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     owned = request.state.owned
     participating = request.state.participating
     # check appropriate privileges
@@ -81,7 +113,7 @@ async def update_project_details(request: Request,
     user_calling = request.state.username
     for_update = new_info.model_dump(exclude_unset=True)
     for_update.update({"updated_by":  user_calling})
-    resp = project_handler.update_info(project_id, for_update, db)
+    resp = await project_handler.update_info(project_id, for_update, db)
     logger.info(f"Updated project {project_id} details")
     return resp
 
@@ -89,14 +121,14 @@ async def update_project_details(request: Request,
 @project_router.delete("/project/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_project(request: Request,
                          project_id: int,
-                         db: Session = Depends(get_db),
+                         db: AsyncSession = Depends(get_async_db),
                          project_handler: object = Depends(createHandler)):
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     owned = request.state.owned
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     owner_status_required=True)        
-    project_handler.delete(project_id, db)
+    await project_handler.delete(project_id, db)
     logger.info(f"Project with id {project_id} deleted")
     
 
@@ -104,10 +136,10 @@ async def delete_project(request: Request,
 async def add_collaborator(request: Request,
                            project_id: int,
                            new_participant: InviteProject,
-                           db: Session = Depends(get_db),
+                           db: AsyncSession = Depends(get_async_db),
                            project_handler: object = Depends(createHandler)):
     # check if project exists
-    proj = project_handler.get_project_internal(project_id, db)
+    proj = await project_handler.get_project_internal(project_id, db)
     if new_participant.name == proj.created_by:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Cannot invite yourself to project")
@@ -116,19 +148,40 @@ async def add_collaborator(request: Request,
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     owner_status_required=True)
-    resp = project_handler.grant_access(project_id, new_participant.name, db)
+    resp = await project_handler.grant_access(project_id, new_participant.name, db)
     logger.info(f"Added user {new_participant.name} as a participant to project {project_id}")
     return resp
     
 
+@project_router.post("/project/{project_id}/invite:batch", response_model=BatchInviteResult)
+async def add_collaborators(request: Request,
+                            project_id: int,
+                            new_participants: Annotated[list[InviteProject], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+                            db: AsyncSession = Depends(get_async_db),
+                            project_handler: object = Depends(createHandler)):
+    # check if project exists
+    await project_handler.get_project_internal(project_id, db)
+    owned = request.state.owned
+    # check owner privileges
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    owner_status_required=True)
+    # the owner and existing participants come back as skipped
+    resp = await project_handler.grant_access_many(project_id,
+                                                   [participant.name for participant in new_participants],
+                                                   db)
+    logger.info(f"Added {len(resp.granted)} participants to project {project_id}")
+    return resp
+
+
 @project_router.post("/project/{project_id}/documents", response_model=list[ProjectDocument])
 async def upload_document(request: Request,
                           project_id: int,
                           upload_files: list[UploadFile],
-                          db: Session = Depends(get_db),
+                          db: AsyncSession = Depends(get_async_db),
                           project_handler: object = Depends(createHandler)):
     # check project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     # check privileges
     owned = request.state.owned
     participating = request.state.participating
@@ -138,32 +191,104 @@ async def upload_document(request: Request,
     user_calling = request.state.username
     added_docs = []
     for file in upload_files:
-        contents = await file.read()
-        doc = project_handler.associate_document(project_id=project_id,
-                                                 doc_name=file.filename,
-                                                 content_type=file.content_type,
-                                                 caller=user_calling,
-                                                 byfile=contents,
-                                                 db=db)
+        # pass the spooled upload on so it's streamed to s3 in parts
+        doc = await project_handler.associate_document(project_id=project_id,
+                                                       doc_name=file.filename,
+                                                       content_type=file.content_type,
+                                                       caller=user_calling,
+                                                       byfile=file.file,
+                                                       db=db)
         added_docs.append(doc)
     logger.info(f"Added {len(added_docs)} documents to project {project_id}")
     return added_docs
 
 
+@project_router.post("/project/{project_id}/documents/presign", response_model=PresignedTransfer)
+async def presign_document_upload(request: Request,
+                                  project_id: int,
+                                  upload: PresignUpload,
+                                  db: AsyncSession = Depends(get_async_db),
+                                  project_handler: object = Depends(createHandler)):
+    # check project exists
+    await project_handler.get_project_internal(project_id, db)
+    # check privileges
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    resp = await project_handler.presign_document_upload(project_id=project_id,
+                                                         doc_name=upload.name,
+                                                         content_type=upload.content_type,
+                                                         caller=request.state.username)
+    logger.info(f"Issued presigned document upload for project {project_id}")
+    return resp
+
+
+@project_router.post("/project/{project_id}/documents/complete", response_model=ProjectDocument)
+async def complete_document_upload(request: Request,
+                                   project_id: int,
+                                   completed: CompleteUpload,
+                                   db: AsyncSession = Depends(get_async_db),
+                                   project_handler: object = Depends(createHandler)):
+    # check project exists
+    await project_handler.get_project_internal(project_id, db)
+    # check privileges
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    resp = await project_handler.complete_document_upload(project_id=project_id,
+                                                          upload_token=completed.upload_token,
+                                                          caller=request.state.username,
+                                                          db=db)
+    logger.info(f"Added presigned upload document {resp.id} to project {project_id}")
+    return resp
+
+
+@project_router.post("/project/{project_id}/documents:batch", response_model=list[DocumentUploadResult])
+async def upload_documents(request: Request,
+                           project_id: int,
+                           upload_files: list[UploadFile],
+                           db: AsyncSession = Depends(get_async_db),
+                           project_handler: object = Depends(createHandler)):
+    # check project exists
+    await project_handler.get_project_internal(project_id, db)
+    # check privileges
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    if len(upload_files) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_BATCH_SIZE} files can be uploaded at once")
+    # files go to s3 in parallel, the result of each is reported separately
+    resp = await project_handler.associate_documents(project_id=project_id,
+                                                     files=[(file.filename, file.content_type, file.file)
+                                                            for file in upload_files],
+                                                     caller=request.state.username,
+                                                     db=db)
+    uploaded = sum(1 for result in resp if result.uploaded)
+    logger.info(f"Added {uploaded} of {len(resp)} documents to project {project_id}")
+    return resp
+
+
 @project_router.get("/project/{project_id}/documents", response_model=list[ProjectDocument])
 async def get_all_documents(request: Request,
                             project_id: int,
-                            db: Session = Depends(get_db),
+                            db: AsyncSession = Depends(get_async_db),
                             project_handler: object = Depends(createHandler)):
     # check project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     # check privileges
     owned = request.state.owned
     participating = request.state.participating
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     participating_projects=participating)
-    resp = project_handler.get_docs(project_id=project_id, db=db)
+    resp = await project_handler.get_docs(project_id=project_id, db=db)
     logger.info(f"Retrieved info on documents for project {project_id}")
     return resp
     
@@ -172,10 +297,10 @@ async def get_all_documents(request: Request,
 async def upload_project_logo(request: Request,
                               project_id: int,
                               logo: UploadFile,
-                              db: Session = Depends(get_db),
+                              db: AsyncSession = Depends(get_async_db),
                               project_handler: object = Depends(createHandler)):
     # check project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     # check privilege
     owned = request.state.owned
     participating = request.state.participating
@@ -188,39 +313,102 @@ async def upload_project_logo(request: Request,
                             detail="Logo must be a .png or .jpeg file")
     # call method and return created logo
     username = request.state.username
-    content = await logo.read()
-    resp = project_handler.upload_logo(project_id=project_id,
-                                       logo_name=logo.filename,
-                                       b_content=content,
-                                       logo_poster=username,
-                                       content_type=logo.content_type,
-                                       db=db)
+    resp = await project_handler.upload_logo(project_id=project_id,
+                                             logo_name=logo.filename,
+                                             b_content=logo.file,
+                                             logo_poster=username,
+                                             content_type=logo.content_type,
+                                             db=db)
     logger.info(f"Updated logo for project {project_id}")
     return resp
     
 
-@project_router.get("/project/{project_id}/logo", response_model=ProjectLogo)
+@project_router.post("/project/{project_id}/logo/presign", response_model=PresignedTransfer)
+async def presign_logo_upload(request: Request,
+                              project_id: int,
+                              upload: PresignUpload,
+                              db: AsyncSession = Depends(get_async_db),
+                              project_handler: object = Depends(createHandler)):
+    # check project exists
+    await project_handler.get_project_internal(project_id, db)
+    # check privilege
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    # the signed content type is enforced by s3 on the client's upload
+    if upload.content_type not in ["image/png", "image/jpeg"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Logo must be a .png or .jpeg file")
+    resp = await project_handler.presign_logo_upload(project_id=project_id,
+                                                     logo_name=upload.name,
+                                                     content_type=upload.content_type,
+                                                     logo_poster=request.state.username)
+    logger.info(f"Issued presigned logo upload for project {project_id}")
+    return resp
+
+
+@project_router.post("/project/{project_id}/logo/complete", response_model=ProjectLogo)
+async def complete_logo_upload(request: Request,
+                               project_id: int,
+                               completed: CompleteUpload,
+                               db: AsyncSession = Depends(get_async_db),
+                               project_handler: object = Depends(createHandler)):
+    # check project exists
+    await project_handler.get_project_internal(project_id, db)
+    # check privilege
+    owned = request.state.owned
+    participating = request.state.participating
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    participating_projects=participating)
+    resp = await project_handler.complete_logo_upload(project_id=project_id,
+                                                      upload_token=completed.upload_token,
+                                                      logo_poster=request.state.username,
+                                                      db=db)
+    logger.info(f"Updated logo for project {project_id} from presigned upload")
+    return resp
+
+
+# the logo itself is returned, presigned=true returns json instead
+@project_router.get("/project/{project_id}/logo",
+                    responses={200: {"model": PresignedTransfer,
+                                     "content": {"image/*": {}},
+                                     "description": "The logo, or a presigned download with presigned=true"},
+                               206: {"description": "The requested byte range of the logo"},
+                               304: {"description": "The logo matches the If-None-Match ETag"}})
 async def download_logo(request: Request,
                         project_id: int,
-                        db: Session = Depends(get_db),
+                        presigned: bool = False,
+                        size: int | None = Query(None, gt=0),
+                        db: AsyncSession = Depends(get_async_db),
                         project_handler: object = Depends(createHandler)):
     # checks
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     owned = request.state.owned
     participating = request.state.participating
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     participating_projects=participating)
-    # calling method
-    name, content = project_handler.download_logo(project_id=project_id,
-                                                      db=db)
-    resp = Response(
-            content=content,
-            headers={
-                "Content-Disposition": f"attachment;filename={name}",
-                "Content-Type": "application/octet-stream"
-            }
-        )
+    if presigned:
+        # the client fetches the logo from s3 itself
+        resp = await project_handler.presign_logo_download(project_id=project_id, db=db)
+        logger.info(f"Issued presigned logo download for project {project_id}")
+        return resp
+    # logos are served from memory, a Range header is answered from there
+    # and an If-None-Match with the current ETag gets a 304. Asking for a
+    # size or accepting avif/webp selects a smaller or converted rendition
+    name, logo = await project_handler.download_logo(project_id=project_id,
+                                                     db=db,
+                                                     size=size,
+                                                     accept=request.headers.get("Accept"))
+    resp = cached_file_response(logo,
+                                filename=name,
+                                content_type=logo.media_type,
+                                byte_range=get_byte_range(request.headers.get("Range")),
+                                if_none_match=request.headers.get("If-None-Match"))
+    resp.headers["Vary"] = "Accept"
     logger.info(f"Retrieved logo for project {project_id}")
     return resp
     
@@ -228,10 +416,10 @@ async def download_logo(request: Request,
 @project_router.delete("/project/{project_id}/logo", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_logo(request: Request,
                       project_id: int,
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_async_db),
                       project_handler: object = Depends(createHandler)):
     # check project exists
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
 
     # check privilege
     owned = request.state.owned
@@ -240,36 +428,60 @@ async def delete_logo(request: Request,
                     owned_projects=owned,
                     participating_projects=participating)
     username = request.state.username
-    project_handler.delete_logo(project_id=project_id,
-                                user_calling=username,
-                                db=db)
+    await project_handler.delete_logo(project_id=project_id,
+                                      user_calling=username,
+                                      db=db)
     logger.info(f"Deleted logo for project {project_id}")
 
 
-@project_router.get("/project/{project_id}/share", response_model=SentEmailProjectInvite)
+@project_router.get("/project/{project_id}/share", response_model=QueuedEmailProjectInvite)
 async def send_email_invite(request: Request,
                             project_id: int,
                             email: str,
-                            db: Session = Depends(get_db),
+                            db: AsyncSession = Depends(get_async_db),
                             project_handler: object = Depends(createHandler)):
-    project_handler.get_project_internal(project_id, db)
+    await project_handler.get_project_internal(project_id, db)
     owned = request.state.owned
     # check owner privileges
     check_privilege(project_id=project_id,
                     owned_projects=owned,
                     owner_status_required=True)
-    invite_username = get_user_from_email(email, db=db)
+    invite_username = await db.run_sync(lambda session: get_user_from_email(email, db=session))
     username = request.state.username
     if username == invite_username:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Cannot invite yourself to project")
-    text, token = project_handler.email_invite(project_id=project_id,
-                                        invite_sender_username=username,
-                                        invite_receiver=invite_username,
-                                        email=email,
-                                        db=db)
-    message_id = SESService.send_email_via_ses(text=text, to_address=email)
-    resp = SentEmailProjectInvite(aws_message_id=message_id,
-                                  join_token=token)
-    logger.info(f"Sent email invite to {invite_username} for project {project_id}")
+    text, token = await project_handler.email_invite(project_id=project_id,
+                                              invite_sender_username=username,
+                                              invite_receiver=invite_username,
+                                              email=email,
+                                              db=db)
+    # the email is stored in the outbox and sent by the background
+    # dispatcher, the request doesn't wait for ses
+    invite_id = await db.run_sync(lambda session: EmailOutboxHandler.enqueue(
+        db=session, project_id=project_id, to_address=email,
+        subject=INVITE_SUBJECT, body=text))
+    resp = QueuedEmailProjectInvite(invite_id=invite_id,
+                                    status="queued",
+                                    join_token=token)
+    logger.info(f"Queued email invite to {invite_username} for project {project_id}")
     return resp
+
+
+@project_router.get("/project/{project_id}/share/{invite_id}", response_model=EmailInviteStatus)
+async def get_email_invite_status(request: Request,
+                                  project_id: int,
+                                  invite_id: int,
+                                  db: AsyncSession = Depends(get_async_db)):
+    owned = request.state.owned
+    # check owner privileges
+    check_privilege(project_id=project_id,
+                    owned_projects=owned,
+                    owner_status_required=True)
+    email = await db.run_sync(lambda session: EmailOutboxHandler.get(
+        db=session, email_id=invite_id, project_id=project_id))
+    return EmailInviteStatus(invite_id=email.id,
+                             status=email.status,
+                             attempts=email.attempts,
+                             sent_on=email.sent_on,
+                             aws_message_id=email.message_id)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
 class NewProject(BaseModel):
@@ -41,6 +42,13 @@ class ProjectDocument(BaseModel):
     content_type: str
 
 
+class DocumentUploadResult(BaseModel):
+    filename: str
+    uploaded: bool
+    document: Optional[ProjectDocument] = None
+    error: Optional[str] = None
+
+
 class ProjectLogo(BaseModel):
     project_id: int
     logo_name: str
@@ -54,6 +62,12 @@ class ProjectPermission(BaseModel):
     role: str
 
 
+class BatchInviteResult(BaseModel):
+    granted: List[ProjectPermission]
+    # unknown users and users who already had access to the project
+    skipped: List[str]
+
+
 class CoreProjectData(BaseModel):
     id: int
     name: str
@@ -62,10 +76,47 @@ class CoreProjectData(BaseModel):
     created_on: datetime
 
 
+class ProjectSort(str, Enum):
+    created_on = "created_on"
+    created_on_desc = "-created_on"
+    name = "name"
+    name_desc = "-name"
+
+
+class PresignUpload(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    name: str
+    content_type: str
+
+
+class CompleteUpload(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    upload_token: str
+
+
+class PresignedTransfer(BaseModel):
+    url: str
+    method: str
+    expires_in: int
+    # headers the client must send along with the request to the url
+    headers: dict[str, str] = {}
+    # returned for uploads, passed back to the matching completion endpoint
+    upload_token: Optional[str] = None
+
+
 class EmailInviteProject(BaseModel):
     email: str = Field(pattern="([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+")
 
 
-class SentEmailProjectInvite(BaseModel):
-    aws_message_id: str
-    join_token: str
\ No newline at end of file
+class QueuedEmailProjectInvite(BaseModel):
+    invite_id: int
+    status: str
+    join_token: str
+
+
+class EmailInviteStatus(BaseModel):
+    invite_id: int
+    status: str
+    attempts: int
+    sent_on: Optional[datetime] = None
+    aws_message_id: Optional[str] = None
\ No newline at end of file
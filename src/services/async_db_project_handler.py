@@ -0,0 +1,178 @@
+import asyncio
+from typing import BinaryIO
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.routers.project.schemas import ProjectSort
+from src.services.content_store import acquire_blobs, content_key
+from src.services.db_project_handler import DbProjectHandler
+
+
+class AsyncDbProjectHandler():
+    """
+        Async counterpart of DbProjectHandler used by the routers.
+        Every method runs the DbProjectHandler logic through
+        AsyncSession.run_sync, so queries go through the async driver and
+        don't block the event loop, while the query code itself lives in a
+        single place.
+    """
+    def __init__(self):
+        self.handler = DbProjectHandler()
+
+    async def create(self,
+                     name: str,
+                     created_by: str,
+                     description: str,
+                     db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.create(
+            name=name, created_by=created_by, description=description, db=session))
+
+    async def create_many(self,
+                          new_projects: list[dict],
+                          created_by: str,
+                          db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.create_many(
+            new_projects=new_projects, created_by=created_by, db=session))
+
+    async def get(self, project_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.get(project_id, session))
+
+    async def get_all(self,
+                      db: AsyncSession,
+                      username: str,
+                      limit: int | None = None,
+                      cursor: str | None = None,
+                      sort: ProjectSort = ProjectSort.created_on,
+                      name_filter: str | None = None,
+                      owner_filter: str | None = None):
+        return await db.run_sync(lambda session: self.handler.get_all(
+            session, username=username, limit=limit, cursor=cursor, sort=sort,
+            name_filter=name_filter, owner_filter=owner_filter))
+
+    async def delete(self, project_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.delete(project_id, session))
+
+    async def update_info(self, project_id: int,
+                          attributes_to_update: dict,
+                          db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.update_info(
+            project_id, attributes_to_update, session))
+
+    async def get_project_internal(self, project_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.get_project_internal(project_id, session))
+
+    @staticmethod
+    async def grant_access(project_id: int, username: str, db: AsyncSession):
+        return await db.run_sync(lambda session: DbProjectHandler.grant_access(
+            project_id, username, session))
+
+    @staticmethod
+    async def grant_access_many(project_id: int, usernames: list[str], db: AsyncSession):
+        return await db.run_sync(lambda session: DbProjectHandler.grant_access_many(
+            project_id, usernames, session))
+
+    @staticmethod
+    async def get_project_privileges(db: AsyncSession, username: str):
+        return await db.run_sync(DbProjectHandler.get_project_privileges, username)
+
+    async def associate_document(self,
+                                 project_id: int,
+                                 doc_name: str,
+                                 content_type: str,
+                                 caller: str,
+                                 byfile: BinaryIO,
+                                 db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.associate_document(
+            project_id=project_id, doc_name=doc_name, content_type=content_type,
+            caller=caller, byfile=byfile, db=session))
+
+    async def associate_documents(self,
+                                  project_id: int,
+                                  files: list[tuple[str, str, BinaryIO]],
+                                  caller: str,
+                                  db: AsyncSession):
+        # hashing the files and waiting for the s3 uploads happens off the
+        # event loop, the session only takes the blob references and
+        # inserts the rows, all in one transaction
+        keys = await asyncio.to_thread(lambda: [content_key(byfile) for *_, byfile in files])
+        new_keys = await db.run_sync(acquire_blobs, keys)
+        uploads = await asyncio.to_thread(self.handler.upload_documents, files, keys, new_keys)
+        return await db.run_sync(lambda session: self.handler.save_documents(
+            project_id, caller, uploads, session))
+
+    async def presign_document_upload(self,
+                                      project_id: int,
+                                      doc_name: str,
+                                      content_type: str,
+                                      caller: str):
+        # signing urls is local, no database or network round trip
+        return self.handler.presign_document_upload(project_id=project_id,
+                                                    doc_name=doc_name,
+                                                    content_type=content_type,
+                                                    caller=caller)
+
+    async def complete_document_upload(self,
+                                       project_id: int,
+                                       upload_token: str,
+                                       caller: str,
+                                       db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.complete_document_upload(
+            project_id=project_id, upload_token=upload_token, caller=caller, db=session))
+
+    async def get_docs(self, project_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.get_docs(project_id, session))
+
+    async def upload_logo(self,
+                          project_id: int,
+                          logo_name: str,
+                          b_content: BinaryIO,
+                          logo_poster: str,
+                          content_type: str,
+                          db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.upload_logo(
+            project_id=project_id, logo_name=logo_name, b_content=b_content,
+            logo_poster=logo_poster, content_type=content_type, db=session))
+
+    async def presign_logo_upload(self,
+                                  project_id: int,
+                                  logo_name: str,
+                                  content_type: str,
+                                  logo_poster: str):
+        return self.handler.presign_logo_upload(project_id=project_id,
+                                                logo_name=logo_name,
+                                                content_type=content_type,
+                                                logo_poster=logo_poster)
+
+    async def complete_logo_upload(self,
+                                   project_id: int,
+                                   upload_token: str,
+                                   logo_poster: str,
+                                   db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.complete_logo_upload(
+            project_id=project_id, upload_token=upload_token, logo_poster=logo_poster, db=session))
+
+    async def download_logo(self,
+                            project_id: int,
+                            db: AsyncSession,
+                            size: int | None = None,
+                            accept: str | None = None):
+        return await db.run_sync(lambda session: self.handler.download_logo(
+            project_id, session, size=size, accept=accept))
+
+    async def presign_logo_download(self, project_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.presign_logo_download(project_id, session))
+
+    async def delete_logo(self,
+                          project_id: int,
+                          user_calling: str,
+                          db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.delete_logo(
+            project_id, user_calling, session))
+
+    async def email_invite(self,
+                           project_id: int,
+                           invite_sender_username: str,
+                           invite_receiver: str,
+                           email: str,
+                           db: AsyncSession):
+        return await db.run_sync(lambda session: self.handler.email_invite(
+            project_id=project_id, invite_sender_username=invite_sender_username,
+            invite_receiver=invite_receiver, email=email, db=session))
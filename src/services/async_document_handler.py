@@ -0,0 +1,56 @@
+from typing import BinaryIO
+from sqlalchemy.ext.asyncio import AsyncSession
+from .document_handler import DocumentHandler
+
+
+class AsyncDocumentHandler():
+    """
+        Async counterpart of DocumentHandler, running its logic through
+        AsyncSession.run_sync.
+    """
+    @staticmethod
+    async def download_document(document_id: int, db: AsyncSession, byte_range: str | None = None):
+        return await db.run_sync(lambda session: DocumentHandler.download_document(
+            document_id, session, byte_range))
+
+    @staticmethod
+    async def update_document(document_id: int,
+                              doc_name: str,
+                              content_type: str,
+                              updating_user: str,
+                              b_content: BinaryIO,
+                              db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.update_document(
+            document_id=document_id, doc_name=doc_name, content_type=content_type,
+            updating_user=updating_user, b_content=b_content, db=session))
+
+    @staticmethod
+    async def presign_download(document_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.presign_download(document_id, session))
+
+    @staticmethod
+    async def presign_update(document_id: int,
+                             doc_name: str,
+                             content_type: str,
+                             updating_user: str,
+                             db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.presign_update(
+            document_id=document_id, doc_name=doc_name, content_type=content_type,
+            updating_user=updating_user, db=session))
+
+    @staticmethod
+    async def complete_update(document_id: int,
+                              upload_token: str,
+                              updating_user: str,
+                              db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.complete_update(
+            document_id=document_id, upload_token=upload_token,
+            updating_user=updating_user, db=session))
+
+    @staticmethod
+    async def delete_document(document_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.delete_document(document_id, session))
+
+    @staticmethod
+    async def get_document_project(document_id: int, db: AsyncSession):
+        return await db.run_sync(lambda session: DocumentHandler.get_document_project(document_id, session))
@@ -1,9 +1,17 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import hashlib
+from threading import Lock
+import time
+from typing import Collection, NamedTuple
 from fastapi import HTTPException
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from src.services.project_manager_tables import Users
 from src.routers.auth.schemas import CreatedUser, User
+from src.services.cache_utils import LRUCache
 from jose import jwt
 from starlette import status
 from dotenv import load_dotenv
@@ -14,6 +22,92 @@ load_dotenv()
 SECRET_KEY = os.getenv("AUTH_SECRET_KEY")
 ALGORITHM = "HS256"
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# per-user ProjectPrivileges snapshots used by the auth middleware.
+# Entries are invalidated on changes to project_access; the TTL bounds how
+# stale other worker processes can get
+privilege_cache = LRUCache(max_size=int(os.getenv("PRIVILEGE_CACHE_MAX_SIZE", 10000)),
+                           ttl=float(os.getenv("PRIVILEGE_CACHE_TTL_SECONDS", 30)))
+# usernames of already verified access tokens, keyed by token digest. Each
+# entry lives until its token expires, capped by the cache ttl
+token_cache = LRUCache(max_size=int(os.getenv("TOKEN_CACHE_MAX_SIZE", 10000)),
+                       ttl=float(os.getenv("TOKEN_CACHE_MAX_TTL_SECONDS", 3600)))
+
+class ProjectPrivileges(NamedTuple):
+    """
+        Immutable snapshot of the projects a user owns or participates in.
+        Frozen sets give O(1) membership checks and make the snapshot safe to
+        share between requests through the privilege cache.
+    """
+    owned: frozenset[int] = frozenset()
+    participating: frozenset[int] = frozenset()
+
+class PasswordHashingPool():
+    """
+        Runs bcrypt hashing and verification on a bounded thread pool so the
+        CPU heavy work doesn't stall the event loop. bcrypt releases the GIL
+        while hashing, so the workers run in parallel. Calls beyond the
+        workers plus max_pending waiting ones are rejected with a 503.
+    """
+    def __init__(self, max_workers: int, max_pending: int) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="password-hashing")
+        self._lock = Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.queued + self.running >= self.max_workers + self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many concurrent logins, retry later",
+                                    headers={"Retry-After": "1"})
+            self.queued += 1
+        submitted_at = time.perf_counter()
+
+        def job():
+            waited = time.perf_counter() - submitted_at
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    async def verify(self, plain_password, hashed_password) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password) -> str:
+        return await self.run(get_password_hash, password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"max_workers": self.max_workers,
+                    "max_pending": self.max_pending,
+                    "queued": self.queued,
+                    "running": self.running,
+                    "completed": self.completed,
+                    "rejected": self.rejected,
+                    "avg_wait_ms": self.total_wait / self.completed * 1000 if self.completed else 0.0,
+                    "max_wait_ms": self.max_wait * 1000}
+
+
+password_hashing_pool = PasswordHashingPool(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1)),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", 100)))
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -29,16 +123,28 @@ def authenticate_user(db, username: str, given_password: str):
         return False
     return user
 
+async def authenticate_user_async(db: AsyncSession, username: str, given_password: str):
+    # only the lookup goes through the session, the password check runs on
+    # the hashing pool
+    user = await db.run_sync(get_user, username)
+    if not user:
+        return False
+    if not await password_hashing_pool.verify(given_password, user.password):
+        return False
+    return user
+
 def get_user(db: Session, username: str):
     user = db.get(Users, username)
     db.close()
     return user
 
-def write_new_user(db: Session, user: User):
+def write_new_user(db: Session, user: User, hashed_passw: str | None = None):
+    # callers on the event loop hash on the hashing pool and pass the result
     if db.get(Users, user.username) is not None:
         raise HTTPException(status_code=400,
                             detail=f"Username '{user.username}' is already taken")
-    hashed_passw = get_password_hash(user.password)
+    if hashed_passw is None:
+        hashed_passw = get_password_hash(user.password)
     passw_byte_version = bytes(hashed_passw, encoding="utf-8")
     new_user = Users(username=user.username,
                      name=user.full_name,
@@ -52,6 +158,10 @@ def write_new_user(db: Session, user: User):
                        email=created_user.email)
 
 
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -64,8 +174,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 def check_privilege(project_id: int,
-                    owned_projects: list[int],
-                    participating_projects: list[int] = [],
+                    owned_projects: Collection[int],
+                    participating_projects: Collection[int] = frozenset(),
                     owner_status_required: bool = False):
     if owner_status_required:
         if project_id not in owned_projects:
@@ -1,22 +1,173 @@
 # defining functions that will manage communication with aws services
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import math
 import os
+from threading import Lock
 import boto3
+from botocore.config import Config
 from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from starlette import status
+from src.services.request_timing import timed
+
+load_dotenv()
+
+
+def get_boto_config() -> Config:
+    # one pool per client is shared by all threads of the process, so it has
+    # to be large enough for the multipart upload threads of every request
+    return Config(max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50)),
+                  connect_timeout=float(os.getenv("AWS_CONNECT_TIMEOUT_SECONDS", 5)),
+                  read_timeout=float(os.getenv("AWS_READ_TIMEOUT_SECONDS", 30)),
+                  retries={"max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", 3)),
+                           "mode": os.getenv("AWS_RETRY_MODE", "standard")})
+
+
+class ClientRegistry():
+    """
+        Process-wide registry of boto3 clients. A client is created once per
+        service on first use and then shared, which keeps its HTTP
+        connections alive between requests. boto3 clients are thread-safe,
+        only their creation is guarded by the lock.
+    """
+    def __init__(self) -> None:
+        self._clients = {}
+        self._lock = Lock()
+        self._session = None
+
+    def get_client(self, service_name: str):
+        client = self._clients.get(service_name)
+        if client is not None:
+            return client
+        with self._lock:
+            if service_name not in self._clients:
+                # sessions are not thread-safe, the registry keeps its own
+                if self._session is None:
+                    self._session = boto3.session.Session()
+                self._clients[service_name] = self._session.client(service_name,
+                                                                    config=get_boto_config())
+            return self._clients[service_name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            self._session = None
+
+
+client_registry = ClientRegistry()
+
+def get_client(service_name: str):
+    return client_registry.get_client(service_name)
+
+
+# for calls that must not be given up on while they may still succeed
+NO_TIMEOUT = math.inf
+
+
+class IOExecutor():
+    """
+        Size-limited thread pool for blocking boto3 calls. Handler code runs
+        inside AsyncSession.run_sync on the event loop thread; a call made
+        from there is handed to the pool and the request's coroutine is
+        suspended until it finishes, so the loop keeps serving other
+        requests. Calls from plain threads already run off the loop and are
+        made directly. Waiting is bounded by a per-call timeout, except
+        with NO_TIMEOUT: a call that timed out keeps running on its thread,
+        so sends that aren't idempotent wait for the real outcome.
+    """
+    def __init__(self, max_workers: int, timeout: float) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="aws-io")
+        self._lock = Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            self.queued += 1
+
+        def job():
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+            return result
+
+        # pool threads don't inherit the caller's context variables, each
+        # job runs in its own copy so request timings reach the access log
+        return self._executor.submit(contextvars.copy_context().run, job)
+
+    async def wait(self, future: Future, timeout: float | None = None):
+        if timeout == NO_TIMEOUT:
+            # still bounded by the boto3 client's connect and read timeouts
+            return await asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout=self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            # the boto3 call itself is bounded by the client read timeout
+            with self._lock:
+                self.timed_out += 1
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                                detail="Storage service did not respond in time")
+
+    async def run(self, fn, *args, timeout: float | None = None, **kwargs):
+        return await self.wait(self.submit(fn, *args, **kwargs), timeout)
+
+    def call(self, fn, *args, timeout: float | None = None, **kwargs):
+        if in_greenlet():
+            return await_only(self.run(fn, *args, timeout=timeout, **kwargs))
+        return fn(*args, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"max_workers": self.max_workers,
+                    "queued": self.queued,
+                    "in_flight": self.in_flight,
+                    "completed": self.completed,
+                    "failed": self.failed,
+                    "timed_out": self.timed_out}
+
+
+io_executor = IOExecutor(max_workers=int(os.getenv("AWS_IO_WORKERS", 16)),
+                         timeout=float(os.getenv("AWS_CALL_TIMEOUT_SECONDS", 60)))
+
 
 class SESService():
     @staticmethod
-    def send_email_via_ses(text:str, to_address: str):
-        ses = boto3.client('ses')
-        load_dotenv()
+    @timed("email")
+    def send_email_via_ses(text:str, to_address: str, subject: str = 'Invite to project'):
+        ses = get_client('ses')
         sender = os.getenv("SES_SENDER")
-        response = ses.send_email(
+        # a retry after giving up on a send that then succeeds would send
+        # the email twice
+        response = io_executor.call(
+            ses.send_email,
+            timeout=NO_TIMEOUT,
             Source=sender,
             Destination={
                 'ToAddresses': [to_address]
                 },
                 Message={
                     'Subject': {
-                        'Data': 'Invite to project',
+                        'Data': subject,
                         'Charset': 'utf-8'
                     },
                     'Body': {
@@ -27,4 +178,3 @@ class SESService():
                     }
                 })
         return response['MessageId']
-
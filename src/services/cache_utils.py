@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class LRUCache():
+    """
+        Thread-safe in-process cache with LRU eviction and time-based expiry
+        of entries. Keeps hit/miss/eviction counters for monitoring. With
+        max_bytes set, entries are also evicted to keep the sum of their
+        sizes, given on set, within that budget.
+    """
+    def __init__(self, max_size: int, ttl: float, max_bytes: int | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # {key: (expires_at, value, nbytes)} kept in least to most recently
+        # used order
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, nbytes = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.bytes -= nbytes
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float | None = None, nbytes: int = 0) -> None:
+        # entries can be given a shorter lifetime than the cache default
+        expires_at = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            self._pop(key)
+            # an entry larger than the whole budget is not cached
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (expires_at, value, nbytes)
+            self.bytes += nbytes
+            while len(self._entries) > self.max_size or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.bytes -= evicted_bytes
+                self.evictions += 1
+
+    def _pop(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries),
+                    "max_size": self.max_size,
+                    "bytes": self.bytes,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0}
@@ -1,3 +1,9 @@
+import base64
+import json
+import os
+import time
+import uuid
+
 def reformat_filename(name: str) -> str:
     return name.strip().replace(" ", "-")
 
@@ -5,4 +11,24 @@ def generate_logo_key(filename: str, project_id: int) -> str:
     return f"project-{project_id}-logo-{filename}"
 
 def get_logo_name_for_user(key: str, project_id: int) -> str:
-    return key[len(f"project-{project_id}-logo-"):]
\ No newline at end of file
+    return key[len(f"project-{project_id}-logo-"):]
+
+def uuid7() -> uuid.UUID:
+    # 48 bit unix time in ms followed by random bits, so keys generated later
+    # sort after earlier ones and new index entries land next to each other
+    unix_ms = time.time_ns() // 1_000_000
+    value = (unix_ms & 0xFFFFFFFFFFFF) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = value & ~(0xF << 76) | 0x7 << 76  # version 7
+    value = value & ~(0x3 << 62) | 0x2 << 62  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
+def generate_s3_key() -> str:
+    if os.getenv("S3_KEY_UUID_VERSION", "4") == "7":
+        return str(uuid7())
+    return str(uuid.uuid4())
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
@@ -0,0 +1,68 @@
+from collections import Counter
+import hashlib
+from typing import BinaryIO
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from src.services.project_manager_tables import Blobs
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# INSERT ... ON CONFLICT is dialect specific
+UPSERT_INSERTS = {"postgresql": postgresql.insert,
+                  "sqlite": sqlite.insert}
+
+
+def content_key(bin_file: BinaryIO | bytes) -> str:
+    # storage key of a document: the sha256 of its bytes. File objects are
+    # read in chunks and rewound for the upload
+    if isinstance(bin_file, (bytes, bytearray)):
+        return hashlib.sha256(bin_file).hexdigest()
+    start = bin_file.tell()
+    digest = hashlib.sha256()
+    while chunk := bin_file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    bin_file.seek(start)
+    return digest.hexdigest()
+
+
+def acquire_blobs(db: Session, keys: list[str]) -> set[str]:
+    """
+        Adds a reference to the blob of every key, creating blobs that don't
+        exist yet, and returns the keys of the created ones. Their files
+        still have to be uploaded before the transaction commits. The rows
+        stay locked until then, so a concurrent release can't delete a file
+        that is being referenced again.
+    """
+    upsert = UPSERT_INSERTS[db.get_bind().dialect.name]
+    new_keys = set()
+    # rows are always locked in the same order
+    for key, count in sorted(Counter(keys).items()):
+        ref_count = db.execute(upsert(Blobs)
+                               .values(key=key, ref_count=count)
+                               .on_conflict_do_update(index_elements=[Blobs.key],
+                                                      set_={"ref_count": Blobs.ref_count + count})
+                               .returning(Blobs.ref_count)).scalar_one()
+        if ref_count == count:
+            new_keys.add(key)
+    return new_keys
+
+
+def release_blobs(db: Session, keys: list[str]) -> list[str]:
+    """
+        Drops a reference to the blob of every key and returns the keys that
+        lost their last one. Their files should be deleted before the
+        transaction commits. Keys without a blob row belong to documents
+        stored before deduplication, which own their file.
+    """
+    orphaned = []
+    for key, count in sorted(Counter(keys).items()):
+        ref_count = db.execute(update(Blobs)
+                               .where(Blobs.key == key)
+                               .values(ref_count=Blobs.ref_count - count)
+                               .returning(Blobs.ref_count)).scalar_one_or_none()
+        if ref_count is not None and ref_count > 0:
+            continue
+        if ref_count is not None:
+            db.execute(delete(Blobs).where(Blobs.key == key))
+        orphaned.append(key)
+    return orphaned
@@ -1,15 +1,24 @@
-from sqlalchemy import select, update
-from sqlalchemy.orm import Session
+from concurrent.futures import wait
+from threading import Semaphore
+from typing import BinaryIO
+from sqlalchemy import and_, exists, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, joinedload, selectinload
 from src.logs.logger import get_logger
 from src.project_handler_interface import ProjectHandlerInterface
-from src.routers.project.schemas import Project, ProjectDocument, ProjectLogo, CoreProjectData, ProjectPermission
+from src.routers.project.schemas import Project, ProjectDocument, ProjectLogo, CoreProjectData, ProjectPermission, ProjectSort, PresignedTransfer, BatchInviteResult, DocumentUploadResult
 from fastapi import HTTPException
+from src.services.auth_utils import ProjectPrivileges, privilege_cache
 from src.services.invite_utils import create_join_token
 from src.services.project_manager_tables import Projects, ProjectAccess, Documents, Users
-from src.services.documents_utils import S3Service
-from uuid import uuid4
-from datetime import datetime
-from src.services.common_utils import reformat_filename, generate_logo_key, get_logo_name_for_user
+from src.services.aws_utils import io_executor
+from src.services.content_store import acquire_blobs, content_key, release_blobs
+from src.services.documents_utils import CachedFile, DocumentUpload, logo_cache, read_stream
+from src.services.logo_resize_worker import logo_resize_worker
+from src.services.logo_renditions import FALLBACK_FORMAT, accepted_formats, all_renditions, choose_size, rendition_filename, rendition_key, rendition_media_type
+from src.services.storage_factory import get_storage
+from src.services.transfer_utils import PRESIGNED_URL_EXPIRY_SECONDS, create_upload_token, decode_upload_token
+from datetime import datetime, timezone
+from src.services.common_utils import reformat_filename, generate_logo_key, generate_s3_key, get_logo_name_for_user, encode_cursor, decode_cursor
 from dotenv import load_dotenv
 import os
 
@@ -21,88 +30,189 @@ class DbProjectHandler(ProjectHandlerInterface):
         self.raw_logos_bucket = os.getenv("RAW_LOGO_BUCKET")
         self.processed_logos_bucket = os.getenv("RESIZED_LOGO_BUCKET")
         self.documents_bucket = os.getenv("DOCUMENTS_BUCKET")
+        # io executor workers one bulk upload may hold at a time, the rest
+        # stay free for the storage calls of other requests
+        self.batch_upload_concurrency = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", 4))
 
     def create(self,
                name: str,
                created_by: str,
                description: str,
                db: Session):
-        # add new project to Projects table
+        # add new project to Projects table together with a permission of
+        # type 'owner' to ProjectAccess, both written in one transaction
         new_project = Projects(name=name,
                                created_by=created_by,
-                               description=description)
+                               description=description,
+                               documents=[],
+                               access=[ProjectAccess(username=created_by,
+                                                     access_type="owner")])
         db.add(new_project)
+        db.flush()
+        # build the response before commit expires the loaded attributes
+        project_repr = self.project_to_schema(new_project)
         db.commit()
-        #add new permission of type 'owner' to ProjectAccess
-        db.add(ProjectAccess(project_id=new_project.id,
-                             username=created_by,
-                             access_type="owner"))
+        privilege_cache.invalidate(created_by)
+        return project_repr
+
+    def create_many(self,
+                    new_projects: list[dict],
+                    created_by: str,
+                    db: Session) -> list[Project]:
+        # all projects are inserted by one multi-row INSERT ... RETURNING and
+        # all owner permissions by one executemany, in a single transaction
+        created = db.execute(
+            insert(Projects).returning(Projects.id,
+                                       Projects.name,
+                                       Projects.description,
+                                       Projects.created_on,
+                                       sort_by_parameter_order=True),
+            [{"name": project["name"],
+              "description": project["description"],
+              "created_by": created_by} for project in new_projects]).all()
+        db.execute(insert(ProjectAccess),
+                   [{"project_id": row[0],
+                     "username": created_by,
+                     "access_type": "owner"} for row in created])
         db.commit()
-        return self.get(new_project.id, db)
+        privilege_cache.invalidate(created_by)
+        return [Project(id=row[0],
+                        name=row[1],
+                        description=row[2],
+                        created_on=row[3],
+                        created_by=created_by,
+                        documents=[],
+                        contributors=[created_by]) for row in created]
 
     def get(self, project_id: int, db: Session):
-        project = db.get(Projects, project_id)
-        # retrieve documents associated to the project
-        docs = db.execute(select(Documents.id, Documents.name).where(
-            Documents.project_id==project_id))
-        docs_list = [{"id": row[0], "name": row[1]} for row in docs.all()]
-        
-        # retrieve full list of project contributors
-        contributors = db.execute(select(ProjectAccess.username).where(
-                    ProjectAccess.project_id == project_id))
-        contributors_list = [row[0] for row in contributors.all()]
+        project = self.load_project(project_id, db)
+        return self.project_to_schema(project)
+
+    @staticmethod
+    def load_project(project_id: int, db: Session) -> Projects:
+        # project row and contributors come from a single joined query,
+        # documents are fetched by one additional IN query
+        q = (select(Projects)
+             .options(joinedload(Projects.access).load_only(ProjectAccess.username),
+                      selectinload(Projects.documents).load_only(Documents.id, Documents.name))
+             .where(Projects.id == project_id)
+             .execution_options(populate_existing=True))
+        return db.execute(q).unique().scalar_one_or_none()
+
+    @staticmethod
+    def project_to_schema(project: Projects) -> Project:
+        docs_list = [{"id": doc.id, "name": doc.name} for doc in project.documents]
+        contributors_list = [access.username for access in project.access]
         # create appropriate output format
         # user should just see the name of the file uploaded as logo, not the
         # s3 bucket key built by the app
         logo_format_for_users = None
         if project.logo is not None:
-            logo_format_for_users = get_logo_name_for_user(project.logo, project_id)
-        project_repr = Project(id=project.id,
-                               name=project.name,
-                               created_by=project.created_by,
-                               created_on=project.created_on,
-                               description=project.description,
-                               updated_by=project.updated_by,
-                               updated_on=project.updated_on,
-                               logo=logo_format_for_users,
-                               documents= docs_list,
-                               contributors=contributors_list)
-        return project_repr
+            logo_format_for_users = get_logo_name_for_user(project.logo, project.id)
+        return Project(id=project.id,
+                       name=project.name,
+                       created_by=project.created_by,
+                       created_on=project.created_on,
+                       description=project.description,
+                       updated_by=project.updated_by,
+                       updated_on=project.updated_on,
+                       logo=logo_format_for_users,
+                       documents=docs_list,
+                       contributors=contributors_list)
 
     
-    def get_all(self, db: Session, accessible_projects: list[int]):
-        all_projects = list()
-        all_project_raw = db.query(Projects.id,
-                                   Projects.name,
-                                   Projects.description,
-                                   Projects.created_by,
-                                   Projects.created_on).filter(
-                                       Projects.id.in_(accessible_projects))
-        for row in all_project_raw.all():
-            proj = CoreProjectData(id = row[0],
-                                   name = row[1],
-                                   description=row[2],
-                                   owner=row[3],
-                                   created_on=row[4])
-            all_projects.append(proj)
-        return all_projects
+    def get_all(self,
+                db: Session,
+                username: str,
+                limit: int | None = None,
+                cursor: str | None = None,
+                sort: ProjectSort = ProjectSort.created_on,
+                name_filter: str | None = None,
+                owner_filter: str | None = None):
+        # without a limit every project is returned, as before pagination
+        sort = ProjectSort(sort)
+        sort_column = Projects.name if sort in (ProjectSort.name, ProjectSort.name_desc) else Projects.created_on
+        descending = sort.value.startswith("-")
+        # projects the user can access, resolved by the join instead of an
+        # IN list of previously fetched ids
+        q = (select(Projects.id,
+                    Projects.name,
+                    Projects.description,
+                    Projects.created_by,
+                    Projects.created_on)
+             .join(ProjectAccess, ProjectAccess.project_id == Projects.id)
+             .where(ProjectAccess.username == username))
+        if name_filter is not None:
+            q = q.where(Projects.name.icontains(name_filter, autoescape=True))
+        if owner_filter is not None:
+            q = q.where(Projects.created_by == owner_filter)
+        # keyset pagination: continue after the (sort value, id) of the last
+        # row of the previous page, with id breaking ties
+        if cursor is not None:
+            try:
+                last_value, last_id = decode_cursor(cursor)
+                # the cursor comes from the client, it only reaches the query
+                # as the (sort value, id) pair we encoded
+                if not isinstance(last_value, str) or type(last_id) is not int:
+                    raise TypeError("cursor has the wrong shape")
+                if sort_column is Projects.created_on:
+                    last_value = datetime.fromisoformat(last_value)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400,
+                                    detail="Invalid pagination cursor")
+            if descending:
+                q = q.where(or_(sort_column < last_value,
+                                and_(sort_column == last_value, Projects.id < last_id)))
+            else:
+                q = q.where(or_(sort_column > last_value,
+                                and_(sort_column == last_value, Projects.id > last_id)))
+        if descending:
+            q = q.order_by(sort_column.desc(), Projects.id.desc())
+        else:
+            q = q.order_by(sort_column, Projects.id)
+        # one extra row tells whether there is a next page
+        rows = db.execute(q.limit(limit + 1) if limit is not None else q).all()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last_row = rows[-1]
+            last_value = last_row[1] if sort_column is Projects.name else last_row[4].isoformat()
+            next_cursor = encode_cursor([last_value, last_row[0]])
+        all_projects = [CoreProjectData(id=row[0],
+                                        name=row[1],
+                                        description=row[2],
+                                        owner=row[3],
+                                        created_on=row[4]) for row in rows]
+        return all_projects, next_cursor
 
     
     def delete(self, project_id: int, db: Session):
         project = db.get(Projects, project_id)
+        # collect everyone with access and the document files before the
+        # rows are cascaded away
+        affected_users = db.execute(select(ProjectAccess.username).where(
+            ProjectAccess.project_id == project_id)).scalars().all()
+        document_keys = db.execute(select(Documents.s3_key).where(
+            Documents.project_id == project_id, Documents.s3_key.is_not(None))).scalars().all()
         db.delete(project)
+        db.flush()
+        self.delete_document_files(release_blobs(db, document_keys))
         db.commit()
+        for username in affected_users:
+            privilege_cache.invalidate(username)
     
 
     def update_info(self, project_id: int,
                     attributes_to_update: dict,
                     db: Session):
         attributes_to_update.update({"updated_on": datetime.now()})
-        q = update(Projects).where(Projects.id == project_id).values(
-            attributes_to_update)
-        db.execute(q)
+        project = self.load_project(project_id, db)
+        for attribute, value in attributes_to_update.items():
+            setattr(project, attribute, value)
+        db.flush()
+        project_repr = self.project_to_schema(project)
         db.commit()
-        return self.get(project_id, db)
+        return project_repr
     
 
     def get_project_internal(self, project_id: int, db: Session) -> None:
@@ -116,8 +226,8 @@ class DbProjectHandler(ProjectHandlerInterface):
     
     @staticmethod
     def grant_access(project_id: int, username: str, db: Session):
-        owned, participating = DbProjectHandler.get_project_privileges(db=db, username=username)
-        if project_id in participating:
+        privileges = DbProjectHandler.get_project_privileges(db=db, username=username)
+        if project_id in privileges.participating:
             raise HTTPException(status_code=400,
                                 detail="User already participating in the project")
         new_access = ProjectAccess(project_id=project_id,
@@ -125,6 +235,7 @@ class DbProjectHandler(ProjectHandlerInterface):
                                    access_type="participant")
         db.add(new_access)
         db.commit()
+        privilege_cache.invalidate(username)
         perm = ProjectPermission(project_id=project_id,
                                  username=username,
                                  role="participant")
@@ -132,16 +243,38 @@ class DbProjectHandler(ProjectHandlerInterface):
         
 
     @staticmethod
-    def get_project_privileges(db: Session, username: str):
-        owned_projects = db.execute(select(ProjectAccess.project_id)
-                                             .where((ProjectAccess.username == username) &
-                                                    (ProjectAccess.access_type == 'owner')))
-        participant_projects = db.execute(select(ProjectAccess.project_id)
-                                    .where((ProjectAccess.username == username) & 
-                                           (ProjectAccess.access_type == 'participant')))
-        list_owned_projects = [row[0] for row in owned_projects]
-        list_participant_projects = [row[0] for row in participant_projects]
-        return list_owned_projects, list_participant_projects
+    def grant_access_many(project_id: int, usernames: list[str], db: Session) -> BatchInviteResult:
+        # a single INSERT ... SELECT adds every requested user that exists
+        # and has no access to the project yet; duplicates are filtered by
+        # the database instead of looking each user up first
+        requested = set(usernames)
+        already_has_access = exists().where(ProjectAccess.project_id == project_id,
+                                            ProjectAccess.username == Users.username)
+        new_participants = (select(literal(project_id), Users.username, literal("participant"))
+                            .where(Users.username.in_(requested), ~already_has_access))
+        granted = db.execute(insert(ProjectAccess)
+                             .from_select(["project_id", "username", "access_type"], new_participants)
+                             .returning(ProjectAccess.username)).scalars().all()
+        db.commit()
+        for username in granted:
+            privilege_cache.invalidate(username)
+        return BatchInviteResult(
+            granted=[ProjectPermission(project_id=project_id,
+                                       username=username,
+                                       role="participant") for username in sorted(granted)],
+            skipped=sorted(requested.difference(granted)))
+
+
+    @staticmethod
+    def get_project_privileges(db: Session, username: str) -> ProjectPrivileges:
+        # owner and participant rows are fetched together and split by type
+        access_rows = db.execute(select(ProjectAccess.project_id,
+                                        ProjectAccess.access_type)
+                                 .where(ProjectAccess.username == username)).all()
+        owned_projects = frozenset(row[0] for row in access_rows if row[1] == 'owner')
+        participant_projects = frozenset(row[0] for row in access_rows if row[1] == 'participant')
+        return ProjectPrivileges(owned=owned_projects,
+                                 participating=participant_projects)
 
 
     def associate_document(self,
@@ -149,47 +282,206 @@ class DbProjectHandler(ProjectHandlerInterface):
                            doc_name: str,
                            content_type: str,
                            caller: str,
-                           byfile: bytes,
+                           byfile: BinaryIO,
                            db: Session):
-        # generate unique uuid
-        new_s3_key = uuid4()
-        query_for_same_uuid = db.execute(select(Documents).where(Documents.s3_key == str(new_s3_key)))
-        # if there is a document with the same key, re-generate the key
-        while query_for_same_uuid.all() != []:
-            # even though here the database is again called in a loop,
-            # the probability of the same uuid being generated twice is tiny.
-            # So, this part of the code probably won't be executed ever, but
-            # it's still here to prevent key collisions from happening
-            new_s3_key = uuid4()
-            query_for_same_uuid = db.execute(select(Documents).where(Documents.s3_key == str(new_s3_key)))
-        
+        # documents are stored under the hash of their content, a file that
+        # is already in the bucket only gets another reference
+        key = io_executor.call(content_key, byfile)
         new_document = Documents(name=reformat_filename(doc_name),
                                  project_id=project_id,
                                  added_by=caller,
                                  content_type=content_type,
-                                 s3_key=str(new_s3_key),
+                                 s3_key=key,
                                  added_on=datetime.now())
-        db.add(new_document)
-        # upload to s3
-        s3_service = S3Service(self.documents_bucket)
         try:
-            s3_service.upload_file_to_s3(key=str(new_s3_key),
-                                         bin_file=byfile,
-                                         content_type=content_type)
+            is_new = key in acquire_blobs(db, [key])
+            db.add(new_document)
+            db.flush()
+            # upload to s3
+            if is_new:
+                storage = get_storage(self.documents_bucket)
+                storage.upload_file(key=key,
+                                    bin_file=byfile,
+                                    content_type=content_type)
         except Exception as ex:
             logger.error(f"Failed to upload document for project {project_id}")
+            db.rollback()
             raise ex
-        
+        document_repr = ProjectDocument(id=new_document.id,
+                                        name=new_document.name,
+                                        added_by=new_document.added_by,
+                                        added_on=new_document.added_on,
+                                        content_type=new_document.content_type,
+                                        project_id=new_document.project_id)
         # commit added document only if upload to s3 was successful
         db.commit()
-        # return the created document to the user
-        final_document = db.get(Documents, new_document.id)
-        return ProjectDocument(id=final_document.id,
-                               name=final_document.name,
-                               added_by=final_document.added_by,
-                               added_on=final_document.added_on,
-                               content_type=final_document.content_type,
-                               project_id=final_document.project_id)
+        return document_repr
+
+
+    def upload_documents(self,
+                         files: list[tuple[str, str, BinaryIO]],
+                         keys: list[str],
+                         new_keys: set[str]) -> list[DocumentUpload]:
+        # files of (name, content type, file object) whose content key is
+        # new are sent to s3 in parallel on the shared io executor; a failed
+        # file doesn't stop the others
+        storage = get_storage(self.documents_bucket)
+        pending = {}
+        in_flight = Semaphore(self.batch_upload_concurrency)
+        for (doc_name, content_type, byfile), key in zip(files, keys):
+            # a file repeated within the batch is sent once
+            if key in new_keys and key not in pending:
+                # runs on a plain thread, waiting here doesn't block the loop
+                in_flight.acquire()
+                pending[key] = io_executor.submit(storage.upload_file,
+                                                  key=key,
+                                                  bin_file=byfile,
+                                                  content_type=content_type)
+                pending[key].add_done_callback(lambda _: in_flight.release())
+        wait(pending.values())
+        uploads = []
+        for (doc_name, content_type, _), key in zip(files, keys):
+            error = pending[key].exception() if key in pending else None
+            uploads.append(DocumentUpload(name=doc_name,
+                                          content_type=content_type,
+                                          s3_key=key,
+                                          error=None if error is None else str(error),
+                                          new_blob=key in new_keys))
+        return uploads
+
+
+    def delete_document_files(self, keys: list[str]) -> None:
+        # best effort, a file left behind only costs storage
+        storage = get_storage(self.documents_bucket)
+        for key in keys:
+            try:
+                storage.delete_file(key)
+            except Exception:
+                logger.error(f"Failed to delete document file {key}")
+
+
+    def save_documents(self,
+                       project_id: int,
+                       caller: str,
+                       uploads: list[DocumentUpload],
+                       db: Session) -> list[DocumentUploadResult]:
+        # rows of all uploaded files are inserted by one INSERT ... RETURNING,
+        # the references taken for files that failed are given back
+        added_on = datetime.now()
+        uploaded = [upload for upload in uploads if upload.error is None]
+        release_blobs(db, [upload.s3_key for upload in uploads if upload.error is not None])
+        ids = []
+        if uploaded:
+            try:
+                ids = db.execute(
+                    insert(Documents).returning(Documents.id, sort_by_parameter_order=True),
+                    [{"name": reformat_filename(upload.name),
+                      "project_id": project_id,
+                      "added_by": caller,
+                      "content_type": upload.content_type,
+                      "s3_key": upload.s3_key,
+                      "added_on": added_on} for upload in uploaded]).scalars().all()
+                db.commit()
+            except Exception as ex:
+                logger.error(f"Failed to save uploaded documents for project {project_id}")
+                # don't leave files in the bucket that no document points to,
+                # deleted while the new blobs are still locked
+                self.delete_document_files({upload.s3_key for upload in uploaded if upload.new_blob})
+                db.rollback()
+                raise ex
+        else:
+            db.commit()
+        ids = iter(ids)
+        results = []
+        for upload in uploads:
+            if upload.error is not None:
+                logger.error(f"Failed to upload document '{upload.name}' for project {project_id}")
+                results.append(DocumentUploadResult(filename=upload.name,
+                                                    uploaded=False,
+                                                    error=upload.error))
+                continue
+            document = ProjectDocument(id=next(ids),
+                                       name=reformat_filename(upload.name),
+                                       added_by=caller,
+                                       added_on=added_on,
+                                       content_type=upload.content_type,
+                                       project_id=project_id)
+            results.append(DocumentUploadResult(filename=upload.name,
+                                                uploaded=True,
+                                                document=document))
+        return results
+
+
+    def associate_documents(self,
+                            project_id: int,
+                            files: list[tuple[str, str, BinaryIO]],
+                            caller: str,
+                            db: Session) -> list[DocumentUploadResult]:
+        keys = [content_key(byfile) for *_, byfile in files]
+        new_keys = acquire_blobs(db, keys)
+        uploads = self.upload_documents(files, keys, new_keys)
+        return self.save_documents(project_id, caller, uploads, db)
+
+
+    def presign_document_upload(self,
+                                project_id: int,
+                                doc_name: str,
+                                content_type: str,
+                                caller: str) -> PresignedTransfer:
+        # the row is only written by complete_document_upload, once the
+        # client has put the file in the bucket
+        new_s3_key = generate_s3_key()
+        storage = get_storage(self.documents_bucket)
+        url, headers = storage.presign_upload(key=new_s3_key,
+                                              content_type=content_type,
+                                              expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+        upload_token = create_upload_token({"sub": caller,
+                                            "kind": "document",
+                                            "project": project_id,
+                                            "key": new_s3_key,
+                                            "name": reformat_filename(doc_name),
+                                            "content_type": content_type})
+        return PresignedTransfer(url=url,
+                                 method="PUT",
+                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS,
+                                 headers=headers,
+                                 upload_token=upload_token)
+
+
+    def complete_document_upload(self,
+                                 project_id: int,
+                                 upload_token: str,
+                                 caller: str,
+                                 db: Session) -> ProjectDocument:
+        upload = decode_upload_token(upload_token, kind="document", username=caller)
+        if upload["project"] != project_id:
+            raise HTTPException(status_code=400,
+                                detail="Invalid upload token")
+        storage = get_storage(self.documents_bucket)
+        if not storage.file_exists(upload["key"]):
+            raise HTTPException(status_code=409,
+                                detail="Document was not uploaded yet")
+        if upload["key"] not in acquire_blobs(db, [upload["key"]]):
+            # the random key is already referenced, the token was used
+            db.rollback()
+            raise HTTPException(status_code=400,
+                                detail="Upload already completed")
+        new_document = Documents(name=upload["name"],
+                                 project_id=project_id,
+                                 added_by=caller,
+                                 content_type=upload["content_type"],
+                                 s3_key=upload["key"],
+                                 added_on=datetime.now())
+        db.add(new_document)
+        db.flush()
+        document_repr = ProjectDocument(id=new_document.id,
+                                        name=new_document.name,
+                                        added_by=new_document.added_by,
+                                        added_on=new_document.added_on,
+                                        content_type=new_document.content_type,
+                                        project_id=new_document.project_id)
+        db.commit()
+        return document_repr
 
 
     def get_docs(self,
@@ -216,52 +508,174 @@ class DbProjectHandler(ProjectHandlerInterface):
     def upload_logo(self,
                     project_id: int,
                     logo_name: str,
-                    b_content: bytes,
+                    b_content: BinaryIO,
                     logo_poster:str,
                     content_type: str,
                     db: Session) -> ProjectLogo:
         clean_user_provided_name = reformat_filename(logo_name)
         logo_key = generate_logo_key(clean_user_provided_name, project_id)
+        upload_time = datetime.now()
+        previous_version = self.logo_version(db.get(Projects, project_id))
         q = update(Projects).where(Projects.id == project_id).values(
                 {"logo": logo_key,
+                 "logo_updated_on": upload_time,
                  "updated_by": logo_poster,
-                 "updated_on": datetime.now()}
+                 "updated_on": upload_time}
             )
-        s3_service_raw = S3Service(self.raw_logos_bucket)
+        raw_storage = get_storage(self.raw_logos_bucket)
         try:
             db.execute(q)
-            s3_service_raw.upload_file_to_s3(key=logo_key, 
-                                             bin_file=b_content,
-                                             content_type=content_type)
+            raw_storage.upload_file(key=logo_key, 
+                                    bin_file=b_content,
+                                    content_type=content_type)
         except Exception as ex:
             logger.error(f"Failed to upload logo for project {project_id}")
             raise ex
         else:
             # commit update of logo field only if upload finished successfully
             db.commit()
-        updated_proj = db.get(Projects, project_id)
-        name_for_user = get_logo_name_for_user(updated_proj.logo, project_id)
-        return ProjectLogo(project_id=updated_proj.id,
+            self.invalidate_logo(previous_version)
+            # without the resize lambda the logo is resized in process
+            logo_resize_worker.submit(logo_key)
+        name_for_user = get_logo_name_for_user(logo_key, project_id)
+        return ProjectLogo(project_id=project_id,
                            logo_name=name_for_user,
-                           uploaded_by=updated_proj.updated_by,
-                           uploaded_on=updated_proj.updated_on)
+                           uploaded_by=logo_poster,
+                           uploaded_on=upload_time)
     
 
+    def presign_logo_upload(self,
+                            project_id: int,
+                            logo_name: str,
+                            content_type: str,
+                            logo_poster: str) -> PresignedTransfer:
+        logo_key = generate_logo_key(reformat_filename(logo_name), project_id)
+        raw_storage = get_storage(self.raw_logos_bucket)
+        url, headers = raw_storage.presign_upload(key=logo_key,
+                                                  content_type=content_type,
+                                                  expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+        upload_token = create_upload_token({"sub": logo_poster,
+                                            "kind": "logo",
+                                            "project": project_id,
+                                            "key": logo_key})
+        return PresignedTransfer(url=url,
+                                 method="PUT",
+                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS,
+                                 headers=headers,
+                                 upload_token=upload_token)
+
+
+    def complete_logo_upload(self,
+                             project_id: int,
+                             upload_token: str,
+                             logo_poster: str,
+                             db: Session) -> ProjectLogo:
+        upload = decode_upload_token(upload_token, kind="logo", username=logo_poster)
+        if upload["project"] != project_id:
+            raise HTTPException(status_code=400,
+                                detail="Invalid upload token")
+        logo_key = upload["key"]
+        raw_storage = get_storage(self.raw_logos_bucket)
+        if not raw_storage.file_exists(logo_key):
+            raise HTTPException(status_code=409,
+                                detail="Logo was not uploaded yet")
+        upload_time = datetime.now()
+        previous_version = self.logo_version(db.get(Projects, project_id))
+        db.execute(update(Projects).where(Projects.id == project_id).values(
+                {"logo": logo_key,
+                 "logo_updated_on": upload_time,
+                 "updated_by": logo_poster,
+                 "updated_on": upload_time}
+            ))
+        db.commit()
+        self.invalidate_logo(previous_version)
+        logo_resize_worker.submit(logo_key)
+        return ProjectLogo(project_id=project_id,
+                           logo_name=get_logo_name_for_user(logo_key, project_id),
+                           uploaded_by=logo_poster,
+                           uploaded_on=upload_time)
+
+
+    @staticmethod
+    def logo_version(project: Projects) -> tuple:
+        # a logo is cached under its key and the time it was uploaded, so a
+        # logo replaced by another worker process is a miss in this one.
+        # updated_on can't be used, editing the project changes it too
+        return (project.logo, project.logo_updated_on)
+
+
+    @staticmethod
+    def invalidate_logo(version: tuple) -> None:
+        # the resized logo itself and every size and format requested of it
+        logo_cache.invalidate(version)
+        for size, rendition_format in all_renditions():
+            logo_cache.invalidate((*version, size, rendition_format))
+
+
     def download_logo(self,
                       project_id: int,
-                      db: Session):
+                      db: Session,
+                      size: int | None = None,
+                      accept: str | None = None) -> tuple[str, CachedFile]:
         proj = db.get(Projects, project_id)
         if proj.logo is None:
             raise HTTPException(status_code=404,
                                 detail=f"Project with id {project_id} doesn't have a logo")
         name_for_user = get_logo_name_for_user(proj.logo, project_id)
-        s3_service_processed = S3Service(self.processed_logos_bucket)
-        try:
-            contents = s3_service_processed.download_file_from_s3(key=proj.logo)
-        except Exception as ex:
-            logger.error(f"Failed to download logo for project {project_id}")
-            raise ex
-        return name_for_user, contents
+        version = self.logo_version(proj)
+        formats = accepted_formats(accept)
+        # files tried in turn; the resized logo without a rendition is last,
+        # logos resized before renditions were written only have that one
+        candidates = [(proj.logo, "application/octet-stream")]
+        cache_key = version
+        if size is not None or formats:
+            size = choose_size(size)
+            rendition_formats = [*formats, FALLBACK_FORMAT]
+            cache_key = (*version, size, rendition_formats[0])
+            candidates = [(rendition_key(proj.logo, size, rendition_format),
+                           rendition_media_type(proj.logo, rendition_format))
+                          for rendition_format in rendition_formats] + candidates
+        logo = logo_cache.get(cache_key)
+        if logo is not None:
+            return rendition_filename(name_for_user, logo.media_type), logo
+        processed_storage = get_storage(self.processed_logos_bucket)
+        for position, (key, media_type) in enumerate(candidates):
+            try:
+                stream = processed_storage.stream_file(key=key)
+                content = read_stream(stream)
+            except FileNotFoundError:
+                if position < len(candidates) - 1:
+                    continue
+                # uploaded, but the resizer hasn't written it yet
+                raise HTTPException(status_code=404,
+                                    detail=f"Logo of project {project_id} is not resized yet")
+            except Exception as ex:
+                logger.error(f"Failed to download logo for project {project_id}")
+                raise ex
+            break
+        logo = CachedFile.from_content(content, last_modified=stream.last_modified, media_type=media_type)
+        # the resized logo is written some time after the upload; until then
+        # the bucket may still hold the previous one, which isn't cached
+        if (stream.last_modified is None or proj.logo_updated_on is None
+                or stream.last_modified >= proj.logo_updated_on.replace(microsecond=0).astimezone(timezone.utc)):
+            logo_cache.set(cache_key, logo, nbytes=len(content))
+        return rendition_filename(name_for_user, media_type), logo
+    
+
+    def presign_logo_download(self,
+                              project_id: int,
+                              db: Session) -> PresignedTransfer:
+        proj = db.get(Projects, project_id)
+        if proj.logo is None:
+            raise HTTPException(status_code=404,
+                                detail=f"Project with id {project_id} doesn't have a logo")
+        processed_storage = get_storage(self.processed_logos_bucket)
+        url = processed_storage.presign_download(key=proj.logo,
+                                                 filename=get_logo_name_for_user(proj.logo, project_id),
+                                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+        return PresignedTransfer(url=url,
+                                 method="GET",
+                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
     
 
     def delete_logo(self,
@@ -269,15 +683,19 @@ class DbProjectHandler(ProjectHandlerInterface):
                     user_calling: str,
                     db: Session):
         proj = db.get(Projects, project_id)
-        s3_service_raw = S3Service(self.raw_logos_bucket)
-        s3_service_processed = S3Service(self.processed_logos_bucket)
+        previous_version = self.logo_version(proj)
+        raw_storage = get_storage(self.raw_logos_bucket)
+        processed_storage = get_storage(self.processed_logos_bucket)
         try:
-            # delete from bucket with resized
-            s3_service_processed.delete_file_from_s3(proj.logo)
+            # delete from bucket with resized, every rendition included
+            processed_storage.delete_file(proj.logo)
+            for size, rendition_format in all_renditions():
+                processed_storage.delete_file(rendition_key(proj.logo, size, rendition_format))
             # delete from bucket with original images
-            s3_service_raw.delete_file_from_s3(proj.logo)
+            raw_storage.delete_file(proj.logo)
             q = update(Projects).where(Projects.id == project_id).values(
                 {"logo": None,
+                 "logo_updated_on": None,
                  "updated_by": user_calling,
                  "updated_on": datetime.now()}
             )
@@ -287,6 +705,7 @@ class DbProjectHandler(ProjectHandlerInterface):
             raise ex
         else:
             db.commit()
+            self.invalidate_logo(previous_version)
     
 
     def email_invite(self,
@@ -1,13 +1,18 @@
+from typing import BinaryIO
 from fastapi import HTTPException
 from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 from src.logs.logger import get_logger
-from .documents_utils import S3Service
+from .aws_utils import io_executor
+from .content_store import acquire_blobs, content_key, release_blobs
+from .storage_factory import get_storage
 from .project_manager_tables import Documents, Projects
 from src.routers.documents.schemas import Document
+from src.routers.project.schemas import PresignedTransfer
 from datetime import datetime
-from .common_utils import reformat_filename
+from .common_utils import generate_s3_key, reformat_filename
+from .transfer_utils import PRESIGNED_URL_EXPIRY_SECONDS, create_upload_token, decode_upload_token
 from dotenv import load_dotenv
 import os
 
@@ -18,26 +23,38 @@ logger = get_logger(__name__)
 
 class DocumentHandler():
     @staticmethod
-    def download_document(document_id: int, db: Session):
+    def download_document(document_id: int, db: Session, byte_range: str | None = None):
         doc = db.get(Documents, document_id)
         key = doc.s3_key
         name = doc.name
         content_type = doc.content_type
-        s3_service = S3Service(DOCUMENTS_BUCKET)
+        storage = get_storage(DOCUMENTS_BUCKET)
         try:
-            contents = s3_service.download_file_from_s3(key=key)
+            stream = storage.stream_file(key=key, byte_range=byte_range)
         except Exception as ex:
             logger.error(f"Failed to download document {document_id}")
             raise ex
-        return (name, content_type, contents)
+        return (name, content_type, stream)
     
 
+    @staticmethod
+    def presign_download(document_id: int, db: Session) -> PresignedTransfer:
+        doc = db.get(Documents, document_id)
+        storage = get_storage(DOCUMENTS_BUCKET)
+        url = storage.presign_download(key=doc.s3_key,
+                                       filename=doc.name,
+                                       expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+        return PresignedTransfer(url=url,
+                                 method="GET",
+                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+
+
     @staticmethod
     def update_document(document_id: int,
                         doc_name: str,
                         content_type: str,
                         updating_user: str,
-                        b_content: bytes,
+                        b_content: BinaryIO,
                         db: Session):
         # create dict of attributes to update
         fields_to_update = {"name": reformat_filename(doc_name),
@@ -45,36 +62,104 @@ class DocumentHandler():
                             "content_type": content_type,
                             "added_on": datetime.now()}
         # get s3_key from db
-        key = db.get(Documents, document_id).s3_key
-        s3_service = S3Service(DOCUMENTS_BUCKET)
+        doc = db.get(Documents, document_id)
+        old_key = doc.s3_key
+        project_id = doc.project_id
+        # the new version is stored under the hash of its content
+        new_key = io_executor.call(content_key, b_content)
+        storage = get_storage(DOCUMENTS_BUCKET)
         try:
             q = update(Documents).where(Documents.id == document_id).values(
-                fields_to_update)
+                {**fields_to_update, "s3_key": new_key})
             db.execute(q)
-            # try uploading new doc with old key to s3
-            s3_service.upload_file_to_s3(key=key, bin_file=b_content, content_type=content_type)
+            if new_key != old_key:
+                if new_key in acquire_blobs(db, [new_key]):
+                    storage.upload_file(key=new_key, bin_file=b_content, content_type=content_type)
+                # the old version is deleted unless other documents share it
+                for key in release_blobs(db, [old_key]):
+                    storage.delete_file(key=key)
         except Exception as ex:
             logger.error(f"Failed to update document {document_id}")
             raise ex
         else:
             # if upload was successful, commit db changes
             db.commit()
-        # return updated document object
-        updated_doc = db.get(Documents, document_id)
-        return Document(id=updated_doc.id,
-                        name=updated_doc.name,
-                        added_by=updated_doc.added_by,
-                        added_on=updated_doc.added_on,
-                        project_id=updated_doc.project_id,
-                        content_type=updated_doc.content_type)
+        # return updated document object built from the written values
+        return Document(id=document_id,
+                        project_id=project_id,
+                        **fields_to_update)
         
 
+    @staticmethod
+    def presign_update(document_id: int,
+                       doc_name: str,
+                       content_type: str,
+                       updating_user: str,
+                       db: Session) -> PresignedTransfer:
+        # the new version gets a key of its own, as other documents may
+        # share the old file; the row is updated by complete_update once the
+        # client reports the upload as done
+        new_s3_key = generate_s3_key()
+        storage = get_storage(DOCUMENTS_BUCKET)
+        url, headers = storage.presign_upload(key=new_s3_key,
+                                              content_type=content_type,
+                                              expires_in=PRESIGNED_URL_EXPIRY_SECONDS)
+        upload_token = create_upload_token({"sub": updating_user,
+                                            "kind": "document_update",
+                                            "document": document_id,
+                                            "key": new_s3_key,
+                                            "name": reformat_filename(doc_name),
+                                            "content_type": content_type})
+        return PresignedTransfer(url=url,
+                                 method="PUT",
+                                 expires_in=PRESIGNED_URL_EXPIRY_SECONDS,
+                                 headers=headers,
+                                 upload_token=upload_token)
+
+
+    @staticmethod
+    def complete_update(document_id: int,
+                        upload_token: str,
+                        updating_user: str,
+                        db: Session):
+        upload = decode_upload_token(upload_token, kind="document_update", username=updating_user)
+        if upload["document"] != document_id:
+            raise HTTPException(status_code=400,
+                                detail="Invalid upload token")
+        storage = get_storage(DOCUMENTS_BUCKET)
+        if not storage.file_exists(upload["key"]):
+            raise HTTPException(status_code=409,
+                                detail="Document was not uploaded yet")
+        if upload["key"] not in acquire_blobs(db, [upload["key"]]):
+            # the random key is already referenced, the token was used
+            db.rollback()
+            raise HTTPException(status_code=400,
+                                detail="Upload already completed")
+        fields_to_update = {"name": upload["name"],
+                            "added_by": updating_user,
+                            "content_type": upload["content_type"],
+                            "added_on": datetime.now()}
+        doc = db.get(Documents, document_id)
+        project_id = doc.project_id
+        old_key = doc.s3_key
+        db.execute(update(Documents).where(Documents.id == document_id).values(
+            {**fields_to_update, "s3_key": upload["key"]}))
+        for key in release_blobs(db, [old_key]):
+            storage.delete_file(key=key)
+        db.commit()
+        return Document(id=document_id,
+                        project_id=project_id,
+                        **fields_to_update)
+
+
     @staticmethod
     def delete_document(document_id: int, db: Session):
         doc = db.get(Documents, document_id)
-        s3_service = S3Service(DOCUMENTS_BUCKET)
+        storage = get_storage(DOCUMENTS_BUCKET)
         try:
-            s3_service.delete_file_from_s3(key=doc.s3_key)
+            # the file goes with the last document that references it
+            for key in release_blobs(db, [doc.s3_key]):
+                storage.delete_file(key=key)
         except Exception as ex:
             logger.error(f"Failed to delete document {document_id}")
             raise ex
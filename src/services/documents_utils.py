@@ -1,21 +1,214 @@
-import boto3
+from datetime import datetime
+from email.utils import format_datetime
+import hashlib
+import io
+import os
+import re
+from typing import BinaryIO, NamedTuple
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette import status
 
 from src.logs.logger import get_logger
+from src.services.aws_utils import get_client, io_executor
+from src.services.cache_utils import LRUCache
+from src.services.request_timing import timed
+from src.services.storage_interface import BlobStorage
 
 logger = get_logger(__name__)
+load_dotenv()
+MB = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("S3_DOWNLOAD_CHUNK_KB", 64)) * 1024
+# S3 only serves a single byte range per GET
+SINGLE_RANGE = re.compile(r"^bytes=(\d+-\d*|-\d+)$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# browsers revalidate their copy of a logo on every use and get a 304 back
+# while it is unchanged; private because logos require authorization
+LOGO_CACHE_CONTROL = os.getenv("LOGO_CACHE_CONTROL", "private, no-cache")
 
-class S3Service():
+def get_transfer_config() -> TransferConfig:
+    # files above the threshold are sent as multipart uploads; at most
+    # part size * concurrency bytes of a file are held in memory at once
+    return TransferConfig(
+        multipart_threshold=int(float(os.getenv("S3_MULTIPART_THRESHOLD_MB", 8)) * MB),
+        multipart_chunksize=int(float(os.getenv("S3_MULTIPART_PART_SIZE_MB", 8)) * MB),
+        max_concurrency=int(os.getenv("S3_MULTIPART_CONCURRENCY", 4)))
+
+
+class DocumentUpload(NamedTuple):
+    """
+        Outcome of sending one file of a bulk upload to s3. error is None
+        when the file is in the bucket under s3_key. new_blob is set when
+        the file was sent by this upload rather than already stored.
+    """
+    name: str
+    content_type: str
+    s3_key: str
+    error: str | None = None
+    new_blob: bool = False
+
+
+class S3FileStream():
+    """
+        Body of an S3 object together with the metadata needed to forward it
+        in an HTTP response. The body is read lazily in chunks.
+    """
+    def __init__(self, body, content_length: int, etag: str = None,
+                 last_modified=None, content_range: str = None) -> None:
+        self.body = body
+        self.content_length = content_length
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_range = content_range
+
+    def iter_chunks(self):
+        try:
+            yield from self.body.iter_chunks(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        finally:
+            self.body.close()
+
+
+@timed("storage")
+def read_stream(stream) -> bytes:
+    # for files kept in memory (logos); the body is read on the io executor
+    # and, unlike a streamed response, counts towards the request's storage time
+    return io_executor.call(lambda: b"".join(stream.iter_chunks()))
+
+
+def get_byte_range(range_header: str | None) -> str | None:
+    # multi-range or malformed headers are ignored and the whole file is sent
+    if range_header is not None and SINGLE_RANGE.match(range_header.strip()):
+        return range_header.strip()
+    return None
+
+
+class CachedFile(NamedTuple):
+    """
+        Complete contents of a small file kept in memory, such as a logo.
+        etag is a strong validator derived from the contents.
+    """
+    content: bytes
+    etag: str
+    last_modified: datetime | None = None
+    media_type: str = "application/octet-stream"
+
+    @classmethod
+    def from_content(cls, content: bytes, last_modified: datetime | None = None,
+                     media_type: str = "application/octet-stream"):
+        return cls(content=content,
+                   etag=f'"{hashlib.sha256(content).hexdigest()[:32]}"',
+                   last_modified=last_modified,
+                   media_type=media_type)
+
+
+# resized logos are small and shown on every dashboard, so they are served
+# from memory within a byte budget
+logo_cache = LRUCache(max_size=int(os.getenv("LOGO_CACHE_MAX_ENTRIES", 10000)),
+                      ttl=float(os.getenv("LOGO_CACHE_TTL_SECONDS", 3600)),
+                      max_bytes=int(float(os.getenv("LOGO_CACHE_MAX_MB", 32)) * MB))
+
+
+def parse_byte_range(byte_range: str, size: int) -> tuple[int, int]:
+    # same rules as s3: start-end, start- or -suffix_length, end inclusive
+    match = BYTE_RANGE.match(byte_range)
+    start, end = 0, 0
+    if match is not None and match.groups() != ("", ""):
+        first, last = match.groups()
+        if first == "":
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = size if last == "" else min(int(last) + 1, size)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Requested range not satisfiable")
+    return start, end
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    if if_none_match is None:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def cached_file_response(file: CachedFile,
+                         filename: str,
+                         content_type: str,
+                         byte_range: str | None = None,
+                         if_none_match: str | None = None,
+                         cache_control: str = LOGO_CACHE_CONTROL) -> Response:
+    headers = {"ETag": file.etag,
+               "Cache-Control": cache_control}
+    if file.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(file.last_modified, usegmt=True)
+    if etag_matches(if_none_match, file.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    headers.update({"Content-Disposition": f"attachment;filename={filename}",
+                    "Content-Type": content_type,
+                    "Accept-Ranges": "bytes"})
+    content = file.content
+    status_code = status.HTTP_200_OK
+    if byte_range is not None:
+        start, end = parse_byte_range(byte_range, len(content))
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(content)}"
+        content = content[start:end]
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    return Response(content=content,
+                    status_code=status_code,
+                    media_type=content_type,
+                    headers=headers)
+
+
+def stream_response(stream: S3FileStream, filename: str, content_type: str) -> StreamingResponse:
+    headers = {"Content-Disposition": f"attachment;filename={filename}",
+               "Content-Type": content_type,
+               "Content-Length": str(stream.content_length),
+               "Accept-Ranges": "bytes"}
+    if stream.etag is not None:
+        headers["ETag"] = stream.etag
+    if stream.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(stream.last_modified, usegmt=True)
+    status_code = status.HTTP_200_OK
+    if stream.content_range is not None:
+        headers["Content-Range"] = stream.content_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    return StreamingResponse(stream.iter_chunks(),
+                             status_code=status_code,
+                             media_type=content_type,
+                             headers=headers)
+
+
+class S3Service(BlobStorage):
     """
-        Class for managing communication with s3 buckets
+        Storage backend for s3 buckets. Calls to s3 go through the shared
+        io executor, so they never block the event loop.
     """
+    transfer_config = get_transfer_config()
+
     def __init__(self, bucket_name: str) -> None:
         self.bucket_name = bucket_name
-        self.s3 = boto3.resource('s3')
+        # shared client, constructing a service is free
+        self.s3 = get_client('s3')
     
-    def upload_file_to_s3(self, key: str, bin_file: bytes, content_type: str):
-        bucket = self.s3.Bucket(self.bucket_name)
+    @timed("storage")
+    def upload_file(self, key: str, bin_file: BinaryIO | bytes, content_type: str):
+        # file objects are read and sent in parts, bytes are wrapped so both
+        # go through the same managed transfer
+        if isinstance(bin_file, (bytes, bytearray)):
+            bin_file = io.BytesIO(bin_file)
         try:
-            bucket.put_object(Key=key, Body=bin_file, ContentType=content_type, Metadata={'Content-Type': content_type})
+            io_executor.call(self.s3.upload_fileobj,
+                             Fileobj=bin_file,
+                             Bucket=self.bucket_name,
+                             Key=key,
+                             ExtraArgs={"ContentType": content_type,
+                                        "Metadata": {"Content-Type": content_type}},
+                             Config=self.transfer_config)
         except Exception as ex:
             logger.error(f"Failed to upload file to S3. Error message: {ex}")
             raise ex
@@ -23,17 +216,87 @@ class S3Service():
             return True
         
 
-    def download_file_from_s3(self, key: str):
+    @timed("storage")
+    def download_file(self, key: str):
         try:
-            return self.s3.Object(bucket_name=self.bucket_name, key=key).get()['Body'].read()
+            return io_executor.call(lambda: self.s3.get_object(Bucket=self.bucket_name, Key=key)['Body'].read())
         except Exception as ex:
             logger.error(f"Failed to download from S3. Error message: {ex}")
             raise ex
     
 
-    def delete_file_from_s3(self, key: str):
+    @timed("storage")
+    def stream_file(self, key: str, byte_range: str | None = None) -> S3FileStream:
+        get_args = {}
+        if byte_range is not None:
+            get_args["Range"] = byte_range
+        try:
+            # only the request runs on the executor, the body is read while
+            # the response is streamed
+            response = io_executor.call(self.s3.get_object, Bucket=self.bucket_name, Key=key, **get_args)
+        except ClientError as ex:
+            error_code = ex.response.get("Error", {}).get("Code")
+            if error_code == "InvalidRange":
+                raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                                    detail="Requested range not satisfiable")
+            if error_code in ("404", "NoSuchKey"):
+                # same as a missing file of the local backend
+                raise FileNotFoundError(key) from ex
+            if error_code in ("403", "AccessDenied"):
+                # without s3:ListBucket on the bucket, s3 answers a missing
+                # key with AccessDenied, so it can't be told apart from one
+                logger.warning(f"Access denied to {key} in S3, treated as missing")
+                raise FileNotFoundError(key) from ex
+            logger.error(f"Failed to download from S3. Error message: {ex}")
+            raise ex
+        return S3FileStream(body=response["Body"],
+                            content_length=response["ContentLength"],
+                            etag=response.get("ETag"),
+                            last_modified=response.get("LastModified"),
+                            content_range=response.get("ContentRange"))
+    
+
+    def presign_download(self, key: str, filename: str, expires_in: int) -> str:
+        # the client downloads straight from s3, under the name shown to users
+        return self.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name,
+                    "Key": key,
+                    "ResponseContentDisposition": f"attachment;filename={filename}"},
+            ExpiresIn=expires_in)
+
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int) -> tuple[str, dict]:
+        # content type and metadata are part of the signature, so the client
+        # has to send the returned headers with its PUT
+        url = self.s3.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket_name,
+                    "Key": key,
+                    "ContentType": content_type,
+                    "Metadata": {"Content-Type": content_type}},
+            ExpiresIn=expires_in)
+        headers = {"Content-Type": content_type,
+                   "x-amz-meta-content-type": content_type}
+        return url, headers
+
+
+    @timed("storage")
+    def file_exists(self, key: str) -> bool:
+        try:
+            io_executor.call(self.s3.head_object, Bucket=self.bucket_name, Key=key)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            logger.error(f"Failed to check file in S3. Error message: {ex}")
+            raise ex
+        return True
+
+
+    @timed("storage")
+    def delete_file(self, key: str):
         try:
-            return self.s3.Object(bucket_name=self.bucket_name, key=key).delete()
+            return io_executor.call(self.s3.delete_object, Bucket=self.bucket_name, Key=key)
         except Exception as ex:
             logger.error(f"Failed to delete from S3. Error message: {ex}")
             raise ex
@@ -0,0 +1,207 @@
+import asyncio
+from datetime import datetime, timedelta
+import os
+import time
+from typing import Callable, NamedTuple
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from src.dependecies import get_async_session
+from src.logs.logger import get_logger
+from src.services.aws_utils import NO_TIMEOUT, SESService, io_executor
+from src.services.project_manager_tables import EmailOutbox
+
+load_dotenv()
+logger = get_logger(__name__)
+INVITE_SUBJECT = "Invite to project"
+
+
+class QueuedEmail(NamedTuple):
+    id: int
+    to_address: str
+    subject: str
+    body: str
+
+
+class EmailOutboxHandler():
+    """
+        Database side of the email outbox. Emails are written by the
+        request that creates them and picked up later by the dispatcher.
+    """
+    @staticmethod
+    def enqueue(db: Session, project_id: int, to_address: str, subject: str, body: str) -> int:
+        email = EmailOutbox(project_id=project_id,
+                            to_address=to_address,
+                            subject=subject,
+                            body=body,
+                            status="queued",
+                            attempts=0,
+                            next_attempt_at=datetime.now())
+        db.add(email)
+        db.flush()
+        email_id = email.id
+        db.commit()
+        return email_id
+
+    @staticmethod
+    def get(db: Session, email_id: int, project_id: int) -> EmailOutbox:
+        email = db.get(EmailOutbox, email_id)
+        if email is None or email.project_id != project_id:
+            raise HTTPException(status_code=404,
+                                detail=f"No invite with id {email_id} found")
+        return email
+
+    @staticmethod
+    def claim_due(db: Session, batch_size: int, lease_seconds: float) -> list[QueuedEmail]:
+        # due rows are leased by moving their next attempt into the future,
+        # so other dispatchers skip them while they are being sent. SKIP
+        # LOCKED keeps concurrent dispatchers from waiting on each other
+        now = datetime.now()
+        rows = db.execute(select(EmailOutbox)
+                          .where(EmailOutbox.status == "queued",
+                                 EmailOutbox.next_attempt_at <= now)
+                          .order_by(EmailOutbox.next_attempt_at)
+                          .limit(batch_size)
+                          .with_for_update(skip_locked=True)).scalars().all()
+        emails = []
+        for row in rows:
+            row.next_attempt_at = now + timedelta(seconds=lease_seconds)
+            emails.append(QueuedEmail(id=row.id,
+                                      to_address=row.to_address,
+                                      subject=row.subject,
+                                      body=row.body))
+        db.commit()
+        return emails
+
+    @staticmethod
+    def record_results(db: Session,
+                       results: list[tuple[int, str | None, str | None]],
+                       max_attempts: int,
+                       backoff_seconds: float,
+                       max_backoff_seconds: float) -> None:
+        # results are (email id, message id, error), stored in one transaction
+        now = datetime.now()
+        outcome = {email_id: (message_id, error) for email_id, message_id, error in results}
+        rows = db.execute(select(EmailOutbox).where(EmailOutbox.id.in_(outcome))).scalars().all()
+        for row in rows:
+            message_id, error = outcome[row.id]
+            row.attempts += 1
+            if error is None:
+                row.status = "sent"
+                row.sent_on = now
+                row.message_id = message_id
+                row.last_error = None
+            elif row.attempts >= max_attempts:
+                row.status = "failed"
+                row.last_error = error[:500]
+            else:
+                # exponential backoff between attempts
+                delay = min(backoff_seconds * 2 ** (row.attempts - 1), max_backoff_seconds)
+                row.next_attempt_at = now + timedelta(seconds=delay)
+                row.last_error = error[:500]
+        db.commit()
+
+
+class EmailDispatcher():
+    """
+        Background task that sends queued emails in batches. Sends are spread
+        out to stay under max_send_rate per second (the SES sending quota) and
+        failed ones are retried with exponential backoff. send_email has the
+        signature of SESService.send_email_via_ses, so a stub can stand in
+        for SES.
+    """
+    def __init__(self,
+                 session_factory: Callable = get_async_session,
+                 send_email: Callable = SESService.send_email_via_ses,
+                 batch_size: int = 50,
+                 max_send_rate: float = 14,
+                 max_attempts: int = 5,
+                 backoff_seconds: float = 30,
+                 max_backoff_seconds: float = 3600,
+                 poll_interval: float = 2,
+                 lease_seconds: float = 300) -> None:
+        self.session_factory = session_factory
+        self.send_email = send_email
+        self.batch_size = batch_size
+        self.max_send_rate = max_send_rate
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._next_send_at = 0.0
+        self._task = None
+        self.sent = 0
+        self.failed_attempts = 0
+        self.batches = 0
+
+    async def _send(self, email: QueuedEmail) -> tuple[int, str | None, str | None]:
+        # reserve the next free send slot, shared across batches
+        now = time.monotonic()
+        send_at = max(now, self._next_send_at)
+        self._next_send_at = send_at + 1 / self.max_send_rate
+        await asyncio.sleep(send_at - now)
+        try:
+            # waits for the send to finish, an email given up on while SES
+            # still delivers it would be sent again by the retry
+            message_id = await io_executor.run(self.send_email,
+                                               timeout=NO_TIMEOUT,
+                                               text=email.body,
+                                               to_address=email.to_address,
+                                               subject=email.subject)
+        except Exception as ex:
+            logger.error(f"Failed to send email {email.id}. Error message: {ex}")
+            self.failed_attempts += 1
+            return email.id, None, str(ex) or type(ex).__name__
+        self.sent += 1
+        return email.id, message_id, None
+
+    async def dispatch_batch(self) -> int:
+        async with self.session_factory() as db:
+            emails = await db.run_sync(EmailOutboxHandler.claim_due, self.batch_size, self.lease_seconds)
+        if not emails:
+            return 0
+        results = await asyncio.gather(*[self._send(email) for email in emails])
+        async with self.session_factory() as db:
+            await db.run_sync(EmailOutboxHandler.record_results, results, self.max_attempts,
+                              self.backoff_seconds, self.max_backoff_seconds)
+        self.batches += 1
+        return len(emails)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                dispatched = await self.dispatch_batch()
+            except Exception as ex:
+                logger.error(f"Email dispatcher failed. Error message: {ex}")
+                dispatched = 0
+            # a full batch means there may be more due right away
+            if dispatched < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"running": self._task is not None,
+                "sent": self.sent,
+                "failed_attempts": self.failed_attempts,
+                "batches": self.batches}
+
+
+email_dispatcher = EmailDispatcher(batch_size=int(os.getenv("EMAIL_BATCH_SIZE", 50)),
+                                   max_send_rate=float(os.getenv("SES_MAX_SEND_RATE", 14)),
+                                   max_attempts=int(os.getenv("EMAIL_MAX_ATTEMPTS", 5)),
+                                   backoff_seconds=float(os.getenv("EMAIL_RETRY_BACKOFF_SECONDS", 30)),
+                                   poll_interval=float(os.getenv("EMAIL_POLL_INTERVAL_SECONDS", 2)))
@@ -11,13 +11,16 @@ from src.services.project_manager_tables import Users
 
 load_dotenv()
 SECRET_KEY = os.getenv("JOIN_SECRET_KEY")
+# upload tokens have the transfer audience and are rejected here
+AUDIENCE = "join"
 logger = get_logger(__name__)
 
 def decode_join_token(token: str, db: Session):
     join_exception = HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                    detail="Invalid join token")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        # invites sent before tokens had an aud claim are still accepted
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], audience=AUDIENCE)
     except JWTError:
         logger.error(f"Join token could not be decoded")
         raise join_exception
@@ -52,6 +55,6 @@ def get_user_from_email(email: str,
 def create_join_token(to_encode: dict):
     my_claims = to_encode.copy()
     expire = datetime.now(timezone.utc) + timedelta(days=3)
-    my_claims.update({"exp": expire})
+    my_claims.update({"exp": expire, "aud": AUDIENCE})
     encoded_token = jwt.encode(my_claims, SECRET_KEY, algorithm="HS256")
     return encoded_token
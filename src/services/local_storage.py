@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+import mmap
+import os
+import shutil
+import tempfile
+from typing import BinaryIO
+from fastapi import HTTPException
+from starlette import status
+
+from src.logs.logger import get_logger
+from src.services.aws_utils import io_executor
+from src.services.documents_utils import DOWNLOAD_CHUNK_SIZE, parse_byte_range
+from src.services.request_timing import timed
+from src.services.storage_interface import BlobStorage
+
+logger = get_logger(__name__)
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class LocalFileStream():
+    """
+        Memory-mapped file sent in chunks. Each chunk is a bytes copy of a
+        slice of the mapping, so this isn't zero-copy, but it avoids a read
+        call per chunk. The mapping keeps the opened version of the file
+        alive, so a concurrent replace doesn't change what is being sent.
+    """
+    def __init__(self, path: str, byte_range: str | None = None) -> None:
+        self.file = open(path, "rb")
+        try:
+            file_stat = os.fstat(self.file.fileno())
+            size = file_stat.st_size
+            self.start, self.end = 0, size
+            self.content_range = None
+            if byte_range is not None:
+                self.start, self.end = parse_byte_range(byte_range, size)
+                self.content_range = f"bytes {self.start}-{self.end - 1}/{size}"
+            self.content_length = self.end - self.start
+            # empty files can't be mapped
+            self.body = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except BaseException:
+            self.file.close()
+            raise
+        self.etag = f'"{file_stat.st_mtime_ns:x}-{size:x}"'
+        self.last_modified = datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
+
+    def close(self) -> None:
+        if self.body is not None:
+            self.body.close()
+        self.file.close()
+
+    def iter_chunks(self):
+        try:
+            for position in range(self.start, self.end, DOWNLOAD_CHUNK_SIZE):
+                yield self.body[position:min(position + DOWNLOAD_CHUNK_SIZE, self.end)]
+        finally:
+            self.close()
+
+
+class LocalStorage(BlobStorage):
+    """
+        Files kept in a directory on local disk, one directory per bucket.
+        Writes go to a temporary file that is renamed over the target, so
+        readers never see a partly written file. Disk access from the event
+        loop goes through the io executor like s3 calls do.
+    """
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Invalid file name")
+        return path
+
+    def _write(self, path: str, bin_file: BinaryIO | bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                if isinstance(bin_file, (bytes, bytearray)):
+                    tmp_file.write(bin_file)
+                else:
+                    shutil.copyfileobj(bin_file, tmp_file, COPY_BUFFER_SIZE)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @timed("storage")
+    def upload_file(self, key: str, bin_file: BinaryIO | bytes, content_type: str) -> bool:
+        # content type is stored with the document row, not with the file
+        try:
+            io_executor.call(self._write, self._path(key), bin_file)
+        except Exception as ex:
+            logger.error(f"Failed to write file to local storage. Error message: {ex}")
+            raise ex
+        return True
+
+    def _read(self, path: str) -> bytes:
+        with open(path, "rb") as file:
+            return file.read()
+
+    @timed("storage")
+    def download_file(self, key: str) -> bytes:
+        return io_executor.call(self._read, self._path(key))
+
+    @timed("storage")
+    def stream_file(self, key: str, byte_range: str | None = None) -> LocalFileStream:
+        # chunks are read by the response while it is streamed
+        return io_executor.call(LocalFileStream, self._path(key), byte_range)
+
+    @timed("storage")
+    def file_exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    @timed("storage")
+    def delete_file(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            # deleting a missing s3 object isn't an error either
+            pass
+
+    def presign_download(self, key: str, filename: str, expires_in: int) -> str:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Presigned transfers are not available with local storage")
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int) -> tuple[str, dict]:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Presigned transfers are not available with local storage")
@@ -0,0 +1,55 @@
+import io
+
+try:
+    from PIL import Image
+except ImportError:
+    # the app only needs Pillow when logos are resized there instead of by the lambda
+    Image = None
+
+# this module is shipped in the resize lambda's zip as well, it can't import
+# anything from the app or packages the lambda doesn't have
+
+# same format as the uploaded logo, for clients without avif or webp support
+FALLBACK_FORMAT = "orig"
+
+
+def rendition_key(logo_key: str, size: int, rendition_format: str) -> str:
+    return f"renditions/{logo_key}/{size}.{rendition_format}"
+
+
+def writable_formats(names: list[str]) -> list[str]:
+    # a format the installed Pillow can't write (avif before 11.3) is left
+    # out, so it is neither rendered nor offered to clients
+    if Image is None:
+        return list(names)
+    Image.init()
+    return [name for name in names if name.upper() in Image.SAVE]
+
+
+def create_renditions(content: bytes, sizes: list[int], formats: list[str]) -> dict[tuple[int, str], bytes]:
+    """
+        Every size and format of a logo, from one decode. Used by the resize
+        lambda and by the app's LogoResizeWorker, so both write the same
+        renditions. formats has to be filtered with writable_formats.
+    """
+    sizes = sorted(sizes, reverse=True)
+    renditions = {}
+    with Image.open(io.BytesIO(content)) as image:
+        source_format = image.format
+        # decoded once; JPEGs straight at the 1/2, 1/4 or 1/8 scale that still
+        # covers the largest size, so the full image is never built
+        image.draft(None, (sizes[0], sizes[0]))
+        mode = "RGBA" if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info else "RGB"
+        resized = image.convert(mode) if image.mode != mode else image
+        for size in sizes:
+            # each size is resampled from the next larger one, which is
+            # much cheaper than going back to the source every time. Other
+            # formats are first shrunk by an integer factor with reduce(),
+            # only the last step is a full resample
+            resized = resized.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+            for rendition_format in [*formats, FALLBACK_FORMAT]:
+                output = io.BytesIO()
+                resized.save(output, format=source_format if rendition_format == FALLBACK_FORMAT
+                             else rendition_format.upper())
+                renditions[(size, rendition_format)] = output.getvalue()
+    return renditions
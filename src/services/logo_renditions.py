@@ -0,0 +1,63 @@
+import mimetypes
+import os
+from dotenv import load_dotenv
+from src.services.logo_render import FALLBACK_FORMAT, rendition_key, writable_formats
+
+load_dotenv()
+# sizes and formats have to match what logo-resize/lambda_function.py writes
+# size of the resized logo stored under the logo's own key, always a rendition
+RESIZED_LOGO_SIZE = 400
+LOGO_SIZES = sorted({int(size) for size in os.getenv("LOGO_RENDITION_SIZES", "64,128,400").split(",")}
+                    | {RESIZED_LOGO_SIZE})
+# in order of preference, the first format the client accepts is served.
+# avif is opt-in, it needs Pillow 11.3 wherever logos are resized
+LOGO_FORMATS = {name: f"image/{name}" for name in
+                writable_formats(os.getenv("LOGO_RENDITION_FORMATS", "webp").split(","))}
+
+
+def all_renditions() -> list[tuple[int, str]]:
+    return [(size, rendition_format) for size in LOGO_SIZES
+            for rendition_format in [*LOGO_FORMATS, FALLBACK_FORMAT]]
+
+
+def choose_size(size: int | None) -> int:
+    # smallest rendition at least as large as requested, the largest one
+    # when nothing given or larger was asked for
+    if size is not None:
+        for rendition_size in LOGO_SIZES:
+            if rendition_size >= size:
+                return rendition_size
+    return LOGO_SIZES[-1]
+
+
+def accepted_formats(accept: str | None) -> list[str]:
+    # only formats named explicitly count, image/* is also sent by browsers
+    # that can't decode avif
+    accepted = set()
+    for media_range in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.lower())
+    return [name for name, media_type in LOGO_FORMATS.items() if media_type in accepted]
+
+
+def rendition_media_type(logo_key: str, rendition_format: str) -> str:
+    if rendition_format in LOGO_FORMATS:
+        return LOGO_FORMATS[rendition_format]
+    return mimetypes.guess_type(logo_key)[0] or "application/octet-stream"
+
+
+def rendition_filename(name: str, media_type: str) -> str:
+    # a converted logo is offered under the extension of its new format
+    for rendition_format, format_media_type in LOGO_FORMATS.items():
+        if media_type == format_media_type:
+            return f"{os.path.splitext(name)[0]}.{rendition_format}"
+    return name
@@ -0,0 +1,153 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import time
+from typing import Callable, NamedTuple
+from dotenv import load_dotenv
+from src.logs.logger import get_logger
+from src.services.aws_utils import io_executor
+from src.services.logo_render import create_renditions
+from src.services.logo_renditions import FALLBACK_FORMAT, LOGO_FORMATS, LOGO_SIZES, RESIZED_LOGO_SIZE, rendition_key, rendition_media_type
+from src.services.storage_factory import get_storage
+
+load_dotenv()
+logger = get_logger(__name__)
+THROUGHPUT_WINDOW_SECONDS = 60
+
+
+def render_logo(content: bytes) -> dict[tuple[int, str], bytes]:
+    # runs in a worker process, so the CPU time isn't taken from the API
+    return create_renditions(content, LOGO_SIZES, list(LOGO_FORMATS))
+
+
+class LogoResizeJob(NamedTuple):
+    key: str
+    enqueued_at: float
+
+
+class LogoResizeWorker():
+    """
+        Resizes uploaded logos inside the app, for deployments without the
+        resize lambda. upload_logo queues the logo's key; background tasks
+        read the raw logo, render it on a process pool and write the
+        renditions through the storage layer. Jobs are kept in memory, a
+        logo queued when the process stops has to be uploaded again.
+        render has the signature of render_logo and must be picklable.
+    """
+    def __init__(self,
+                 processes: int = 2,
+                 render: Callable = render_logo,
+                 raw_bucket: str | None = None,
+                 processed_bucket: str | None = None) -> None:
+        self.processes = processes
+        self.render = render
+        self.raw_bucket = raw_bucket
+        self.processed_bucket = processed_bucket
+        self._loop = None
+        self._queue = None
+        self._pool = None
+        self._tasks = []
+        self._completed_at = deque()
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.total_resize_seconds = 0.0
+
+    def submit(self, key: str) -> bool:
+        if self._loop is None:
+            return False
+        job = LogoResizeJob(key, time.monotonic())
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        # handlers run on the event loop thread, other threads hand the job over
+        if on_loop:
+            self._queue.put_nowait(job)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return True
+
+    async def process(self, job: LogoResizeJob) -> None:
+        raw_storage = get_storage(self.raw_bucket)
+        processed_storage = get_storage(self.processed_bucket)
+        content = await io_executor.run(raw_storage.download_file, job.key)
+        started = time.monotonic()
+        renditions = await self._loop.run_in_executor(self._pool, self.render, content)
+        self.total_resize_seconds += time.monotonic() - started
+        await asyncio.gather(*[io_executor.run(processed_storage.upload_file,
+                                               key=rendition_key(job.key, size, rendition_format),
+                                               bin_file=rendition,
+                                               content_type=rendition_media_type(job.key, rendition_format))
+                               for (size, rendition_format), rendition in renditions.items()])
+        # the resized logo under the logo's own key is written last, like the lambda does
+        await io_executor.run(processed_storage.upload_file,
+                              key=job.key,
+                              bin_file=renditions[(RESIZED_LOGO_SIZE, FALLBACK_FORMAT)],
+                              content_type=rendition_media_type(job.key, FALLBACK_FORMAT))
+
+    async def run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            waited = time.monotonic() - job.enqueued_at
+            self.total_queue_seconds += waited
+            self.max_queue_seconds = max(self.max_queue_seconds, waited)
+            self.in_progress += 1
+            try:
+                await self.process(job)
+            except Exception as ex:
+                logger.error(f"Failed to resize logo {job.key}. Error message: {ex}")
+                self.failed += 1
+            else:
+                self.processed += 1
+                self._completed_at.append(time.monotonic())
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        # waits until every queued logo is resized, used by tests
+        await self._queue.join()
+
+    def start(self) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue()
+            # the app runs threads (io executor, db pool), forking it isn't safe
+            self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=multiprocessing.get_context("spawn"))
+            self._tasks = [self._loop.create_task(self.run()) for _ in range(self.processes)]
+
+    async def stop(self) -> None:
+        if self._loop is not None:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._tasks = []
+            self._loop = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._completed_at and self._completed_at[0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._completed_at.popleft()
+        finished = self.processed + self.failed
+        return {"running": self._loop is not None,
+                "processes": self.processes,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "in_progress": self.in_progress,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_queue_seconds": self.total_queue_seconds / finished if finished else 0.0,
+                "max_queue_seconds": self.max_queue_seconds,
+                "avg_resize_seconds": self.total_resize_seconds / self.processed if self.processed else 0.0,
+                "logos_per_second": len(self._completed_at) / THROUGHPUT_WINDOW_SECONDS}
+
+
+logo_resize_worker = LogoResizeWorker(processes=int(os.getenv("LOGO_RESIZE_PROCESSES", 2)),
+                                      raw_bucket=os.getenv("RAW_LOGO_BUCKET"),
+                                      processed_bucket=os.getenv("RESIZED_LOGO_BUCKET"))
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, LargeBinary
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Index, LargeBinary, Text
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from sqlalchemy.sql import text
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -26,6 +28,18 @@ class Projects(Base):
     updated_by = Column(String(10))
     updated_on = Column(DateTime)
     logo = Column(String(300))
+    # changed only by logo uploads, versions the cached logo
+    logo_updated_on = Column(DateTime)
+    # children are removed by the ON DELETE CASCADE foreign keys
+    documents = relationship("Documents",
+                             order_by="Documents.id",
+                             cascade="all, delete-orphan",
+                             passive_deletes=True)
+    access = relationship("ProjectAccess",
+                          cascade="all, delete-orphan",
+                          passive_deletes=True)
+    # fetch server generated created_on with RETURNING on insert
+    __mapper_args__ = {"eager_defaults": True}
 
 class Documents(Base):
     __tablename__ = 'documents'
@@ -37,9 +51,19 @@ class Documents(Base):
                         nullable=False)
     added_by = Column(String(10), ForeignKey('users.username'), nullable=False)
     content_type = Column(String(50), nullable=False)
-    s3_key = Column(String(36), unique=True)
+    # documents with the same content share one file, see Blobs
+    s3_key = Column(String(64), index=True)
     added_on = Column(DateTime, nullable=False)
 
+class Blobs(Base):
+    __tablename__ = 'blobs'
+
+    # sha256 of the file, or a random key for files put in the bucket
+    # through a presigned url
+    key = Column(String(64), primary_key=True)
+    # number of documents pointing to the file
+    ref_count = Column(Integer, nullable=False)
+
 class ProjectAccess(Base):
     __tablename__ = 'project_access'
 
@@ -48,7 +72,31 @@ class ProjectAccess(Base):
                         primary_key=True)
     username = Column(String(10),
                       ForeignKey('users.username', ondelete='CASCADE'),
-                      primary_key=True)
+                      primary_key=True,
+                      index=True)
     access_type = Column(String(10))
     is_valid = Column(Boolean, default=True)
-    
\ No newline at end of file
+    
+
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer,
+                        ForeignKey('projects.id', ondelete='CASCADE'),
+                        nullable=False)
+    to_address = Column(String(50), nullable=False)
+    subject = Column(String(200), nullable=False)
+    body = Column(Text, nullable=False)
+    # queued -> sent, or failed once all attempts are used up
+    status = Column(String(10), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    # created by create_all on existing databases, the default has to
+    # compile for postgres as well as sqlite
+    created_on = Column(DateTime, server_default=func.now())
+    sent_on = Column(DateTime)
+    message_id = Column(String(100))
+    last_error = Column(String(500))
+    # the dispatcher polls for queued rows that are due
+    __table_args__ = (Index("email_outbox_due_idx", "status", "next_attempt_at"),)
@@ -0,0 +1,93 @@
+from contextvars import ContextVar
+import functools
+from threading import Lock
+import time
+from sqlalchemy import event
+
+
+class RequestTimings():
+    """
+        Time one request spends in the auth middleware, the database and
+        the storage and email services. It is kept in a context variable,
+        which run_sync greenlets, to_thread calls and io executor jobs
+        inherit, so every call made for the request adds to it. Calls
+        running in parallel (the files of a bulk upload) are each counted
+        in full.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        # jobs of one request may finish on several threads at once
+        self._lock = Lock()
+        self.auth_seconds = 0.0
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.storage_seconds = 0.0
+        self.email_seconds = 0.0
+
+
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def add_time(kind: str, seconds: float) -> None:
+    # outside of a request (email dispatcher, logo worker) nothing is recorded
+    timings = request_timings.get()
+    if timings is not None:
+        with timings._lock:
+            setattr(timings, f"{kind}_seconds", getattr(timings, f"{kind}_seconds") + seconds)
+
+
+def timed(kind: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add_time(kind, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info["query_started"].pop()
+    timings = request_timings.get()
+    if timings is not None:
+        with timings._lock:
+            timings.db_seconds += time.perf_counter() - started
+            timings.db_queries += 1
+
+
+def on_error(exception_context) -> None:
+    # a failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        started = conn.info["query_started"].pop()
+        add_time("db", time.perf_counter() - started)
+
+
+def listen(engine) -> None:
+    # async engines are listened to through their sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", on_error)
+
+
+def access_record(request, status_code: int, timings: RequestTimings, bytes_out: int) -> dict:
+    # the route template groups requests for different ids together
+    route = request.scope.get("route")
+    return {"method": request.method,
+            "route": getattr(route, "path", None),
+            "status": status_code,
+            "duration_ms": round((time.perf_counter() - timings.started) * 1000, 3),
+            "auth_ms": round(timings.auth_seconds * 1000, 3),
+            "db_ms": round(timings.db_seconds * 1000, 3),
+            "db_queries": timings.db_queries,
+            "storage_ms": round(timings.storage_seconds * 1000, 3),
+            "email_ms": round(timings.email_seconds * 1000, 3),
+            "bytes_in": int(request.headers.get("Content-Length") or 0),
+            "bytes_out": bytes_out}
@@ -0,0 +1,16 @@
+from dotenv import load_dotenv
+import os
+from src.services.documents_utils import S3Service
+from src.services.local_storage import LocalStorage
+from src.services.storage_interface import BlobStorage
+
+load_dotenv()
+# "s3" or "local", local keeps every bucket in a directory under the root
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "./storage")
+
+def get_storage(bucket_name: str) -> BlobStorage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(os.path.join(LOCAL_STORAGE_ROOT, bucket_name))
+    else:
+        return S3Service(bucket_name)
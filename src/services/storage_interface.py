@@ -0,0 +1,38 @@
+from abc import ABC, abstractmethod
+from typing import BinaryIO
+
+
+class BlobStorage(ABC):
+    """
+        Storage of uploaded files (documents and logos), one instance per
+        bucket. Keys are chosen by the app, the backend only stores bytes.
+    """
+
+    @abstractmethod
+    def upload_file(self, key: str, bin_file: BinaryIO | bytes, content_type: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def download_file(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream_file(self, key: str, byte_range: str | None = None) -> object:
+        # returns a stream that documents_utils.stream_response can send
+        raise NotImplementedError
+
+    @abstractmethod
+    def file_exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_file(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def presign_download(self, key: str, filename: str, expires_in: int) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def presign_upload(self, key: str, content_type: str, expires_in: int) -> tuple[str, dict]:
+        raise NotImplementedError
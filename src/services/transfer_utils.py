@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import os
+from fastapi import HTTPException
+from jose import jwt, JWTError
+from dotenv import load_dotenv
+from starlette import status
+from src.logs.logger import get_logger
+
+
+load_dotenv()
+
+
+def derive_key(secret: str, purpose: str) -> str:
+    return hmac.new(secret.encode(), purpose.encode(), hashlib.sha256).hexdigest()
+
+
+# upload tokens carry the same claims as join tokens, without a dedicated
+# secret they are signed with a key derived from the join secret, so
+# neither kind of token verifies as the other
+SECRET_KEY = os.getenv("TRANSFER_SECRET_KEY") or derive_key(os.getenv("JOIN_SECRET_KEY", ""), "presigned-transfer")
+AUDIENCE = "transfer"
+PRESIGNED_URL_EXPIRY_SECONDS = int(os.getenv("S3_PRESIGNED_URL_EXPIRY_SECONDS", 900))
+logger = get_logger(__name__)
+
+
+def create_upload_token(to_encode: dict) -> str:
+    """
+        Token handed out together with a presigned PUT url. It carries
+        everything needed to record the upload once the client calls the
+        completion endpoint, so nothing is stored before the file exists.
+    """
+    my_claims = to_encode.copy()
+    expire = datetime.now(timezone.utc) + timedelta(seconds=PRESIGNED_URL_EXPIRY_SECONDS)
+    my_claims.update({"exp": expire, "aud": AUDIENCE})
+    return jwt.encode(my_claims, SECRET_KEY, algorithm="HS256")
+
+
+def decode_upload_token(token: str, kind: str, username: str) -> dict:
+    upload_exception = HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                     detail="Invalid upload token")
+    try:
+        # expiry and a present aud claim are checked by jose on decode
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], audience=AUDIENCE)
+    except JWTError:
+        logger.error(f"Upload token could not be decoded")
+        raise upload_exception
+    if payload.get("aud") != AUDIENCE or payload.get("kind") != kind or payload.get("sub") != username:
+        logger.error(f"Upload token of user '{username}' used for a different transfer")
+        raise upload_exception
+    return payload
@@ -1,6 +1,8 @@
+import asyncio
+from threading import Event
 import unittest
 from fastapi import HTTPException
-from src.services.auth_utils import write_new_user, authenticate_user, create_access_token, check_privilege
+from src.services.auth_utils import PasswordHashingPool, write_new_user, authenticate_user, create_access_token, check_privilege
 from src.services.project_manager_tables import Base
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
@@ -56,4 +58,31 @@ class Test_Auth_Utils(unittest.TestCase):
     def test_d_check_privilege(self):
         self.assertRaises(HTTPException, check_privilege, 6, [1,3], [2,5])
         self.assertRaises(HTTPException, check_privilege, 1, [3], [1,2,5], True)
-        
\ No newline at end of file
+
+
+    def test_e_password_hashing_pool(self):
+        pool = PasswordHashingPool(max_workers=2, max_pending=1)
+        async def hash_and_verify():
+            hashed = await pool.hash("1234")
+            return await pool.verify("1234", hashed), await pool.verify("14", hashed)
+        self.assertEqual((True, False), asyncio.run(hash_and_verify()))
+        stats = pool.stats()
+        self.assertEqual(3, stats["completed"])
+        self.assertEqual(0, stats["queued"] + stats["running"])
+
+
+    def test_f_password_hashing_pool_rejects_when_full(self):
+        pool = PasswordHashingPool(max_workers=1, max_pending=1)
+        release = Event()
+        async def saturate():
+            # one call running and one waiting fill the pool, the third is rejected
+            blocked = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(HTTPException) as rejected:
+                await pool.run(release.wait)
+            release.set()
+            await asyncio.gather(*blocked)
+            return rejected.exception.status_code
+        self.assertEqual(503, asyncio.run(saturate()))
+        self.assertEqual(1, pool.stats()["rejected"])
+        self.assertEqual(2, pool.stats()["completed"])
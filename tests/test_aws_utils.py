@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+from unittest import mock
+from fastapi import HTTPException
+from sqlalchemy.util import greenlet_spawn
+from src.services.aws_utils import NO_TIMEOUT, ClientRegistry, IOExecutor, get_boto_config
+
+
+class Test_Client_Registry(unittest.TestCase):
+    def test_a_client_is_shared(self):
+        registry = ClientRegistry()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = list(pool.map(lambda _: registry.get_client("s3"), range(32)))
+        # every thread gets the single client created for the service
+        self.assertEqual(1, len({id(client) for client in clients}))
+        self.assertIsNot(clients[0], registry.get_client("ses"))
+        registry.clear()
+        self.assertIsNot(clients[0], registry.get_client("s3"))
+
+
+    @mock.patch.dict("os.environ", {"AWS_MAX_POOL_CONNECTIONS": "20", "AWS_MAX_ATTEMPTS": "5"})
+    def test_b_boto_config(self):
+        config = get_boto_config()
+        self.assertEqual(20, config.max_pool_connections)
+        self.assertEqual(5, config.retries["max_attempts"])
+        self.assertEqual("standard", config.retries["mode"])
+        registry = ClientRegistry()
+        self.assertEqual(20, registry.get_client("s3").meta.config.max_pool_connections)
+
+
+class Test_IO_Executor(unittest.TestCase):
+    def test_a_call_from_run_sync_is_offloaded(self):
+        executor = IOExecutor(max_workers=2, timeout=5)
+        thread_name = lambda: threading.current_thread().name
+        # plain threads call directly, code running under run_sync is moved
+        # to the executor
+        self.assertEqual(threading.current_thread().name, executor.call(thread_name))
+        offloaded = asyncio.run(greenlet_spawn(executor.call, thread_name))
+        self.assertTrue(offloaded.startswith("aws-io"))
+        self.assertEqual(1, executor.stats()["completed"])
+
+
+    def test_b_timeout_and_failures(self):
+        executor = IOExecutor(max_workers=1, timeout=5)
+        with self.assertRaises(HTTPException) as ex:
+            asyncio.run(executor.run(time.sleep, 0.5, timeout=0.01))
+        self.assertEqual(504, ex.exception.status_code)
+        # calls that mustn't be given up on are waited for
+        self.assertIsNone(asyncio.run(executor.run(time.sleep, 0.05, timeout=NO_TIMEOUT)))
+        with self.assertRaises(ValueError):
+            asyncio.run(executor.run(int, "not a number"))
+        stats = executor.stats()
+        self.assertEqual(1, stats["timed_out"])
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(0, stats["queued"])
@@ -0,0 +1,85 @@
+import unittest
+from unittest import mock
+from src.services.cache_utils import LRUCache
+
+
+class Test_LRU_Cache(unittest.TestCase):
+    def test_a_get_and_set(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        self.assertIsNone(cache.get("username1"))
+        cache.set("username1", ([1], [2]))
+        self.assertEqual(([1], [2]), cache.get("username1"))
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(0.5, stats["hit_ratio"])
+
+
+    def test_b_lru_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # touching 'a' makes 'b' the least recently used entry
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+
+    def test_c_expiry(self):
+        cache = LRUCache(max_size=2, ttl=10)
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=100):
+            cache.set("a", 1)
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=109):
+            self.assertEqual(1, cache.get("a"))
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=110):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.stats()["size"])
+
+
+    def test_c_expiry_per_entry(self):
+        cache = LRUCache(max_size=2, ttl=10)
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=100):
+            cache.set("short", 1, ttl=2)
+            # lifetimes above the cache ttl are capped
+            cache.set("long", 2, ttl=60)
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=102):
+            self.assertIsNone(cache.get("short"))
+            self.assertEqual(2, cache.get("long"))
+        with mock.patch("src.services.cache_utils.time.monotonic", return_value=110):
+            self.assertIsNone(cache.get("long"))
+
+
+    def test_d_invalidate(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("a")
+        cache.invalidate("not-there")
+        self.assertIsNone(cache.get("a"))
+        cache.clear()
+        self.assertIsNone(cache.get("b"))
+
+
+    def test_e_byte_budget(self):
+        cache = LRUCache(max_size=10, ttl=60, max_bytes=100)
+        cache.set("a", b"a" * 40, nbytes=40)
+        cache.set("b", b"b" * 40, nbytes=40)
+        cache.get("a")
+        # 'b' is the least recently used entry and goes to make room
+        cache.set("c", b"c" * 30, nbytes=30)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(70, cache.stats()["bytes"])
+        # replacing an entry only counts its new size
+        cache.set("a", b"a" * 10, nbytes=10)
+        self.assertEqual(40, cache.stats()["bytes"])
+        # entries over the budget are not cached at all
+        cache.set("huge", b"h" * 101, nbytes=101)
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual(b"c" * 30, cache.get("c"))
+        cache.invalidate("c")
+        self.assertEqual(10, cache.stats()["bytes"])
+        cache.clear()
+        self.assertEqual(0, cache.stats()["bytes"])
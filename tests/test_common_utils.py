@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+from uuid import UUID
+from src.services.common_utils import generate_s3_key, uuid7
+
+
+class Test_Common_Utils(unittest.TestCase):
+    def test_a_uuid7(self):
+        with mock.patch("src.services.common_utils.time.time_ns", return_value=1_700_000_000_000 * 1_000_000):
+            earlier = uuid7()
+        with mock.patch("src.services.common_utils.time.time_ns", return_value=1_700_000_000_001 * 1_000_000):
+            later = uuid7()
+        self.assertEqual(7, earlier.version)
+        self.assertEqual("specified in RFC 4122", earlier.variant)
+        self.assertEqual(1_700_000_000_000, earlier.int >> 80)
+        # keys sort by creation time
+        self.assertLess(str(earlier), str(later))
+
+
+    def test_b_generate_s3_key(self):
+        with mock.patch.dict("os.environ", {"S3_KEY_UUID_VERSION": "7"}):
+            self.assertEqual(7, UUID(generate_s3_key()).version)
+        with mock.patch.dict("os.environ", {"S3_KEY_UUID_VERSION": "4"}):
+            key = generate_s3_key()
+        self.assertEqual(4, UUID(key).version)
+        self.assertEqual(36, len(key))
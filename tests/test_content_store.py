@@ -0,0 +1,39 @@
+import hashlib
+import io
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from src.services.content_store import acquire_blobs, content_key, release_blobs
+from src.services.project_manager_tables import Base, Blobs
+
+
+class Test_Content_Store(unittest.TestCase):
+    def setUp(self) -> None:
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.session = Session(bind=engine, autoflush=False)
+
+    def tearDown(self) -> None:
+        self.session.close()
+
+
+    def test_a_content_key(self):
+        content = b"x" * 3_000_000
+        file_obj = io.BytesIO(b"header" + content)
+        file_obj.seek(6)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), content_key(file_obj))
+        # the file is rewound to where hashing started
+        self.assertEqual(6, file_obj.tell())
+        self.assertEqual(hashlib.sha256(content).hexdigest(), content_key(content))
+
+
+    def test_b_reference_counting(self):
+        self.assertEqual({"a", "b"}, acquire_blobs(self.session, ["a", "b", "a"]))
+        self.assertEqual(2, self.session.get(Blobs, "a").ref_count)
+        self.assertEqual(set(), acquire_blobs(self.session, ["b"]))
+        self.assertEqual([], release_blobs(self.session, ["a", "b"]))
+        self.assertEqual(["a", "b"], release_blobs(self.session, ["a", "b"]))
+        self.assertEqual(0, self.session.query(Blobs).count())
+        # keys from before deduplication have no row and own their file
+        self.assertEqual(["legacy-key"], release_blobs(self.session, ["legacy-key"]))
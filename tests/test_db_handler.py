@@ -1,16 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import hashlib
+import io
 import os
+import threading
+import time
 import unittest
 from unittest import mock
 
+from botocore.response import StreamingBody
 from fastapi import HTTPException
-from src.services.auth_utils import write_new_user
-from src.services.project_manager_tables import Base, Projects
-from sqlalchemy import create_engine
+from src.services.documents_utils import S3FileStream, logo_cache
+from src.services.logo_renditions import all_renditions
+from src.services.auth_utils import ProjectPrivileges, write_new_user, privilege_cache
+from src.services.common_utils import encode_cursor
+from src.services.project_manager_tables import Base, Blobs, Documents, Projects
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 from src.routers.auth.schemas import User
 from src.services.db_project_handler import DbProjectHandler
+from src.services.document_handler import DocumentHandler
 from dotenv import load_dotenv
 
 
@@ -18,7 +27,8 @@ def image_helper():
     m = mock.MagicMock()
     with open("./tests/test_logo.png", "rb") as image:
         content = image.read()
-        m.return_value = content
+        m.side_effect = lambda *args, **kwargs: S3FileStream(body=StreamingBody(io.BytesIO(content), len(content)),
+                                                             content_length=len(content))
     return m
 
 def email_helper():
@@ -98,13 +108,29 @@ class Test_Db_Handler(unittest.TestCase):
         self.assertEqual(['username1'], proj.contributors)
 
 
+    def test_b_get_query_count(self):
+        handler = DbProjectHandler()
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(self.engine, "before_cursor_execute", count_statement)
+        try:
+            proj = handler.get(project_id=1, db=self.session)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(['username1'], proj.contributors)
+        # project with contributors in one query, documents in a second one
+        self.assertLessEqual(len(statements), 2)
+
+    
     def test_c_get_all(self):
         handler = DbProjectHandler()
         handler.create(name="Project 2",
                        created_by="username1",
                        description="toy description",
                        db=self.session)
-        all_projs = handler.get_all(db=self.session, accessible_projects=[1, 2])
+        all_projs, next_cursor = handler.get_all(db=self.session, username="username1")
+        self.assertIsNone(next_cursor)
         self.assertEqual(2, len(all_projs))
         self.assertEqual("Project 1", all_projs[0].name)
         self.assertEqual(1, all_projs[0].id)
@@ -113,6 +139,30 @@ class Test_Db_Handler(unittest.TestCase):
         self.assertIsNotNone(all_projs[0].created_on)
 
     
+    def test_c_get_all_paginated(self):
+        handler = DbProjectHandler()
+        first_page, cursor = handler.get_all(db=self.session, username="username1",
+                                             limit=1, sort="-name")
+        self.assertEqual(["Project 2"], [proj.name for proj in first_page])
+        self.assertIsNotNone(cursor)
+        second_page, last_cursor = handler.get_all(db=self.session, username="username1",
+                                                   limit=1, sort="-name", cursor=cursor)
+        self.assertEqual(["Project 1"], [proj.name for proj in second_page])
+        self.assertIsNone(last_cursor)
+        # filters
+        filtered, _ = handler.get_all(db=self.session, username="username1", name_filter="ject 2")
+        self.assertEqual([2], [proj.id for proj in filtered])
+        not_owned, _ = handler.get_all(db=self.session, username="username1", owner_filter="username2")
+        self.assertEqual([], not_owned)
+        # no access means no projects
+        others, _ = handler.get_all(db=self.session, username="username2")
+        self.assertEqual([], others)
+        self.assertRaises(HTTPException, handler.get_all, self.session, "username1", 1, "not-a-cursor")
+        # decodable cursors with values of the wrong type are rejected too
+        for values in (["Project 1", "1"], [1, 1], ["Project 1", True], ["Project 1"], {"a": 1, "b": 2}):
+            self.assertRaises(HTTPException, handler.get_all, self.session, "username1", 1, encode_cursor(values), "-name")
+
+    
     def test_d_update_info(self):
         handler = DbProjectHandler()
         details = {"description": "new description", "updated_by": "username1"}
@@ -148,7 +198,10 @@ class Test_Db_Handler(unittest.TestCase):
         write_new_user(self.session, new_user)
         # test method
         handler = DbProjectHandler()
+        privilege_cache.set("username2", ProjectPrivileges())
         new_permission = handler.grant_access(1, "username2", self.session)
+        # stale cached privileges must be dropped once access changes
+        self.assertIsNone(privilege_cache.get("username2"))
         self.assertEqual(1, new_permission.project_id)
         self.assertEqual("username2", new_permission.username)
         self.assertEqual("participant", new_permission.role)
@@ -156,14 +209,14 @@ class Test_Db_Handler(unittest.TestCase):
 
     def test_g_get_project_privileges(self):
         owned, participating = DbProjectHandler.get_project_privileges(self.session, "username1")
-        self.assertEqual([], participating)
-        self.assertEqual([1, 2], owned)
-        owned_2, participating_2 = DbProjectHandler.get_project_privileges(self.session, "username2")
-        self.assertEqual([], owned_2)
-        self.assertEqual([1], participating_2)
+        self.assertEqual(frozenset(), participating)
+        self.assertEqual(frozenset({1, 2}), owned)
+        privileges_2 = DbProjectHandler.get_project_privileges(self.session, "username2")
+        self.assertEqual(frozenset(), privileges_2.owned)
+        self.assertEqual(frozenset({1}), privileges_2.participating)
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.upload_file_to_s3")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
     def test_h_associate_document(self, result):
         handler = DbProjectHandler()
         file_contents = open("./toy_file.txt", "rb")
@@ -194,7 +247,41 @@ class Test_Db_Handler(unittest.TestCase):
         self.assertEqual("text/plain", all_docs[0].content_type)
 
     
-    @mock.patch("src.services.db_project_handler.S3Service.upload_file_to_s3")
+    @mock.patch("src.services.documents_utils.S3Service.file_exists", return_value=True)
+    @mock.patch("src.services.documents_utils.S3Service.presign_upload",
+                return_value=("https://signed-url", {"Content-Type": "text/plain"}))
+    def test_i_presigned_document_upload(self, presign, exists):
+        handler = DbProjectHandler()
+        transfer = handler.presign_document_upload(project_id=1,
+                                                   doc_name="toy file 2.txt",
+                                                   content_type="text/plain",
+                                                   caller="username1")
+        self.assertEqual("https://signed-url", transfer.url)
+        self.assertEqual("PUT", transfer.method)
+        # nothing is recorded until the upload is completed
+        self.assertEqual(1, len(handler.get_docs(1, self.session)))
+        self.assertRaises(HTTPException, handler.complete_document_upload,
+                          2, transfer.upload_token, "username1", self.session)
+        self.assertRaises(HTTPException, handler.complete_document_upload,
+                          1, transfer.upload_token, "username2", self.session)
+        exists.return_value = False
+        self.assertRaises(HTTPException, handler.complete_document_upload,
+                          1, transfer.upload_token, "username1", self.session)
+        exists.return_value = True
+        doc = handler.complete_document_upload(project_id=1,
+                                               upload_token=transfer.upload_token,
+                                               caller="username1",
+                                               db=self.session)
+        self.assertEqual(2, doc.id)
+        self.assertEqual("toy-file-2.txt", doc.name)
+        self.assertEqual("text/plain", doc.content_type)
+        # a token can only be completed once
+        self.assertRaises(HTTPException, handler.complete_document_upload,
+                          1, transfer.upload_token, "username1", self.session)
+        self.assertEqual(2, len(handler.get_docs(1, self.session)))
+
+
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
     def test_j_upload_logo(self, result):
         handler = DbProjectHandler()
         file_contents = open("./tests/test_logo.png", "rb")
@@ -213,25 +300,68 @@ class Test_Db_Handler(unittest.TestCase):
         self.assertLessEqual(timestamp, logo.uploaded_on)
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.download_file_from_s3", new_callable=image_helper)
+    @mock.patch("src.services.documents_utils.S3Service.stream_file", new_callable=image_helper)
     def test_k_download_logo(self, result):
         handler = DbProjectHandler()
-        name, content = handler.download_logo(project_id=1, db=self.session)
+        name, logo = handler.download_logo(project_id=1, db=self.session)
         image = bytes()
         with open("./tests/test_logo.png", "rb") as i:
             image = i.read()
         self.assertTrue(result.called)
         self.assertEqual("test_logo.png", name)
-        self.assertEqual(image, content)
+        self.assertEqual(image, logo.content)
+        # the second download is served from the logo cache
+        _, cached_logo = handler.download_logo(project_id=1, db=self.session)
+        self.assertIs(logo, cached_logo)
+        self.assertEqual(1, result.call_count)
+        # a thumbnail in a format the client accepts is a separate rendition
+        name, thumbnail = handler.download_logo(project_id=1, db=self.session,
+                                                size=64, accept="image/webp")
+        self.assertEqual("test_logo.webp", name)
+        self.assertEqual("image/webp", thumbnail.media_type)
+        self.assertEqual("renditions/project-1-logo-test_logo.png/64.webp",
+                         result.call_args.kwargs["key"])
+
+
+    def test_k_download_logo_after_update(self):
+        handler = DbProjectHandler()
+        proj = self.session.get(Projects, 1)
+        handler.invalidate_logo(DbProjectHandler.logo_version(proj))
+        # the logo was uploaded an hour ago and resized right after
+        proj.logo_updated_on = proj.updated_on = datetime.now() - timedelta(hours=1)
+        self.session.commit()
+        resized_on = proj.logo_updated_on.astimezone(timezone.utc)
+        with open("./tests/test_logo.png", "rb") as image:
+            content = image.read()
+        # editing the project later must not keep its logo out of the cache
+        handler.update_info(project_id=1,
+                            attributes_to_update={"description": "edited after the logo upload"},
+                            db=self.session)
+        self.session.commit()
+        with mock.patch("src.services.documents_utils.S3Service.stream_file") as stream:
+            stream.side_effect = lambda *args, **kwargs: S3FileStream(body=StreamingBody(io.BytesIO(content), len(content)),
+                                                                      content_length=len(content),
+                                                                      last_modified=resized_on)
+            for _ in range(3):
+                handler.download_logo(project_id=1, db=self.session)
+                handler.download_logo(project_id=1, db=self.session, size=64, accept="image/webp")
+        self.assertEqual(2, stream.call_count)
+        self.assertIsNotNone(logo_cache.get(DbProjectHandler.logo_version(self.session.get(Projects, 1))))
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.delete_file_from_s3")
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
     def test_l_delete_logo(self, result):
         handler = DbProjectHandler()
+        cached_version = DbProjectHandler.logo_version(self.session.get(Projects, 1))
+        self.assertIsNotNone(logo_cache.get(cached_version))
+        self.assertIsNotNone(logo_cache.get((*cached_version, 64, "webp")))
         handler.delete_logo(project_id=1,
                             user_calling="username2",
                             db=self.session)
-        self.assertTrue(result.called)
+        # raw and resized logo and all renditions
+        self.assertEqual(2 + len(all_renditions()), result.call_count)
+        self.assertIsNone(logo_cache.get(cached_version))
+        self.assertIsNone(logo_cache.get((*cached_version, 64, "webp")))
         proj = self.session.get(Projects, 1)
         self.assertIsNone(proj.logo)
         self.assertEqual("username2", proj.updated_by)
@@ -253,7 +383,124 @@ class Test_Db_Handler(unittest.TestCase):
         self.assertIsInstance(join_token, str)
 
 
-    def test_z_delete(self):
+    def test_n_create_many(self):
+        handler = DbProjectHandler()
+        created = handler.create_many(new_projects=[{"name": "Project 3", "description": "third"},
+                                                    {"name": "Project 4", "description": "fourth"}],
+                                      created_by="username2",
+                                      db=self.session)
+        self.assertEqual(["Project 3", "Project 4"], [proj.name for proj in created])
+        self.assertEqual(["username2"], created[1].contributors)
+        self.assertIsNotNone(created[0].created_on)
+        privileges = DbProjectHandler.get_project_privileges(self.session, "username2")
+        self.assertEqual({proj.id for proj in created}, privileges.owned)
+
+
+    def test_o_grant_access_many(self):
+        new_user = User(username="username3",
+                        full_name="Third User",
+                        email="third@gmail.com",
+                        password="1234")
+        write_new_user(self.session, new_user)
+        privilege_cache.set("username3", ProjectPrivileges())
+        result = DbProjectHandler.grant_access_many(1, ["username3", "username2", "username1", "ghost"],
+                                                    self.session)
+        self.assertEqual(["username3"], [perm.username for perm in result.granted])
+        self.assertEqual(["ghost", "username1", "username2"], result.skipped)
+        self.assertIsNone(privilege_cache.get("username3"))
+        self.assertEqual(frozenset({1}),
+                         DbProjectHandler.get_project_privileges(self.session, "username3").participating)
+
+
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_p_associate_documents(self, result):
+        def upload(key, bin_file, content_type):
+            if bin_file.read() == b"fail":
+                raise ConnectionError("upload failed")
+        result.side_effect = upload
+        handler = DbProjectHandler()
+        files = [("a file.txt", "text/plain", io.BytesIO(b"a")),
+                 ("broken.txt", "text/plain", io.BytesIO(b"fail")),
+                 ("c.csv", "text/csv", io.BytesIO(b"c"))]
+        docs_before = len(handler.get_docs(1, self.session))
+        results = handler.associate_documents(project_id=1,
+                                              files=files,
+                                              caller="username1",
+                                              db=self.session)
+        self.assertEqual(3, result.call_count)
+        # results come back in the order of the files
+        self.assertEqual(["a file.txt", "broken.txt", "c.csv"], [res.filename for res in results])
+        self.assertEqual([True, False, True], [res.uploaded for res in results])
+        self.assertEqual("upload failed", results[1].error)
+        self.assertEqual("a-file.txt", results[0].document.name)
+        self.assertEqual("text/csv", results[2].document.content_type)
+        self.assertLess(results[0].document.id, results[2].document.id)
+        docs = {doc.id: doc.name for doc in handler.get_docs(1, self.session)}
+        self.assertEqual(docs_before + 2, len(docs))
+        self.assertEqual("c.csv", docs[results[2].document.id])
+
+
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_p_associate_documents_bounded(self, result):
+        # a large batch only holds a few io executor workers at a time
+        running, most_running = [0], [0]
+        lock = threading.Lock()
+        def upload(key, bin_file, content_type):
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+        result.side_effect = upload
+        handler = DbProjectHandler()
+        handler.batch_upload_concurrency = 2
+        files = [(f"file_{i}.txt", "text/plain", io.BytesIO(str(i).encode())) for i in range(8)]
+        keys = [f"key-{i}" for i in range(8)]
+        uploads = handler.upload_documents(files, keys, set(keys))
+        self.assertEqual(8, result.call_count)
+        self.assertEqual(2, most_running[0])
+        self.assertEqual([None] * 8, [upload.error for upload in uploads])
+
+
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_q_associate_document_deduplicated(self, upload, delete):
+        handler = DbProjectHandler()
+        template = b"shared template"
+        key = hashlib.sha256(template).hexdigest()
+        docs = [handler.associate_document(project_id=1,
+                                           doc_name=f"template {i}.txt",
+                                           content_type="text/plain",
+                                           caller="username1",
+                                           byfile=io.BytesIO(template),
+                                           db=self.session) for i in range(2)]
+        results = handler.associate_documents(project_id=1,
+                                              files=[("copy.txt", "text/plain", io.BytesIO(template))],
+                                              caller="username1",
+                                              db=self.session)
+        # identical content is sent once and shared by all three documents
+        self.assertEqual(1, upload.call_count)
+        self.assertEqual(key, upload.call_args.kwargs["key"])
+        doc_ids = [doc.id for doc in docs] + [results[0].document.id]
+        self.assertEqual({key}, {self.session.get(Documents, doc_id).s3_key for doc_id in doc_ids})
+        self.assertEqual(3, self.session.get(Blobs, key).ref_count)
+        # the file is only deleted with the last document
+        for doc_id in doc_ids[:2]:
+            DocumentHandler.delete_document(doc_id, self.session)
+        self.assertFalse(delete.called)
+        self.assertEqual(1, self.session.get(Blobs, key).ref_count)
+        DocumentHandler.delete_document(doc_ids[2], self.session)
+        delete.assert_called_once_with(key=key)
+        self.assertIsNone(self.session.get(Blobs, key))
+
+
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
+    def test_z_delete(self, delete):
         handler = DbProjectHandler()
+        document_keys = {doc.s3_key for doc in self.session.query(Documents).filter_by(project_id=1)}
         handler.delete(project_id=1, db=self.session)
         self.assertIsNone(self.session.get(Projects, 1))
+        # files of the project's documents go with it
+        self.assertEqual(document_keys, {call.args[0] for call in delete.call_args_list})
+        self.assertEqual(0, self.session.query(Blobs).count())
@@ -1,10 +1,14 @@
 from datetime import datetime
+import hashlib
+import io
 import os
 import unittest
 from unittest import mock
 from uuid import uuid4
 
+from botocore.response import StreamingBody
 from fastapi import HTTPException
+from src.services.documents_utils import S3FileStream
 from src.services.auth_utils import write_new_user
 from src.services.project_manager_tables import Base, Documents
 from sqlalchemy import create_engine
@@ -70,17 +74,22 @@ class Test_Document_Handler(unittest.TestCase):
                           self.session)
         
 
-    @mock.patch("src.services.document_handler.S3Service.download_file_from_s3", return_value=bytes("random_string", "utf-8"))
+    @mock.patch("src.services.documents_utils.S3Service.stream_file",
+                return_value=S3FileStream(body=StreamingBody(io.BytesIO(bytes("random_string", "utf-8")), 13),
+                                          content_length=13))
     def test_b_download_document(self, result):
-        name, content_type, contents = DocumentHandler.download_document(1, self.session)
+        name, content_type, stream = DocumentHandler.download_document(1, self.session)
+        contents = b"".join(stream.iter_chunks())
         self.assertTrue(result.called)
         self.assertEqual("toy_file.txt", name)
         self.assertEqual("text/plain", content_type)
         self.assertEqual(bytes("random_string", "utf-8"), contents)
 
 
-    @mock.patch("src.services.document_handler.S3Service.upload_file_to_s3")
-    def test_c_update_document(self, result):
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_c_update_document(self, result, delete):
+        old_key = self.session.get(Documents, 1).s3_key
         with open("toy_file_2.txt", 'w') as f:
             pass
         file_contents = open("./toy_file_2.txt", "rb")
@@ -100,9 +109,45 @@ class Test_Document_Handler(unittest.TestCase):
         self.assertEqual(1, updated_doc.project_id)
         self.assertLessEqual(timestamp, updated_doc.added_on)
         self.assertEqual("text/plain", updated_doc.content_type)
+        # the new version is stored under its content hash, the old file
+        # had no other document and is removed
+        new_key = self.session.get(Documents, 1).s3_key
+        self.assertEqual(hashlib.sha256(b"").hexdigest(), new_key)
+        self.assertEqual(new_key, result.call_args.kwargs["key"])
+        delete.assert_called_once_with(key=old_key)
 
 
-    @mock.patch("src.services.document_handler.S3Service.delete_file_from_s3")
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
+    @mock.patch("src.services.documents_utils.S3Service.file_exists", return_value=True)
+    @mock.patch("src.services.documents_utils.S3Service.presign_upload",
+                return_value=("https://signed-url", {"Content-Type": "text/csv"}))
+    def test_c_presigned_update_document(self, result, exists, delete):
+        old_key = self.session.get(Documents, 1).s3_key
+        transfer = DocumentHandler.presign_update(document_id=1,
+                                                  doc_name="toy_file_3.csv",
+                                                  content_type="text/csv",
+                                                  updating_user="username1",
+                                                  db=self.session)
+        # the new version gets a new key, the old file may be shared
+        new_key = result.call_args.kwargs["key"]
+        self.assertNotEqual(old_key, new_key)
+        self.assertEqual("PUT", transfer.method)
+        self.assertRaises(HTTPException, DocumentHandler.complete_update,
+                          2, transfer.upload_token, "username1", self.session)
+        updated_doc = DocumentHandler.complete_update(document_id=1,
+                                                      upload_token=transfer.upload_token,
+                                                      updating_user="username1",
+                                                      db=self.session)
+        self.assertEqual("toy_file_3.csv", updated_doc.name)
+        self.assertEqual("text/csv", updated_doc.content_type)
+        self.assertEqual("toy_file_3.csv", self.session.get(Documents, 1).name)
+        self.assertEqual(new_key, self.session.get(Documents, 1).s3_key)
+        delete.assert_called_once_with(key=old_key)
+        self.assertRaises(HTTPException, DocumentHandler.complete_update,
+                          1, transfer.upload_token, "username1", self.session)
+
+
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
     def test_d_delete_document(self, result):
         DocumentHandler.delete_document(1, self.session)
         self.assertTrue(result.called)
@@ -0,0 +1,158 @@
+import asyncio
+from datetime import datetime, timedelta
+import threading
+import time
+import unittest
+from unittest import mock
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateTable
+from src.services.aws_utils import io_executor
+from src.services.email_outbox import EmailDispatcher, EmailOutboxHandler
+from src.services.project_manager_tables import Base, EmailOutbox
+
+
+class StubSES():
+    """
+        Stands in for SESService.send_email_via_ses. Addresses in fail_for
+        are rejected, every call is recorded with the time it started.
+    """
+    def __init__(self, fail_for: tuple = ()) -> None:
+        self.fail_for = set(fail_for)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str, to_address: str, subject: str):
+        with self._lock:
+            self.calls.append((time.monotonic(), to_address, subject))
+            if to_address in self.fail_for:
+                raise RuntimeError("Throttling: Maximum sending rate exceeded")
+            return f"message-{len(self.calls)}"
+
+
+class Test_Email_Outbox(unittest.TestCase):
+    def setUp(self) -> None:
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        self.session_factory = async_sessionmaker(autoflush=False, bind=engine)
+
+        async def create_tables():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        asyncio.run(create_tables())
+
+    def enqueue(self, *addresses: str) -> list[int]:
+        async def run():
+            async with self.session_factory() as db:
+                return [await db.run_sync(EmailOutboxHandler.enqueue, 1, address, "Invite to project", "text")
+                        for address in addresses]
+        return asyncio.run(run())
+
+    def get(self, email_id: int) -> EmailOutbox:
+        async def run():
+            async with self.session_factory() as db:
+                return await db.run_sync(EmailOutboxHandler.get, email_id, 1)
+        return asyncio.run(run())
+
+    def make_due(self) -> None:
+        async def run():
+            async with self.session_factory() as db:
+                await db.execute(update(EmailOutbox).values(next_attempt_at=datetime.now() - timedelta(seconds=1)))
+                await db.commit()
+        asyncio.run(run())
+
+
+    def test_a_batch_is_sent(self):
+        ids = self.enqueue("a@gmail.com", "b@gmail.com", "c@gmail.com")
+        ses = StubSES()
+        dispatcher = EmailDispatcher(self.session_factory, send_email=ses,
+                                     batch_size=2, max_send_rate=1000)
+        self.assertEqual(2, asyncio.run(dispatcher.dispatch_batch()))
+        self.assertEqual(1, asyncio.run(dispatcher.dispatch_batch()))
+        self.assertEqual(0, asyncio.run(dispatcher.dispatch_batch()))
+        self.assertEqual(["a@gmail.com", "b@gmail.com", "c@gmail.com"],
+                         sorted(call[1] for call in ses.calls))
+        for email_id in ids:
+            email = self.get(email_id)
+            self.assertEqual("sent", email.status)
+            self.assertEqual(1, email.attempts)
+            self.assertTrue(email.message_id.startswith("message-"))
+            self.assertIsNotNone(email.sent_on)
+        self.assertEqual({"running": False, "sent": 3, "failed_attempts": 0, "batches": 2},
+                         dispatcher.stats())
+
+
+    def test_b_failed_email_is_retried_then_given_up(self):
+        ok_id, failing_id = self.enqueue("ok@gmail.com", "bounce@gmail.com")
+        ses = StubSES(fail_for=("bounce@gmail.com",))
+        dispatcher = EmailDispatcher(self.session_factory, send_email=ses,
+                                     max_send_rate=1000, max_attempts=3,
+                                     backoff_seconds=60)
+        self.assertEqual(2, asyncio.run(dispatcher.dispatch_batch()))
+        self.assertEqual("sent", self.get(ok_id).status)
+        email = self.get(failing_id)
+        self.assertEqual("queued", email.status)
+        self.assertEqual(1, email.attempts)
+        self.assertIn("Throttling", email.last_error)
+        # the retry waits for the backoff
+        self.assertGreater(email.next_attempt_at, datetime.now() + timedelta(seconds=50))
+        self.assertEqual(0, asyncio.run(dispatcher.dispatch_batch()))
+        for _ in range(2):
+            self.make_due()
+            self.assertEqual(1, asyncio.run(dispatcher.dispatch_batch()))
+        email = self.get(failing_id)
+        self.assertEqual("failed", email.status)
+        self.assertEqual(3, email.attempts)
+        self.make_due()
+        self.assertEqual(0, asyncio.run(dispatcher.dispatch_batch()))
+        self.assertEqual(4, len(ses.calls))
+
+
+    def test_c_sends_are_throttled(self):
+        self.enqueue(*[f"user{i}@gmail.com" for i in range(5)])
+        ses = StubSES()
+        dispatcher = EmailDispatcher(self.session_factory, send_email=ses, max_send_rate=20)
+        asyncio.run(dispatcher.dispatch_batch())
+        starts = sorted(call[0] for call in ses.calls)
+        # 5 sends at 20 per second are spread over at least 200 ms
+        self.assertGreaterEqual(starts[-1] - starts[0], 0.19)
+
+
+    def test_d_dispatcher_runs_in_background(self):
+        email_id, = self.enqueue("a@gmail.com")
+        ses = StubSES()
+        dispatcher = EmailDispatcher(self.session_factory, send_email=ses, poll_interval=0.01)
+
+        async def run():
+            dispatcher.start()
+            self.assertTrue(dispatcher.stats()["running"])
+            for _ in range(100):
+                if dispatcher.stats()["batches"]:
+                    break
+                await asyncio.sleep(0.01)
+            await dispatcher.stop()
+        asyncio.run(run())
+        self.assertEqual("sent", self.get(email_id).status)
+        self.assertFalse(dispatcher.stats()["running"])
+
+
+    def test_e_slow_send_is_not_given_up(self):
+        email_id, = self.enqueue("slow@gmail.com")
+        ses = StubSES()
+        slow_ses = lambda **kwargs: (time.sleep(0.2), ses(**kwargs))[1]
+        dispatcher = EmailDispatcher(self.session_factory, send_email=slow_ses, max_send_rate=1000)
+        # a timed out send would be retried while the first one still delivers
+        with mock.patch.object(io_executor, "timeout", 0.01):
+            self.assertEqual(1, asyncio.run(dispatcher.dispatch_batch()))
+        email = self.get(email_id)
+        self.assertEqual("sent", email.status)
+        self.assertEqual(1, email.attempts)
+        self.assertEqual(1, len(ses.calls))
+
+
+    def test_f_outbox_table_compiles_for_postgres(self):
+        # existing postgres databases get the table from create_all
+        ddl = str(CreateTable(EmailOutbox.__table__).compile(dialect=postgresql.dialect()))
+        self.assertNotIn("datetime(", ddl)
+        self.assertIn("DEFAULT now()", ddl)
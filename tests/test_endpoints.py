@@ -1,52 +1,73 @@
+import asyncio
+import io
+import json
 import os
+import time
 import unittest
 from unittest import mock
 from unittest.mock import MagicMock, patch
 from fastapi import HTTPException
+from jose import jwt
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
-from src.dependecies import get_db
-from datetime import datetime
+from src.dependecies import get_async_db
+from datetime import datetime, timedelta, timezone
+from botocore.response import StreamingBody
+from src.services.auth_utils import create_access_token, token_cache
+from src.services import request_timing
+from src.services.documents_utils import S3FileStream
 from src.services.project_manager_tables import Base
 from src.main import app
 
 
+def stream_of(content: bytes, content_range: str = None,
+              last_modified: datetime = datetime(2024, 5, 4, tzinfo=timezone.utc)):
+    return S3FileStream(body=StreamingBody(io.BytesIO(content), len(content)),
+                        content_length=len(content),
+                        etag='"etag-of-content"',
+                        last_modified=last_modified,
+                        content_range=content_range)
+
 def image_helper():
     m = MagicMock()
     with open("./tests/test_logo.png", "rb") as image:
         content = image.read()
-        m.return_value = content
+        # resized by the lambda after the logo was uploaded
+        m.side_effect = lambda *args, **kwargs: stream_of(content, last_modified=datetime.now(timezone.utc))
     return m
 
-def email_helper():
+def document_helper():
     m = MagicMock()
-    m.return_value = "str-simulating-message-id"
+    m.side_effect = lambda *args, **kwargs: stream_of(bytes("random_string", "utf-8"))
     return m
 
-
 class Test_Endpoints(unittest.TestCase):
     
     @classmethod
     def setUpClass(cls) -> None:
         # create in memory test db
-        engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
+        engine = create_async_engine(
+        "sqlite+aiosqlite://",
         poolclass=StaticPool
         )
-        TestingSessionLocal = sessionmaker(autocommit=False,
-                                   autoflush=False,
-                                   bind=engine)
+        TestingSessionLocal = async_sessionmaker(autoflush=False,
+                                                 bind=engine)
+        # the access log times statements like on the DbConnector engines
+        request_timing.listen(engine.sync_engine)
         # create tables for needed mapped classes
-        Base.metadata.create_all(bind=engine)
+        async def create_tables():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        asyncio.run(create_tables())
         # override the dependency providing db connection
-        app.dependency_overrides[get_db] = lambda: TestingSessionLocal()
+        async def override_get_async_db():
+            async with TestingSessionLocal() as db:
+                yield db
+        app.dependency_overrides[get_async_db] = override_get_async_db
         # patch the function giving db connection to middleware
-        cls.patcher = patch("src.main.get_session")
-        cls.mock_function = cls.patcher.start()
-        cls.mock_function.return_value = TestingSessionLocal()
+        cls.patcher = patch("src.main.get_async_session", new=TestingSessionLocal)
+        cls.patcher.start()
         # create instance of app
         cls.client = TestClient(app)
         # create first user
@@ -74,7 +95,7 @@ class Test_Endpoints(unittest.TestCase):
     def tearDownClass(cls) -> None:
         cls.patcher.stop()
         os.remove("./toy_file.txt")
-        cls.engine.dispose()
+        asyncio.run(cls.engine.dispose())
         return super().tearDownClass()
 
 
@@ -91,6 +112,24 @@ class Test_Endpoints(unittest.TestCase):
         self.assertEqual("No Authorization header", expected_detail)
 
     
+    def test_a2_middleware_token_cache(self):
+        token_cache.clear()
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        with patch("src.main.jwt.decode", wraps=jwt.decode) as decode:
+            self.client.get("/projects", headers=header)
+            self.client.get("/projects", headers=header)
+        # the signature is verified for the first request only
+        self.assertEqual(1, decode.call_count)
+        expired = create_access_token({"sub": "johdoe"}, expires_delta=timedelta(minutes=-1))
+        with self.assertRaises(HTTPException) as ex:
+            self.client.get("/projects", headers={"Authorization": f"bearer {expired}"})
+        self.assertEqual(401, ex.exception.status_code)
+        unknown_user = create_access_token({"sub": "nobody"})
+        with self.assertRaises(HTTPException) as ex:
+            self.client.get("/projects", headers={"Authorization": f"bearer {unknown_user}"})
+        self.assertEqual(401, ex.exception.status_code)
+
+    
     def test_b1_new_user(self):
         sign_up_data = {"username": "jandoe",
                 "full_name": "Jane Doe",
@@ -187,6 +226,30 @@ class Test_Endpoints(unittest.TestCase):
         self.assertIsNotNone(response_payload[0]["created_on"])
 
     
+    def test_e_get_all_paginated(self):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        self.client.post("/projects",
+                         json={"name": "Project 0", "description": "toy description"},
+                         headers=header)
+        response = self.client.get("/projects", params={"limit": 1, "sort": "name"}, headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["Project 0"], [proj["name"] for proj in response.json()])
+        cursor = response.headers["x-next-cursor"]
+        next_page = self.client.get("/projects", params={"limit": 1, "sort": "name", "cursor": cursor},
+                                    headers=header)
+        self.assertEqual(["Project 1"], [proj["name"] for proj in next_page.json()])
+        self.assertNotIn("x-next-cursor", next_page.headers)
+        # without a limit every project is returned on one page
+        unpaginated = self.client.get("/projects", params={"sort": "name"}, headers=header)
+        self.assertEqual(["Project 0", "Project 1"], [proj["name"] for proj in unpaginated.json()])
+        self.assertNotIn("x-next-cursor", unpaginated.headers)
+        # decodes to ["Project 0", "1"], the id isn't an integer
+        invalid_cursor = self.client.get("/projects",
+                                         params={"limit": 1, "sort": "name", "cursor": "WyJQcm9qZWN0IDAiLCAiMSJd"},
+                                         headers=header)
+        self.assertEqual(400, invalid_cursor.status_code)
+
+    
     def test_f_get(self):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.get("/project/1/info", headers=header)
@@ -309,7 +372,7 @@ class Test_Endpoints(unittest.TestCase):
                          response.json())
 
     
-    @mock.patch("src.services.db_project_handler.S3Service.upload_file_to_s3")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
     def test_i_upload_document(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         file_contents = open("./toy_file.txt", "rb")
@@ -344,7 +407,7 @@ class Test_Endpoints(unittest.TestCase):
         self.assertEqual("text/plain", response.json()[0]["content_type"])
 
 
-    @mock.patch("src.services.document_handler.S3Service.download_file_from_s3", return_value=bytes("random_string", "utf-8"))
+    @mock.patch("src.services.documents_utils.S3Service.stream_file", new_callable=document_helper)
     def test_k_download_document(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.get("/document/1", headers=header)
@@ -354,15 +417,51 @@ class Test_Endpoints(unittest.TestCase):
                          response.headers["content-disposition"])
         self.assertEqual("text/plain", response.headers["content-type"])
         self.assertEqual("13", response.headers["content-length"])
+        self.assertEqual("bytes", response.headers["accept-ranges"])
+        self.assertEqual('"etag-of-content"', response.headers["etag"])
+        self.assertEqual("Sat, 04 May 2024 00:00:00 GMT", response.headers["last-modified"])
         self.assertEqual(bytes("random_string", "utf-8"), response.content) 
 
+
+    @mock.patch("src.services.documents_utils.S3Service.stream_file")
+    def test_k_download_document_range(self, result):
+        result.return_value = stream_of(bytes("random", "utf-8"), content_range="bytes 0-5/13")
+        header = {"Authorization": f"bearer {self.jon_jwt}", "Range": "bytes=0-5"}
+        response = self.client.get("/document/1", headers=header)
+        self.assertEqual(206, response.status_code)
+        self.assertEqual("bytes=0-5", result.call_args.kwargs["byte_range"])
+        self.assertEqual("bytes 0-5/13", response.headers["content-range"])
+        self.assertEqual(bytes("random", "utf-8"), response.content)
+
+    
+    @mock.patch("src.services.documents_utils.S3Service.presign_download", return_value="https://signed-url")
+    def test_k_download_document_presigned(self, result):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        response = self.client.get("/document/1?presigned=true", headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("toy_file.txt", result.call_args.kwargs["filename"])
+        self.assertEqual("https://signed-url", response.json()["url"])
+        self.assertEqual("GET", response.json()["method"])
+        self.assertIsNone(response.json()["upload_token"])
+
+
+    def test_k_download_document_schema(self):
+        # file or presigned json, neither is validated against a response model
+        paths = self.client.get("/openapi.json").json()["paths"]
+        for path, media_type in [("/document/{document_id}", "application/octet-stream"),
+                                 ("/project/{project_id}/logo", "image/*")]:
+            content = paths[path]["get"]["responses"]["200"]["content"]
+            self.assertEqual({"application/json", media_type}, set(content))
+            self.assertEqual("#/components/schemas/PresignedTransfer", content["application/json"]["schema"]["$ref"])
+
     
-    @mock.patch("src.services.document_handler.S3Service.upload_file_to_s3")
-    def test_l_update_document(self, result):
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_l_update_document(self, result, delete):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         with open("toy_file_2.txt", 'w') as f:
             pass
-        file_contents = open("./toy_file.txt", "rb")
+        file_contents = io.BytesIO(b"new version")
         doc_file = {"new_document":
                     ("toy_file_2.txt", file_contents, "text/plain")}
         timestamp = datetime.now()
@@ -382,7 +481,7 @@ class Test_Endpoints(unittest.TestCase):
         self.assertEqual("text/plain", response.json()["content_type"])
 
        
-    @mock.patch("src.services.document_handler.S3Service.delete_file_from_s3")
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
     def test_m_delete_document(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.delete("/document/1", headers=header)
@@ -394,7 +493,25 @@ class Test_Endpoints(unittest.TestCase):
                          try_getting_doc.json())
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.upload_file_to_s3")
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
+    def test_m2_upload_documents_batch(self, result):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        doc_files = [("upload_files", (f"file_{i}.txt", io.BytesIO(b"contents"), "text/plain"))
+                     for i in range(4)]
+        response = self.client.post("/project/1/documents:batch",
+                                    headers=header,
+                                    files=doc_files)
+        self.assertEqual(200, response.status_code)
+        # the four files have the same content, which is stored once
+        self.assertEqual(1, result.call_count)
+        self.assertEqual([True] * 4, [res["uploaded"] for res in response.json()])
+        self.assertEqual("file_3.txt", response.json()[3]["document"]["name"])
+        all_docs = self.client.get("/project/1/documents", headers=header)
+        self.assertLessEqual({res["document"]["id"] for res in response.json()},
+                             {doc["id"] for doc in all_docs.json()})
+
+
+    @mock.patch("src.services.documents_utils.S3Service.upload_file")
     def test_n1_upsert_logo(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         file_contents = open("./tests/test_logo.png", "rb")
@@ -429,7 +546,31 @@ class Test_Endpoints(unittest.TestCase):
                          response.json())
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.download_file_from_s3", new_callable=image_helper)
+    @mock.patch("src.services.documents_utils.S3Service.file_exists", return_value=True)
+    @mock.patch("src.services.documents_utils.S3Service.presign_upload",
+                return_value=("https://signed-url", {"Content-Type": "image/png"}))
+    def test_n3_presigned_logo_upload(self, presign, exists):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        response = self.client.post("/project/1/logo/presign",
+                                    headers=header,
+                                    json={"name": "test_logo.png", "content_type": "image/png"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("https://signed-url", response.json()["url"])
+        self.assertEqual({"Content-Type": "image/png"}, response.json()["headers"])
+        completed = self.client.post("/project/1/logo/complete",
+                                     headers=header,
+                                     json={"upload_token": response.json()["upload_token"]})
+        self.assertEqual(200, completed.status_code)
+        self.assertTrue(exists.called)
+        self.assertEqual("test_logo.png", completed.json()["logo_name"])
+        self.assertEqual("johdoe", completed.json()["uploaded_by"])
+        wrong_type = self.client.post("/project/1/logo/presign",
+                                      headers=header,
+                                      json={"name": "toy_file.txt", "content_type": "text/plain"})
+        self.assertEqual(400, wrong_type.status_code)
+
+
+    @mock.patch("src.services.documents_utils.S3Service.stream_file", new_callable=image_helper)
     def test_o_download_logo(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.get("/project/1/logo", headers=header)
@@ -443,9 +584,49 @@ class Test_Endpoints(unittest.TestCase):
         self.assertEqual("application/octet-stream",
                          response.headers["content-type"])
         self.assertEqual(image, response.content)
+        self.assertEqual("private, no-cache", response.headers["cache-control"])
+        etag = response.headers["etag"]
+        # revalidation with the current ETag is answered from the cache
+        not_modified = self.client.get("/project/1/logo",
+                                       headers={**header, "If-None-Match": etag})
+        self.assertEqual(304, not_modified.status_code)
+        self.assertEqual(b"", not_modified.content)
+        self.assertEqual(etag, not_modified.headers["etag"])
+        partial = self.client.get("/project/1/logo", headers={**header, "Range": "bytes=0-7"})
+        self.assertEqual(206, partial.status_code)
+        self.assertEqual(image[:8], partial.content)
+        self.assertEqual(1, result.call_count)
+
+
+    @mock.patch("src.services.documents_utils.S3Service.stream_file")
+    def test_o2_download_logo_rendition(self, result):
+        # avif isn't among the formats written, it is never asked for
+        def rendition(key, byte_range=None):
+            if key != "renditions/project-1-logo-test_logo.png/128.webp":
+                raise FileNotFoundError(key)
+            return stream_of(b"webp-thumbnail", last_modified=datetime.now(timezone.utc))
+        result.side_effect = rendition
+        header = {"Authorization": f"bearer {self.jon_jwt}",
+                  "Accept": "image/avif,image/webp,*/*;q=0.8"}
+        with self.assertLogs("access", level="INFO") as logs:
+            response = self.client.get("/project/1/logo?size=100", headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"webp-thumbnail", response.content)
+        # stream_file is mocked, what is left is reading the rendition for the cache
+        self.assertGreater(json.loads(logs.records[-1].getMessage())["storage_ms"], 0)
+        self.assertEqual("image/webp", response.headers["content-type"])
+        self.assertEqual("attachment;filename=test_logo.webp",
+                         response.headers["content-disposition"])
+        self.assertEqual("Accept", response.headers["vary"])
+        # the webp rendition is cached
+        cached = self.client.get("/project/1/logo?size=128", headers=header)
+        self.assertEqual(b"webp-thumbnail", cached.content)
+        self.assertEqual(1, result.call_count)
+        invalid_size = self.client.get("/project/1/logo?size=0", headers=header)
+        self.assertEqual(422, invalid_size.status_code)
 
 
-    @mock.patch("src.services.db_project_handler.S3Service.delete_file_from_s3")
+    @mock.patch("src.services.documents_utils.S3Service.delete_file")
     def test_p_delete_logo(self, result):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.delete("/project/1/logo", headers=header)
@@ -456,8 +637,7 @@ class Test_Endpoints(unittest.TestCase):
                          try_get_logo.json())
 
 
-    @mock.patch("src.routers.project.projects.SESService.send_email_via_ses", new_callable=email_helper)
-    def test_q1_share_via_email(self, result):
+    def test_q1_share_via_email(self):
         # create new user to invite
         sign_up_data = {"username": "jandoe1",
                         "full_name": "Jane Doe",
@@ -470,12 +650,22 @@ class Test_Endpoints(unittest.TestCase):
                                    params=request_body,
                                    headers=header)
         self.assertEqual(200, response.status_code)
-        self.assertTrue(result.called)
-        self.assertEqual("str-simulating-message-id",
-                         response.json()["aws_message_id"])
+        # the email is only queued, the dispatcher sends it later
+        self.assertEqual("queued", response.json()["status"])
         self.assertIsInstance(response.json()["join_token"], str)
         # save generated token for future use
         self.__class__.join_token = response.json()["join_token"]
+        invite_id = response.json()["invite_id"]
+        status_response = self.client.get(f"/project/1/share/{invite_id}", headers=header)
+        self.assertEqual(200, status_response.status_code)
+        self.assertEqual({"invite_id": invite_id,
+                          "status": "queued",
+                          "attempts": 0,
+                          "sent_on": None,
+                          "aws_message_id": None},
+                         status_response.json())
+        missing_response = self.client.get("/project/1/share/9999", headers=header)
+        self.assertEqual(404, missing_response.status_code)
 
     
     def test_q2_share_via_email_400_fail(self):
@@ -509,6 +699,95 @@ class Test_Endpoints(unittest.TestCase):
         self.assertEqual("jandoe1", response.json()["username"])
 
     
+    def test_s_metrics(self):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        response = self.client.get("/metrics", headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertIn("checkouts", response.json()["db_pool"])
+        self.assertIn("hits", response.json()["privilege_cache"])
+        self.assertIn("avg_wait_ms", response.json()["password_hashing"])
+        self.assertIn("hit_ratio", response.json()["token_cache"])
+        self.assertIn("max_bytes", response.json()["logo_cache"])
+        self.assertIn("in_flight", response.json()["aws_io"])
+        self.assertIn("sent", response.json()["email_outbox"])
+        self.assertIn("logos_per_second", response.json()["logo_resize"])
+
+
+    def test_s2_access_log(self):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        with self.assertLogs("access", level="INFO") as logs:
+            response = self.client.get("/project/1/info", headers=header)
+        self.assertEqual(200, response.status_code)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual("GET", record["method"])
+        self.assertEqual("/project/{project_id}/info", record["route"])
+        self.assertEqual(200, record["status"])
+        self.assertEqual(len(response.content), record["bytes_out"])
+        self.assertEqual(0, record["bytes_in"])
+        self.assertGreaterEqual(record["duration_ms"], record["auth_ms"])
+        self.assertGreater(record["auth_ms"], 0)
+        self.assertGreater(record["db_queries"], 0)
+        self.assertGreater(record["db_ms"], 0)
+        self.assertEqual(0, record["storage_ms"])
+        self.assertEqual(0, record["email_ms"])
+
+
+    def test_s3_access_log_batch_upload(self):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        # the real S3Service sends the files, only the boto3 client is faked
+        s3_client = MagicMock()
+        s3_client.upload_fileobj.side_effect = lambda **kwargs: time.sleep(0.01)
+        doc_files = [("upload_files", (f"timed_{i}.txt", io.BytesIO(f"timed contents {i}".encode()), "text/plain"))
+                     for i in range(3)]
+        with patch("src.services.documents_utils.get_client", return_value=s3_client), \
+                self.assertLogs("access", level="INFO") as logs:
+            response = self.client.post("/project/1/documents:batch", headers=header, files=doc_files)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, s3_client.upload_fileobj.call_count)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual("/project/{project_id}/documents:batch", record["route"])
+        # the uploads ran on io executor threads and are still counted
+        self.assertGreaterEqual(record["storage_ms"], 30)
+        self.assertGreater(record["db_queries"], 0)
+        self.assertGreater(record["bytes_in"], 0)
+
+    
+    def test_t1_batch_create(self):
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        request_body = [{"name": f"Batch project {i}", "description": "toy description"}
+                        for i in range(3)]
+        response = self.client.post("/projects:batch", json=request_body, headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([f"Batch project {i}" for i in range(3)],
+                         [proj["name"] for proj in response.json()])
+        self.assertEqual(["johdoe"], response.json()[0]["contributors"])
+        self.assertIsNotNone(response.json()[0]["created_on"])
+        # the creator owns every new project right away
+        created_id = response.json()[2]["id"]
+        info = self.client.get(f"/project/{created_id}/info", headers=header)
+        self.assertEqual(200, info.status_code)
+        empty = self.client.post("/projects:batch", json=[], headers=header)
+        self.assertEqual(422, empty.status_code)
+
+
+    def test_t2_batch_invite(self):
+        sign_up_data = {"username": "jimdoe",
+                        "full_name": "Jim Doe",
+                        "email": "jimdoe@gmail.com",
+                        "password": "1234"}
+        self.client.post("/auth", data=sign_up_data)
+        header = {"Authorization": f"bearer {self.jon_jwt}"}
+        request_body = [{"name": name} for name in ["jimdoe", "jandoe", "johdoe", "ghost"]]
+        response = self.client.post("/project/1/invite:batch", json=request_body, headers=header)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{"project_id": 1, "username": "jimdoe", "role": "participant"}],
+                         response.json()["granted"])
+        # existing participant, owner and unknown user are left out
+        self.assertEqual(["ghost", "jandoe", "johdoe"], response.json()["skipped"])
+        again = self.client.post("/project/1/invite:batch", json=request_body[:1], headers=header)
+        self.assertEqual([], again.json()["granted"])
+
+
     def test_z_delete_404_fail(self):
         header = {"Authorization": f"bearer {self.jon_jwt}"}
         response = self.client.delete("/project/5999", headers=header)
@@ -3,6 +3,7 @@ from fastapi import HTTPException
 from src.services.auth_utils import write_new_user
 from src.services.invite_utils import decode_join_token, get_user_from_email, create_join_token
 from src.services.project_manager_tables import Base
+from src.services.transfer_utils import create_upload_token, decode_upload_token
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
@@ -54,3 +55,10 @@ class Test_Invite_Utils(unittest.TestCase):
         self.assertEqual("username1", username)
         self.assertEqual(1, project)
         
+
+    def test_d_join_and_upload_tokens_are_not_interchangeable(self):
+        # both carry sub and project, only the key and audience tell them apart
+        upload_token = create_upload_token({"sub": "username1", "project": 1, "kind": "logo"})
+        self.assertRaises(HTTPException, decode_join_token, upload_token, self.session)
+        self.assertRaises(HTTPException, decode_upload_token, self.join_token, "logo", "username1")
+        self.assertEqual(1, decode_upload_token(upload_token, "logo", "username1")["project"])
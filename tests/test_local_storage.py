@@ -0,0 +1,121 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from fastapi import HTTPException
+from src.services.documents_utils import S3Service, parse_byte_range, stream_response
+from src.services.local_storage import LocalStorage
+from src.services.storage_factory import get_storage
+
+
+class Test_Local_Storage(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(os.path.join(self.tmp_dir.name, "bucket"))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def read_stream(self, stream) -> bytes:
+        return b"".join(stream.iter_chunks())
+
+
+    def test_a_upload_and_download(self):
+        self.assertTrue(self.storage.upload_file("key", io.BytesIO(b"contents"), "text/plain"))
+        self.storage.upload_file("other-key", b"bytes", "text/plain")
+        self.assertEqual(b"contents", self.storage.download_file("key"))
+        self.assertEqual(b"bytes", self.storage.download_file("other-key"))
+        self.assertTrue(self.storage.file_exists("key"))
+        self.storage.delete_file("key")
+        self.assertFalse(self.storage.file_exists("key"))
+        # deleting a missing file is not an error
+        self.storage.delete_file("key")
+
+
+    def test_b_stream_and_ranges(self):
+        content = bytes(range(256)) * 1000
+        self.storage.upload_file("key", content, "application/octet-stream")
+        stream = self.storage.stream_file("key")
+        self.assertEqual(len(content), stream.content_length)
+        self.assertIsNone(stream.content_range)
+        self.assertTrue(stream.etag.startswith('"'))
+        self.assertEqual(content, self.read_stream(stream))
+        stream = self.storage.stream_file("key", byte_range="bytes=10-19")
+        self.assertEqual(content[10:20], self.read_stream(stream))
+        self.assertEqual(f"bytes 10-19/{len(content)}", stream.content_range)
+        stream = self.storage.stream_file("key", byte_range="bytes=-5")
+        self.assertEqual(content[-5:], self.read_stream(stream))
+        stream = self.storage.stream_file("key", byte_range="bytes=100-")
+        response = stream_response(stream, "file.bin", "application/octet-stream")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(str(len(content) - 100), response.headers["content-length"])
+        stream.close()
+        with self.assertRaises(HTTPException) as ex:
+            self.storage.stream_file("key", byte_range=f"bytes={len(content)}-")
+        self.assertEqual(416, ex.exception.status_code)
+        self.storage.upload_file("empty", b"", "text/plain")
+        self.assertEqual(b"", self.read_stream(self.storage.stream_file("empty")))
+
+
+    def test_c_parse_byte_range(self):
+        self.assertEqual((0, 10), parse_byte_range("bytes=0-", 10))
+        self.assertEqual((5, 10), parse_byte_range("bytes=5-100", 10))
+        self.assertEqual((0, 10), parse_byte_range("bytes=-100", 10))
+        for byte_range in ["bytes=-0", "bytes=10-", "bytes=5-4", "bytes=-"]:
+            with self.assertRaises(HTTPException):
+                parse_byte_range(byte_range, 10)
+
+
+    def test_d_write_is_atomic(self):
+        self.storage.upload_file("key", b"old version", "text/plain")
+        stream = self.storage.stream_file("key")
+
+        class FailingFile(io.BytesIO):
+            def read(self, *args):
+                raise OSError("connection reset")
+
+        with self.assertRaises(OSError):
+            self.storage.upload_file("key", FailingFile(), "text/plain")
+        # the failed write left neither a partial file nor a temporary one
+        self.assertEqual(b"old version", self.storage.download_file("key"))
+        self.assertEqual(["key"], os.listdir(self.storage.root))
+        # a stream opened before a replace keeps sending the old version
+        self.storage.upload_file("key", b"new version", "text/plain")
+        self.assertEqual(b"old version", self.read_stream(stream))
+        self.assertEqual(b"new version", self.storage.download_file("key"))
+
+
+    def test_e_concurrent_writes(self):
+        versions = [bytes([i]) * 100_000 for i in range(8)]
+        threads = [threading.Thread(target=self.storage.upload_file, args=("key", version, "text/plain"))
+                   for version in versions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the file is one complete version, never a mix
+        self.assertIn(self.storage.download_file("key"), versions)
+
+
+    def test_f_keys_stay_inside_root(self):
+        with self.assertRaises(HTTPException) as ex:
+            self.storage.upload_file("../outside", b"contents", "text/plain")
+        self.assertEqual(400, ex.exception.status_code)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "outside")))
+
+
+    def test_g_presigning_not_supported(self):
+        with self.assertRaises(HTTPException) as ex:
+            self.storage.presign_download("key", "file.txt", 60)
+        self.assertEqual(501, ex.exception.status_code)
+
+
+    def test_h_storage_factory(self):
+        self.assertIsInstance(get_storage("bucket"), S3Service)
+        with mock.patch("src.services.storage_factory.STORAGE_BACKEND", "local"), \
+             mock.patch("src.services.storage_factory.LOCAL_STORAGE_ROOT", self.tmp_dir.name):
+            storage = get_storage("documents")
+        self.assertIsInstance(storage, LocalStorage)
+        self.assertEqual(os.path.join(self.tmp_dir.name, "documents"), storage.root)
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from logging.handlers import QueueHandler, RotatingFileHandler, TimedRotatingFileHandler
+from src.logs.logger import create_file_handler, get_access_logger, get_logger
+
+
+class Test_Logger(unittest.TestCase):
+    def test_a_get_logger_is_idempotent(self):
+        logger = get_logger("test_logger.idempotent")
+        self.assertIs(logger, get_logger("test_logger.idempotent"))
+        self.assertEqual(1, len(logger.handlers))
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+        # all loggers share the one queue
+        self.assertIs(logger.handlers[0], get_logger("test_logger.other").handlers[0])
+
+
+    def test_b_records_reach_the_file(self):
+        get_logger("test_logger.file").info("record written by the listener")
+        deadline = time.monotonic() + 5
+        content = ""
+        while "record written by the listener" not in content and time.monotonic() < deadline:
+            time.sleep(0.01)
+            with open(os.getenv("LOG_FILE_PATH")) as log_file:
+                content = log_file.read()
+        self.assertIn("test_logger.file - INFO - record written by the listener", content)
+
+
+    def test_c_rotation(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = os.path.join(tmp_dir, "app.log")
+            with mock.patch.dict("os.environ", {"LOG_FILE_PATH": log_file, "LOG_MAX_MB": "1"}):
+                handler = create_file_handler()
+            self.assertIsInstance(handler, RotatingFileHandler)
+            self.assertEqual(1024 * 1024, handler.maxBytes)
+            handler.close()
+            with mock.patch.dict("os.environ", {"LOG_FILE_PATH": log_file, "LOG_MAX_MB": "0",
+                                                "LOG_ROTATE_WHEN": "midnight"}):
+                handler = create_file_handler()
+            self.assertIsInstance(handler, TimedRotatingFileHandler)
+            handler.close()
+
+
+    def test_d_access_records_are_json_lines(self):
+        get_access_logger().info(json.dumps({"route": "/test_logger/access"}))
+        deadline = time.monotonic() + 5
+        lines = []
+        while not lines and time.monotonic() < deadline:
+            time.sleep(0.01)
+            with open(os.getenv("LOG_FILE_PATH")) as log_file:
+                lines = [line for line in log_file if "/test_logger/access" in line]
+        self.assertEqual({"route": "/test_logger/access"}, json.loads(lines[-1]))
+        self.assertFalse(get_access_logger().propagate)
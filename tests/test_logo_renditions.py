@@ -0,0 +1,34 @@
+import unittest
+from unittest import mock
+from src.services.logo_renditions import accepted_formats, all_renditions, choose_size, rendition_filename, rendition_key, rendition_media_type
+
+
+class Test_Logo_Renditions(unittest.TestCase):
+    def test_a_choose_size(self):
+        self.assertEqual(64, choose_size(1))
+        self.assertEqual(64, choose_size(64))
+        self.assertEqual(128, choose_size(100))
+        self.assertEqual(400, choose_size(1000))
+        self.assertEqual(400, choose_size(None))
+
+
+    @mock.patch.dict("src.services.logo_renditions.LOGO_FORMATS", {"avif": "image/avif", "webp": "image/webp"}, clear=True)
+    def test_b_accepted_formats(self):
+        self.assertEqual(["avif", "webp"], accepted_formats("image/avif,image/webp,image/apng,*/*;q=0.8"))
+        self.assertEqual(["webp"], accepted_formats("image/webp,*/*"))
+        self.assertEqual(["webp"], accepted_formats("image/avif;q=0, image/webp;q=0.5"))
+        # wildcards don't say anything about avif or webp support
+        self.assertEqual([], accepted_formats("image/*,*/*"))
+        self.assertEqual([], accepted_formats(None))
+
+
+    @mock.patch.dict("src.services.logo_renditions.LOGO_FORMATS", {"avif": "image/avif", "webp": "image/webp"}, clear=True)
+    def test_c_rendition_naming(self):
+        self.assertEqual("renditions/project-1-logo-a.png/64.webp",
+                         rendition_key("project-1-logo-a.png", 64, "webp"))
+        self.assertEqual(9, len(all_renditions()))
+        self.assertEqual("image/webp", rendition_media_type("project-1-logo-a.png", "webp"))
+        self.assertEqual("image/png", rendition_media_type("project-1-logo-a.png", "orig"))
+        self.assertEqual("application/octet-stream", rendition_media_type("project-1-logo-a", "orig"))
+        self.assertEqual("a.avif", rendition_filename("a.png", "image/avif"))
+        self.assertEqual("a.png", rendition_filename("a.png", "image/png"))
@@ -0,0 +1,107 @@
+import asyncio
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from src.services.local_storage import LocalStorage
+from src.services.logo_render import Image, writable_formats
+from src.services.logo_renditions import all_renditions, rendition_key
+from src.services.logo_resize_worker import LogoResizeWorker, render_logo
+
+
+def load_lambda():
+    # the lambda is deployed on its own, it is loaded from its file with
+    # the s3 client it creates on import mocked
+    spec = importlib.util.spec_from_file_location("lambda_function", "./logo-resize/lambda_function.py")
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch("boto3.client"):
+        spec.loader.exec_module(module)
+    return module
+
+
+def render_stub(content: bytes) -> dict:
+    # stands in for render_logo, runs in the worker process
+    return {(size, rendition_format): f"{size}.{rendition_format}:".encode() + content
+            for size, rendition_format in all_renditions()}
+
+
+class Test_Logo_Resize_Worker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        get_storage = lambda bucket: LocalStorage(os.path.join(self.tmp_dir.name, bucket))
+        self.patcher = mock.patch("src.services.logo_resize_worker.get_storage", side_effect=get_storage)
+        self.patcher.start()
+        self.raw = get_storage("raw")
+        self.processed = get_storage("processed")
+
+    def tearDown(self) -> None:
+        self.patcher.stop()
+        self.tmp_dir.cleanup()
+
+
+    def test_a_resize_queued_logos(self):
+        worker = LogoResizeWorker(processes=1, render=render_stub,
+                                  raw_bucket="raw", processed_bucket="processed")
+        # nothing is queued while the worker isn't running
+        self.assertFalse(worker.submit("project-1-logo-a.png"))
+        self.raw.upload_file("project-1-logo-a.png", b"logo-a", "image/png")
+        self.raw.upload_file("project-2-logo-b.png", b"logo-b", "image/png")
+
+        async def scenario():
+            worker.start()
+            self.assertTrue(worker.submit("project-1-logo-a.png"))
+            self.assertTrue(worker.submit("project-2-logo-b.png"))
+            self.assertTrue(worker.submit("project-3-logo-missing.png"))
+            await worker.join()
+            stats = worker.stats()
+            await worker.stop()
+            return stats
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(b"64.webp:logo-a",
+                         self.processed.download_file(rendition_key("project-1-logo-a.png", 64, "webp")))
+        self.assertEqual(b"400.orig:logo-b", self.processed.download_file("project-2-logo-b.png"))
+        self.assertEqual(2, stats["processed"])
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(0, stats["queued"])
+        self.assertGreater(stats["logos_per_second"], 0)
+        self.assertGreaterEqual(stats["max_queue_seconds"], stats["avg_queue_seconds"])
+        self.assertFalse(worker.stats()["running"])
+
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_b_render_logo(self):
+        with open("./tests/test_logo.png", "rb") as image:
+            renditions = render_logo(image.read())
+        self.assertEqual(set(all_renditions()), set(renditions))
+        with Image.open(io.BytesIO(renditions[(64, "orig")])) as thumbnail:
+            self.assertEqual((64, 64), thumbnail.size)
+            self.assertEqual("PNG", thumbnail.format)
+        with Image.open(io.BytesIO(renditions[(128, "webp")])) as thumbnail:
+            self.assertEqual((128, 128), thumbnail.size)
+            self.assertEqual("WEBP", thumbnail.format)
+        self.assertEqual(["webp"], writable_formats(["webp", "bmp2"]))
+
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_c_lambda_writes_same_renditions(self):
+        # large enough for the JPEG draft and reduce() steps to be used
+        output = io.BytesIO()
+        Image.effect_mandelbrot((1600, 1200), (-2, -1.5, 1, 1.5), 50).convert("RGB").save(output, format="JPEG")
+        content = output.getvalue()
+        lambda_function = load_lambda()
+        s3_client = lambda_function.s3_client
+        s3_client.get_object.return_value = {"ContentType": "image/jpeg", "Body": io.BytesIO(content)}
+        lambda_function.lambda_handler({"Records": [{"s3": {"bucket": {"name": lambda_function.RAW_BUCKET},
+                                                            "object": {"key": "project-1-logo-a.jpg"}}}]}, None)
+        written = {call.kwargs["Key"]: call.kwargs["Body"] for call in s3_client.put_object.call_args_list}
+        renditions = render_logo(content)
+        self.assertEqual({rendition_key("project-1-logo-a.jpg", size, rendition_format)
+                          for size, rendition_format in renditions} | {"project-1-logo-a.jpg"}, set(written))
+        for (size, rendition_format), rendition in renditions.items():
+            # a diff of the image bytes wouldn't help, only the rendition is named
+            self.assertTrue(rendition == written[rendition_key("project-1-logo-a.jpg", size, rendition_format)],
+                            f"{size}.{rendition_format} differs")
+        self.assertEqual(renditions[(400, "orig")], written["project-1-logo-a.jpg"])
@@ -0,0 +1,42 @@
+import unittest
+from sqlalchemy import create_engine, text
+from src.services import request_timing
+from src.services.request_timing import RequestTimings, request_timings, timed
+
+
+@timed("storage")
+def storage_call(value):
+    return value
+
+
+class Test_Request_Timing(unittest.TestCase):
+    def test_a_timed_calls(self):
+        # nothing is recorded outside of a request
+        self.assertEqual(1, storage_call(1))
+        timings = RequestTimings()
+        context_token = request_timings.set(timings)
+        try:
+            self.assertEqual(2, storage_call(2))
+        finally:
+            request_timings.reset(context_token)
+        self.assertGreater(timings.storage_seconds, 0)
+        self.assertEqual(0, timings.email_seconds)
+
+
+    def test_b_engine_events(self):
+        engine = create_engine("sqlite://")
+        request_timing.listen(engine)
+        timings = RequestTimings()
+        context_token = request_timings.set(timings)
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("select 1"))
+                conn.execute(text("select 2"))
+                self.assertRaises(Exception, conn.execute, text("select * from missing_table"))
+        finally:
+            request_timings.reset(context_token)
+        self.assertEqual(2, timings.db_queries)
+        self.assertGreater(timings.db_seconds, 0)
+        with engine.connect() as conn:
+            # the failed statement didn't leave a start time behind
+            self.assertEqual([], conn.info.get("query_started", []))
@@ -1,9 +1,72 @@
+import io
 import unittest
-from src.services.documents_utils import S3Service
-from boto3.resources.factory import ServiceResource
+from unittest import mock
+from src.services.aws_utils import get_client
+from src.services.documents_utils import MB, S3Service, get_transfer_config
+from botocore.exceptions import ClientError
 
 class Test_S3Service(unittest.TestCase):
     def test_constructor(self):
         s3_service = S3Service("test-bucket-name")
         self.assertEqual("test-bucket-name", s3_service.bucket_name)
-        self.assertIsInstance(s3_service.s3, ServiceResource)
\ No newline at end of file
+        # every service shares the same client
+        self.assertIs(get_client("s3"), s3_service.s3)
+        self.assertIs(s3_service.s3, S3Service("other-bucket-name").s3)
+
+    def test_upload_streams_file_object(self):
+        s3_service = S3Service("test-bucket-name")
+        s3_service.s3 = mock.MagicMock()
+        file_obj = io.BytesIO(b"contents")
+        s3_service.upload_file(key="key", bin_file=file_obj, content_type="text/plain")
+        upload = s3_service.s3.upload_fileobj
+        upload.assert_called_once()
+        # the file object itself is handed to the managed transfer, not its bytes
+        self.assertIs(file_obj, upload.call_args.kwargs["Fileobj"])
+        self.assertEqual("test-bucket-name", upload.call_args.kwargs["Bucket"])
+        self.assertEqual("text/plain", upload.call_args.kwargs["ExtraArgs"]["ContentType"])
+
+    def test_upload_wraps_bytes(self):
+        s3_service = S3Service("test-bucket-name")
+        s3_service.s3 = mock.MagicMock()
+        s3_service.upload_file(key="key", bin_file=b"contents", content_type="text/plain")
+        upload = s3_service.s3.upload_fileobj
+        self.assertEqual(b"contents", upload.call_args.kwargs["Fileobj"].read())
+
+    @mock.patch.dict("os.environ", {"S3_MULTIPART_PART_SIZE_MB": "16", "S3_MULTIPART_CONCURRENCY": "2"})
+    def test_transfer_config(self):
+        config = get_transfer_config()
+        self.assertEqual(16 * MB, config.multipart_chunksize)
+        self.assertEqual(2, config.max_concurrency)
+
+    def test_presign_upload_signs_content_type(self):
+        s3_service = S3Service("test-bucket-name")
+        s3_service.s3 = mock.MagicMock()
+        sign = s3_service.s3.generate_presigned_url
+        sign.return_value = "https://signed-url"
+        url, headers = s3_service.presign_upload(key="key", content_type="text/plain", expires_in=60)
+        self.assertEqual("https://signed-url", url)
+        self.assertEqual("put_object", sign.call_args.args[0])
+        self.assertEqual("text/plain", sign.call_args.kwargs["Params"]["ContentType"])
+        self.assertEqual(60, sign.call_args.kwargs["ExpiresIn"])
+        self.assertEqual({"Content-Type": "text/plain",
+                          "x-amz-meta-content-type": "text/plain"}, headers)
+
+    def test_file_exists_in_s3(self):
+        s3_service = S3Service("test-bucket-name")
+        s3_service.s3 = mock.MagicMock()
+        self.assertTrue(s3_service.file_exists("key"))
+        s3_service.s3.head_object.side_effect = ClientError(
+            {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        self.assertFalse(s3_service.file_exists("key"))
+
+    def test_stream_missing_file(self):
+        s3_service = S3Service("test-bucket-name")
+        s3_service.s3 = mock.MagicMock()
+        # without s3:ListBucket a missing key is reported as AccessDenied
+        for code in ["NoSuchKey", "AccessDenied"]:
+            s3_service.s3.get_object.side_effect = ClientError(
+                {"Error": {"Code": code, "Message": "missing"}}, "GetObject")
+            self.assertRaises(FileNotFoundError, s3_service.stream_file, "key")
+        s3_service.s3.get_object.side_effect = ClientError(
+            {"Error": {"Code": "SlowDown", "Message": "Reduce your request rate"}}, "GetObject")
+        self.assertRaises(ClientError, s3_service.stream_file, "key")